@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Run the benchmarks of ``benchmarks/suite.py`` on a test database and save
+the results in ``benchmarks/results/``, to compare them between releases.
+
+    $ python benchmarks/run.py --rows 100000
+    $ python benchmarks/run.py --compare benchmarks/results/0.1.3-sqlite.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import timeit
+import tracemalloc
+
+import django
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS = os.path.join(ROOT, "benchmarks", "results")
+
+
+def measure(run, repeat):
+    """
+    Get the min and median seconds of a call of ``run``, and the peak of
+    memory allocated by a call.
+    """
+    timer = timeit.Timer(run)
+    number, _ = timer.autorange()
+    times = [elapsed / number for elapsed in timer.repeat(repeat, number)]
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"min": min(times), "median": statistics.median(times), "number": number, "peak_memory": peak}
+
+
+def run_benchmark(func, args, repeat):
+    benchmark = func(*args)
+    try:
+        return measure(next(benchmark), repeat)
+    except Exception as err:
+        return {"error": f"{type(err).__name__}: {err}"}
+    finally:
+        benchmark.close()
+
+
+def report(name, result):
+    if "error" in result:
+        print(f"{name:40} {result['error']}")
+    else:
+        print(f"{name:40} {result['min'] * 1000:12.3f} ms {result['peak_memory'] / 1024:12.1f} KiB")
+
+
+def run_all(options):
+    from suite import BENCHMARKS, populate
+
+    selected = [
+        (name, sized, func)
+        for name, sized, func in BENCHMARKS
+        if not options.benchmarks or any(pattern in name for pattern in options.benchmarks)
+    ]
+    results = {}
+    for name, sized, func in selected:
+        if not sized:
+            results[name] = run_benchmark(func, (), options.repeat)
+            report(name, results[name])
+    for rows in sorted(options.rows):
+        if any(sized for name, sized, func in selected):
+            populate(rows)
+        for name, sized, func in selected:
+            if sized:
+                key = f"{name}[{rows}]"
+                results[key] = run_benchmark(func, (rows,), options.repeat)
+                report(key, results[key])
+    return results
+
+
+def compare(results, path, threshold):
+    """
+    Print the changes against the results saved in ``path``, and return the
+    benchmarks slower than ``threshold`` times.
+    """
+    with open(path) as fp:
+        previous = json.load(fp)["benchmarks"]
+    regressions = []
+    print(f"\nCompared to {path}:")
+    for name, result in results.items():
+        old = previous.get(name, {})
+        if "min" not in result or "min" not in old:
+            continue
+        ratio = result["min"] / old["min"]
+        flag = " REGRESSION" if ratio > threshold else ""
+        print(f"{name:40} {old['min'] * 1000:12.3f} ms {result['min'] * 1000:12.3f} ms {ratio:8.2f}x{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the django-site-metrics benchmarks.")
+    parser.add_argument("benchmarks", nargs="*", help="Run only the benchmarks whose name contains one of these.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10**5, 10**6, 10**7])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Results file, by default benchmarks/results/<version>-<database>.json.")
+    parser.add_argument("--compare", help="Results file to compare with.")
+    parser.add_argument("--threshold", type=float, default=1.2, help="Slowdown ratio reported as a regression.")
+    options = parser.parse_args(argv)
+
+    sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tests.test_settings")
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_databases, setup_test_environment, teardown_databases
+
+    import metrics
+
+    setup_test_environment()
+    databases = setup_databases(verbosity=0, interactive=False, aliases={"default"})
+    try:
+        results = run_all(options)
+    finally:
+        teardown_databases(databases, verbosity=0)
+
+    output = options.output or os.path.join(RESULTS, f"{metrics.__version__}-{connection.vendor}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as fp:
+        data = {
+            "version": metrics.__version__,
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "machine": platform.platform(),
+            "benchmarks": results,
+        }
+        json.dump(data, fp, indent=2, sort_keys=True)
+    print(f"\nSaved to {output}")
+
+    if options.compare and compare(results, options.compare, options.threshold):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
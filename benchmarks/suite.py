@@ -0,0 +1,237 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Benchmarks of the request capture, the writes and the overview queries.
+
+Each benchmark is a generator doing its setup and yielding the callable to
+time, and cleaning up once resumed. The sized ones take the number of rows,
+and are run once the requests table holds each of the ``--rows`` sizes.
+"""
+
+from datetime import timedelta
+from importlib import import_module
+from unittest import mock
+
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.utils import timezone
+
+from metrics import generator, plugins
+from metrics.middleware import RequestMiddleware
+from metrics.models import Request
+from metrics.traffic import Error, Error404, modules
+from metrics.utils import browsers, engines
+
+BENCHMARKS = []
+
+ERROR_INDEXES = import_module("metrics.migrations.0017_request_error_indexes")
+
+USER_AGENTS = [user_agent for weight, user_agent in generator.USER_AGENTS]
+REFERERS = (
+    "",
+    "",
+    "https://www.google.com/search?q=django+site+metrics",
+    "https://www.bing.com/search?q=request+analytics",
+    "https://search.yahoo.com/search?p=django",
+    "https://news.ycombinator.com/",
+    "https://example.com/blog/",
+)
+
+
+def benchmark(sized=False):
+    """
+    Register a benchmark; ``sized`` ones take the number of rows.
+    """
+
+    def decorator(func):
+        BENCHMARKS.append((func.__name__, sized, func))
+        return func
+
+    return decorator
+
+
+def populate(rows, seed=0):
+    """
+    Add generated requests until the table holds ``rows`` of them.
+    """
+    missing = rows - Request.objects.count()
+    if missing > 0:
+        generator.generate_requests(missing, seed=seed + rows, days=60)
+
+
+def http_request():
+    request = RequestFactory().get(
+        "/page/1/?q=foo",
+        HTTP_USER_AGENT=USER_AGENTS[0],
+        HTTP_REFERER=REFERERS[2],
+        HTTP_ACCEPT_LANGUAGE="en-US,en;q=0.9",
+    )
+    request.user = None
+    return request
+
+
+@benchmark()
+def middleware_overhead():
+    # Only counted in-process, nothing is written.
+    middleware = RequestMiddleware(lambda request: HttpResponse())
+    request, response = http_request(), HttpResponse()
+
+    def run():
+        middleware.process_request(request)
+        middleware.process_response(request, response)
+
+    with mock.patch("metrics.settings.ONLY_ERRORS", True):
+        yield run
+
+
+@benchmark()
+def middleware_save():
+    middleware = RequestMiddleware(lambda request: HttpResponse())
+    request, response = http_request(), HttpResponse()
+
+    def run():
+        with transaction.atomic():
+            middleware.process_request(request)
+            middleware.process_response(request, response)
+            transaction.set_rollback(True)
+
+    with mock.patch("metrics.settings.ONLY_ERRORS", False):
+        yield run
+
+
+@benchmark()
+def from_http_request():
+    request, response = http_request(), HttpResponse()
+    yield lambda: Request().from_http_request(request, response, commit=False)
+
+
+@benchmark()
+def browsers_resolve():
+    yield lambda: [browsers.resolve(user_agent) for user_agent in USER_AGENTS]
+
+
+@benchmark()
+def engines_resolve():
+    yield lambda: [engines.resolve(referer) for referer in REFERERS]
+
+
+def rolled_back(insert, count=1000):
+    requests = list(generator.TrafficGenerator().requests(count))
+
+    def run():
+        with transaction.atomic():
+            insert(requests)
+            transaction.set_rollback(True)
+
+    return run
+
+
+@benchmark()
+def bulk_create_1000():
+    yield rolled_back(Request.objects.bulk_create)
+
+
+@benchmark()
+def bulk_insert_1000():
+    # COPY on PostgreSQL.
+    yield rolled_back(Request.objects.bulk_insert)
+
+
+def month():
+    now = timezone.now()
+    return Request.objects.between(now - timedelta(days=30), now + timedelta(seconds=1))
+
+
+def plugin_benchmark(plugin_class):
+    def setup(rows):
+        plugin = plugin_class()
+        plugin.qs = month()
+        yield plugin.render
+
+    setup.__name__ = plugin_class.__name__
+    return setup
+
+
+for plugin_class in (
+    plugins.LatestRequests,
+    plugins.TrafficInformation,
+    plugins.TopPaths,
+    plugins.TopErrorPaths,
+    plugins.TopReferrers,
+    plugins.TopSearchPhrases,
+    plugins.TopBrowsers,
+):
+    benchmark(sized=True)(plugin_benchmark(plugin_class))
+
+
+@benchmark(sized=True)
+def modules_table(rows):
+    yield lambda: modules.table([month()])
+
+
+@benchmark(sized=True)
+def modules_graph(rows):
+    now = timezone.now()
+    days = [now - timedelta(days=day) for day in range(0, 31, 2)]
+    yield lambda: modules.graph(
+        [(day, Request.objects.between(day - timedelta(days=1), day).order_by("timestamp")) for day in days]
+    )
+
+
+def error_queries():
+    qs = month()
+    plugin = plugins.TopErrorPaths()
+    plugin.qs = qs
+
+    def run():
+        Error().count(qs)
+        Error404().count(qs)
+        plugin.render()
+        Request.objects.errors().top("path")
+
+    return run
+
+
+@benchmark(sized=True)
+def error_queries_unindexed(rows):
+    # The indexes are dropped in a transaction, rolled back when the
+    # benchmark is closed: the migration may have created them.
+    with transaction.atomic(), connection.cursor() as cursor:
+        for name in ERROR_INDEXES.ERROR_INDEXES:
+            cursor.execute(f"DROP INDEX IF EXISTS {name}")
+        yield error_queries()
+
+
+@benchmark(sized=True)
+def error_queries_indexed(rows):
+    # As METRICS_ERROR_INDEXES would create them, rolled back when the
+    # benchmark is closed.
+    with transaction.atomic(), connection.cursor() as cursor:
+        for name, column in ERROR_INDEXES.ERROR_INDEXES.items():
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {name} ON metrics_request ({column}) WHERE {ERROR_INDEXES.ERROR_CONDITION}"
+            )
+        cursor.execute("ANALYZE metrics_request")
+        yield error_queries()
@@ -21,33 +21,147 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+from calendar import timegm
+import copy
 from datetime import timedelta
 from functools import update_wrapper
+import hashlib
 import json
+import os
 from urllib.parse import urlencode
 
 from django.contrib import admin
 from django.contrib.admin import widgets
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ALL_VAR, ChangeList, ORDER_VAR, PAGE_VAR
 from django.contrib.auth import get_user_model
-from django.http import HttpResponse
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Max, Q
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.urls import path
-from django.utils import timezone
+from django.utils import timezone, translation
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_date, parse_datetime
 from django.utils.html import format_html
+from django.utils.http import http_date, quote_etag
 from django.utils.text import Truncator
 from django.utils.translation import gettext_lazy as _
 
+from . import live, recent, settings
+from .analytics import load_frame
+from .archive import day_range, local_date
 from .fields import StringField
+from .indexes import has_trigram_indexes
+from .interning import NORMALIZED_FIELDS
+from .managers import string_lookup
 from .models import Request
-from .plugins import plugins
+from .paginator import EstimatedCountPaginator
+from .plugins import plugins, renderer
 from .serializers import JSONEncoder
 from .traffic import modules
+from .utils import PERIODS
 
 User = get_user_model()
 
+# Keyset pagination cursors
+AFTER_VAR = "after"
+BEFORE_VAR = "before"
+
+# Cache lifetime of the traffic graphs ending before today, which still change
+# when old requests are purged, archived or classified.
+PAST_TRAFFIC_MAX_AGE = 5 * 60
+
+# Columns loaded only when they are shown in the changelist
+DEFERRED_FIELDS = ("headers", "query_string", "full_path", "referer", "user_agent", "language")
+
+
+def encode_cursor(obj):
+    timestamp = obj.timestamp
+    if timezone.is_aware(timestamp):
+        timestamp = timestamp.astimezone(timezone.utc)
+    return f"{timestamp.isoformat()}_{obj.pk}"
+
+
+def decode_cursor(value):
+    timestamp, sep, pk = value.rpartition("_")
+    try:
+        timestamp, pk = parse_datetime(timestamp), int(pk)
+    except ValueError:
+        timestamp = None
+    if timestamp is None:
+        raise IncorrectLookupParameters(f"Invalid cursor {value!r}")
+    return timestamp, pk
+
+
+class RequestChangeList(ChangeList):
+    def __init__(self, request, *args, **kwargs):
+        # Seek pagination works only on the default (timestamp, id) ordering.
+        self.keyset = settings.ADMIN_KEYSET_PAGINATION and not (ORDER_VAR in request.GET or ALL_VAR in request.GET)
+        self.keyset_previous_url = self.keyset_next_url = None
+        super().__init__(request, *args, **kwargs)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(AFTER_VAR, None)
+        lookup_params.pop(BEFORE_VAR, None)
+        return lookup_params
+
+    def get_queryset(self, request):
+        deferred = [name for name in DEFERRED_FIELDS if name not in self.list_display]
+        deferred += [f"{name}_term" for name in deferred if name in NORMALIZED_FIELDS]
+        if "headers" in deferred:
+            deferred.append("header_set")
+        return super().get_queryset(request).defer(*deferred)
+
+    def get_results(self, request):
+        self.root_queryset = self.root_queryset.estimated()
+        super().get_results(request)
+        self.result_count_is_estimated = self.paginator.is_estimated
+        self.full_result_count_is_estimated = self.root_queryset.count_is_estimated
+        if self.keyset:
+            self.get_keyset_results(request)
+
+    def get_keyset_results(self, request):
+        """
+        Fetch the page following (``?after=``) or preceding (``?before=``) a
+        cursor row with an index range on ``(timestamp, id)``, instead of an
+        ``OFFSET`` which reads and discards all the previous rows.
+        """
+        after, before = self.params.get(AFTER_VAR), self.params.get(BEFORE_VAR)
+        qs = self.queryset
+        if before:
+            timestamp, pk = decode_cursor(before)
+            qs = qs.filter(timestamp__gte=timestamp).exclude(timestamp=timestamp, pk__lte=pk)
+            qs = qs.order_by("timestamp", "pk")
+        elif after:
+            timestamp, pk = decode_cursor(after)
+            qs = qs.filter(timestamp__lte=timestamp).exclude(timestamp=timestamp, pk__gte=pk)
+            qs = qs.order_by("-timestamp", "-pk")
+        else:
+            qs = qs.order_by("-timestamp", "-pk")
+        # One more row tells whether there is another page.
+        results = list(qs[: self.list_per_page + 1])
+        has_more = len(results) > self.list_per_page
+        results = results[: self.list_per_page]
+        if before:
+            results.reverse()
+        self.result_list = results
+        if results:
+            if has_more or before:
+                self.keyset_next_url = self.get_query_string(
+                    {AFTER_VAR: encode_cursor(results[-1])}, [BEFORE_VAR, PAGE_VAR]
+                )
+            if after or (before and has_more):
+                self.keyset_previous_url = self.get_query_string(
+                    {BEFORE_VAR: encode_cursor(results[0])}, [AFTER_VAR, PAGE_VAR]
+                )
+
 
 @admin.register(Request)
 class RequestAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
     formfield_overrides = {
         StringField: {"widget": widgets.AdminTextInputWidget},
     }
@@ -60,7 +174,7 @@ class RequestAdmin(admin.ModelAdmin):
         (_("Response"), {"fields": ("status_code",)}),
         (_("User info"), {"fields": ("referer", "user_agent", "ip", "_user", "language")}),
     )
-    ordering = ["-timestamp"]
+    ordering = ["-timestamp", "-id"]
     readonly_fields = (
         "method",
         "path",
@@ -77,6 +191,24 @@ class RequestAdmin(admin.ModelAdmin):
         "language",
     )
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_users()
+
+    def has_trigram_indexes(self):
+        # The setting may have been enabled after migrating, without creating
+        # the indexes (see the indexrequests command).
+        return settings.TRIGRAM_INDEXES and has_trigram_indexes(Request.objects.db)
+
+    def get_search_fields(self, request):
+        # Substring searches scan the whole table without the trigram indexes.
+        if settings.NORMALIZE_STRINGS or self.has_trigram_indexes():
+            # The term tables are small enough to be searched without indexes.
+            return tuple(string_lookup(field) for field in ("path", "referer", "user_agent"))
+        return super().get_search_fields(request)
+
+    def get_changelist(self, request, **kwargs):
+        return RequestChangeList
+
     def lookup_allowed(self, key, value):
         return key == "user__%s" % User.USERNAME_FIELD or super().lookup_allowed(key, value)
 
@@ -84,7 +216,11 @@ class RequestAdmin(admin.ModelAdmin):
         return json.dumps(obj.query_string, cls=JSONEncoder, indent=2)
 
     def _path(self, obj):
-        url = urlencode({"path": obj.path})
+        if obj.path_term_id:
+            url = urlencode({"path_term": obj.path_term_id})
+        else:
+            # The trigram indexes are on UPPER(path), they serve iexact from PostgreSQL 14.
+            url = urlencode({"path__iexact" if self.has_trigram_indexes() else "path": obj.path})
         path = Truncator(obj.path).chars(72)
         return format_html(f"""<a href="?{url}" title="{path}">{path}</a>""")
 
@@ -98,8 +234,8 @@ class RequestAdmin(admin.ModelAdmin):
         return f"{user.get_username()} [{user.pk}]" if user else ""
 
     def request_from(self, obj):
-        if obj.user_id:
-            user = obj.user
+        user = obj.user
+        if user:
             field = User.USERNAME_FIELD
             username = Truncator(user.get_username()).chars(35)
             title = _("Show only requests from this user.")
@@ -121,20 +257,119 @@ class RequestAdmin(admin.ModelAdmin):
         return [
             path("overview/", wrap(self.overview), name="{0}_{1}_overview".format(*info)),
             path("overview/traffic/", wrap(self.traffic), name="{0}_{1}_traffic".format(*info)),
+            path("overview/plugins/<str:name>/", wrap(self.plugin), name="{0}_{1}_plugin".format(*info)),
+            path("overview/live/", wrap(self.live), name="{0}_{1}_live".format(*info)),
+            path("overview/recent/", wrap(self.recent), name="{0}_{1}_recent".format(*info)),
         ] + super().get_urls()
 
+    def plugin_queryset(self, period="month"):
+        """
+        Get the requests of the current ``period`` shown by the plugins, and
+        their frame with the "memory" ``settings.OVERVIEW_BACKEND``.
+        """
+        qs = Request.objects.period(period)
+        if settings.OVERVIEW_BACKEND == "memory":
+            return qs, load_frame(qs)
+        return qs.order_by("timestamp"), None
+
     def overview(self, request):
-        qs = Request.objects.this_month().order_by("timestamp")
-        for plugin in plugins.plugins:
-            plugin.qs = qs
+        frame = None
+        if settings.LAZY_PLUGINS:
+            # The page loads the plugins from self.plugin().
+            fragments = [(plugin, None) for plugin in plugins.plugins]
+        else:
+            qs, frame = self.plugin_queryset()
+            # Copied, the plugins are shared by the concurrent requests.
+            page_plugins = [copy.copy(plugin) for plugin in plugins.plugins]
+            for plugin in page_plugins:
+                plugin.qs = qs
+                plugin.frame = frame
+            fragments = list(zip(page_plugins, renderer.render(page_plugins)))
 
         return render(
             request,
             "admin/metrics/request/overview.html",
-            {"title": _("Request overview"), "plugins": plugins.plugins},
+            {
+                "title": _("Request overview"),
+                "plugins": plugins.plugins,
+                "fragments": fragments,
+                "frame": frame,
+            },
         )
 
-    def traffic(self, request):
+    def plugin(self, request, name):
+        """
+        Render a single plugin for the current ``?period=`` (``month`` by
+        default), as HTML or, with ``?format=json``, wrapped in JSON.
+        """
+        try:
+            # Copied, the plugins are shared by the concurrent requests.
+            plugin = copy.copy(plugins.get(name))
+        except KeyError:
+            raise Http404(f"No plugin {name!r}")
+        period = request.GET.get("period", "month")
+        if period not in PERIODS:
+            period = "month"
+
+        start, end = Request.objects.period(period).archive_range
+        key = f"metrics:plugin:{name}:{translation.get_language()}:{start.isoformat()}:{end.isoformat()}"
+        html = cache.get(key) if settings.PLUGIN_CACHE_TIMEOUT else None
+        if html is None:
+            plugin.qs, plugin.frame = self.plugin_queryset(period)
+            html = plugin.render()
+            if settings.PLUGIN_CACHE_TIMEOUT:
+                cache.set(key, html, settings.PLUGIN_CACHE_TIMEOUT)
+
+        if request.GET.get("format") == "json":
+            return JsonResponse(
+                {
+                    "name": name,
+                    "verbose_name": str(plugin.verbose_name),
+                    "start": start,
+                    "end": end,
+                    "html": html,
+                },
+                encoder=JSONEncoder,
+            )
+        return HttpResponse(html)
+
+    def live(self, request):
+        """
+        Stream the requests saved by all the processes as server-sent events,
+        each a JSON array of rows (see ``metrics.live.publish()``).
+        """
+        if not settings.LIVE_FEED or connection.vendor != "postgresql":
+            raise Http404("The live feed is disabled")
+        response = StreamingHttpResponse(live.events(live.listener.subscribe()), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        # Don't let nginx buffer the events.
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    def recent(self, request):
+        """
+        Show the requests captured by the process serving the page, newest
+        first, without querying the database.
+        """
+        if not settings.RECENT_REQUESTS:
+            raise Http404("The recent requests are not captured")
+        return render(
+            request,
+            "admin/metrics/request/recent.html",
+            {
+                "title": _("Recent requests of process %(pid)s") % {"pid": os.getpid()},
+                "records": [
+                    (record, recent.to_datetime(record.timestamp))
+                    for record in reversed(recent.buffer.records(limit=settings.RECENT_REQUESTS))
+                ],
+            },
+        )
+
+    def traffic_days(self, request):
+        """
+        Get the days of the traffic graph: the ``?days=`` (30 by default)
+        before ``?end=`` (today by default), every one or more days.
+        """
         try:
             days_count = int(request.GET.get("days", 30))
         except ValueError:
@@ -147,7 +382,70 @@ class RequestAdmin(admin.ModelAdmin):
         else:
             days_step = 30
 
-        days = [timezone.now().today() - timedelta(day) for day in range(0, days_count + 1, days_step)]
-        days_qs = [(day, Request.objects.day(date=day).order_by("timestamp")) for day in days]
-        dump = json.dumps(modules.graph(days_qs), cls=JSONEncoder, indent=2)
-        return HttpResponse(dump, content_type="text/javascript")
+        today = local_date(timezone.now())
+        try:
+            end = min(parse_date(request.GET.get("end", "")) or today, today)
+        except ValueError:
+            end = today
+        return [end - timedelta(day) for day in range(0, days_count + 1, days_step)]
+
+    def traffic_validators(self, days, layout):
+        """
+        Get the ETag and the last modification time of the traffic graph of
+        ``days``. A graph ending before today changes with the requests of its
+        range, the others with the latest request.
+        """
+        end = max(days)
+        key = [
+            min(days),
+            end,
+            len(days),
+            layout,
+            translation.get_language(),
+            timezone.get_current_timezone_name(),
+            settings.OVERVIEW_BACKEND,
+            settings.TRAFFIC_MODULES,
+            settings.TRAFFIC_HUMANS_ONLY,
+        ]
+        if end < local_date(timezone.now()):
+            last_modified = day_range(end)[1]
+            # Cheaper than the graph, with the index on the timestamp.
+            requests = Request.objects.filter(timestamp__gte=day_range(min(days))[0], timestamp__lt=last_modified)
+            key.extend(
+                requests.aggregate(count=Count("id"), bots=Count("id", filter=Q(is_bot=True)), last=Max("id")).values()
+            )
+        else:
+            latest_id, last_modified = Request.objects.order_by("-id").values_list("id", "timestamp").first() or (
+                0,
+                None,
+            )
+            key.append(latest_id)
+        etag = quote_etag(hashlib.md5(":".join(map(str, key)).encode()).hexdigest())
+        return etag, last_modified and timegm(last_modified.utctimetuple())
+
+    def traffic(self, request):
+        days = self.traffic_days(request)
+        layout = "columnar" if request.GET.get("layout") == "columnar" else "series"
+        etag, last_modified = self.traffic_validators(days, layout)
+        # A 304 when the browser has the current graph, without counting.
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            if settings.OVERVIEW_BACKEND == "memory":
+                # A single query for the whole range, sliced by day in memory.
+                qs = Request.objects.between(day_range(min(days))[0], day_range(max(days))[1])
+                frame = load_frame(qs, modules.frame_columns)
+                days_qs = [(day, frame.between(*day_range(day))) for day in days]
+            else:
+                days_qs = [(day, Request.objects.day(date=day).order_by("timestamp")) for day in days]
+            data = modules.columns(days_qs) if layout == "columnar" else modules.graph(days_qs)
+            dump = json.dumps(data, cls=JSONEncoder, separators=(",", ":"))
+            response = HttpResponse(dump, content_type="application/json")
+
+        response["ETag"] = etag
+        if last_modified:
+            response["Last-Modified"] = http_date(last_modified)
+        if max(days) < local_date(timezone.now()):
+            patch_cache_control(response, private=True, max_age=PAST_TRAFFIC_MAX_AGE)
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
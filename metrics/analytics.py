@@ -0,0 +1,244 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import sys
+
+from django.core.exceptions import ImproperlyConfigured
+
+from . import settings
+from .archive import load_archived, pa, to_utc
+from .interning import interner, NORMALIZED_FIELDS
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Columns of a Frame, strings are dictionary encoded.
+COLUMNS = (
+    "timestamp",
+    "status_code",
+    "method",
+    "path",
+    "is_secure",
+    "ip",
+    "user_id",
+    "referer",
+    "user_agent",
+    "language",
+)
+STRING_COLUMNS = ("method", "path", "ip", "referer", "user_agent", "language")
+DTYPES = {
+    "timestamp": "int64",  # microseconds since the epoch, UTC (local time without USE_TZ)
+    "status_code": "int16",
+    "is_secure": "bool",
+    "user_id": "int64",
+}
+# user_id of the anonymous requests.
+NO_USER = -1
+
+
+def to_microseconds(values):
+    """
+    Convert the datetimes ``values`` to an array of microseconds since the
+    epoch, as stored in ``Frame.arrays["timestamp"]``.
+    """
+    return np.array([to_utc(value) for value in values], dtype="datetime64[us]").astype(np.int64)
+
+
+class Frame:
+    """
+    Requests held in memory as column arrays, sorted by timestamp.
+
+    Strings are dictionary encoded: ``arrays[name]`` holds the indexes of
+    the values in ``dictionaries[name]``, so that grouping and filtering work
+    on small integers, and predicates on strings are evaluated once per
+    distinct value.
+    """
+
+    def __init__(self, arrays, dictionaries=None):
+        self.arrays = arrays
+        self.dictionaries = dictionaries or {}
+
+    @classmethod
+    def from_columns(cls, columns):
+        """
+        Build a frame from lists of values, by column name.
+        """
+        arrays, dictionaries = {}, {}
+        for name, values in columns.items():
+            if name in STRING_COLUMNS:
+                values = np.array([value or "" for value in values], dtype=object)
+                dictionary, codes = np.unique(values, return_inverse=True)
+                arrays[name], dictionaries[name] = codes.astype(np.int32), dictionary.astype(object)
+            elif name == "timestamp":
+                arrays[name] = to_microseconds(values)
+            elif name == "user_id":
+                arrays[name] = np.array([NO_USER if value is None else value for value in values], dtype=np.int64)
+            else:
+                arrays[name] = np.array(values, dtype=DTYPES[name])
+        return cls(arrays, dictionaries).sorted()
+
+    @classmethod
+    def from_queryset(cls, qs, columns=COLUMNS):
+        """
+        Load the requests of ``qs`` with a single query.
+        """
+        names = ["timestamp"] + [name for name in columns if name != "timestamp"]
+        terms = [name for name in names if settings.NORMALIZE_STRINGS and name in NORMALIZED_FIELDS]
+        fields = names + [f"{name}_term" for name in terms]
+        rows = list(qs.order_by().values_list(*fields))
+        values = dict(zip(fields, zip(*rows))) if rows else {field: () for field in fields}
+        for name in terms:
+            ids = values.pop(f"{name}_term")
+            strings = interner.values(set(ids).difference([None]), using=qs.db)
+            values[name] = [value if pk is None else strings.get(pk, "") for value, pk in zip(values[name], ids)]
+        return cls.from_columns(values)
+
+    @classmethod
+    def from_table(cls, table):
+        """
+        Build a frame from the known columns of a ``pyarrow.Table`` (see
+        ``metrics.archive``).
+        """
+        arrays, dictionaries = {}, {}
+        for name in table.column_names:
+            column = table[name]
+            if name in STRING_COLUMNS:
+                encoded = column.fill_null("").combine_chunks().dictionary_encode()
+                arrays[name] = encoded.indices.to_numpy(zero_copy_only=False).astype(np.int32)
+                dictionaries[name] = encoded.dictionary.to_numpy(zero_copy_only=False).astype(object)
+            elif name == "timestamp":
+                arrays[name] = column.cast(pa.int64()).to_numpy()
+            elif name == "user_id":
+                arrays[name] = column.fill_null(NO_USER).to_numpy().astype(np.int64)
+            elif name in DTYPES:
+                arrays[name] = column.to_numpy().astype(DTYPES[name])
+        return cls(arrays, dictionaries).sorted()
+
+    @classmethod
+    def concat(cls, frames):
+        """
+        Join ``frames`` with the same columns, merging their dictionaries.
+        """
+        frames = list(frames)
+        arrays, dictionaries = {}, {}
+        for name in frames[0].arrays:
+            if name not in frames[0].dictionaries:
+                arrays[name] = np.concatenate([frame.arrays[name] for frame in frames])
+                continue
+            merged = np.unique(np.concatenate([frame.dictionaries[name] for frame in frames]))
+            # Position of each old dictionary value in the merged one.
+            positions = [np.searchsorted(merged, frame.dictionaries[name]).astype(np.int32) for frame in frames]
+            arrays[name] = np.concatenate([position[frame.arrays[name]] for position, frame in zip(positions, frames)])
+            dictionaries[name] = merged.astype(object)
+        return cls(arrays, dictionaries).sorted()
+
+    def __len__(self):
+        return len(self.arrays["timestamp"])
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    @property
+    def nbytes(self):
+        """
+        Approximate memory used by the frame, in bytes.
+        """
+        size = sum(array.nbytes for array in self.arrays.values())
+        for dictionary in self.dictionaries.values():
+            size += dictionary.nbytes + sum(sys.getsizeof(value) for value in dictionary)
+        return size
+
+    def take(self, index):
+        """
+        Get the rows selected by ``index``, a boolean mask, an array of
+        positions or a slice. Dictionaries are shared.
+        """
+        return Frame({name: array[index] for name, array in self.arrays.items()}, self.dictionaries)
+
+    def sorted(self):
+        timestamps = self.arrays["timestamp"]
+        if len(timestamps) < 2 or (timestamps[:-1] <= timestamps[1:]).all():
+            return self
+        return self.take(np.argsort(timestamps, kind="stable"))
+
+    def between(self, start, end):
+        """
+        Get the rows with ``start <= timestamp < end``, without copying.
+        """
+        first, last = np.searchsorted(self.arrays["timestamp"], to_microseconds([start, end]))
+        return self.take(slice(first, last))
+
+    def values(self, name):
+        """
+        Get the decoded values of the column ``name``.
+        """
+        if name in self.dictionaries:
+            return self.dictionaries[name][self.arrays[name]]
+        return self.arrays[name]
+
+    def matches(self, name, predicate):
+        """
+        Get the boolean mask of the rows whose string ``name`` satisfies
+        ``predicate``, called once per distinct value.
+        """
+        dictionary = self.dictionaries[name]
+        mask = np.fromiter((bool(predicate(value)) for value in dictionary), dtype=bool, count=len(dictionary))
+        return mask[self.arrays[name]]
+
+    def unique(self, name):
+        """
+        Get the distinct values of the column ``name``.
+        """
+        if name in self.dictionaries:
+            return self.dictionaries[name][np.unique(self.arrays[name])]
+        return np.unique(self.arrays[name])
+
+    def top(self, name, limit=10):
+        """
+        Get the most frequent non empty values of the string ``name``, in the
+        format of ``RequestQuerySet.top()``.
+        """
+        dictionary = self.dictionaries[name]
+        counts = np.bincount(self.arrays[name], minlength=len(dictionary))
+        counts[dictionary == ""] = 0
+        order = np.argsort(-counts, kind="stable")[: np.count_nonzero(counts)]
+        if limit is not None:
+            order = order[:limit]
+        count, term = f"{name}__count", f"{name}_term"
+        return [{name: dictionary[index], count: int(counts[index]), term: None} for index in order]
+
+
+def load_frame(qs, columns=COLUMNS):
+    """
+    Load the requests of ``qs`` in a ``Frame``, with the archived requests of
+    its time range (see ``RequestQuerySet.between()``).
+    """
+    if np is None:
+        raise ImproperlyConfigured("The in-memory analytics require numpy.")
+    frame = Frame.from_queryset(qs, columns)
+    table = load_archived(qs, columns)
+    if table is not None:
+        frame = Frame.concat([frame, Frame.from_table(table)])
+    return frame
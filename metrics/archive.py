@@ -0,0 +1,202 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import datetime
+import json
+import os
+
+from django.utils import timezone
+
+from . import settings
+from .serializers import JSONEncoder
+from .utils import handle_naive_datetime, period_range
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pc = pq = None
+
+# Columns of the segments, all the fields of Request.
+COLUMNS = (
+    "id",
+    "timestamp",
+    "status_code",
+    "method",
+    "path",
+    "full_path",
+    "query_string",
+    "headers",
+    "is_secure",
+    "ip",
+    "user_id",
+    "referer",
+    "user_agent",
+    "language",
+)
+
+
+def get_schema():
+    return pa.schema(
+        [
+            ("id", pa.int64()),
+            ("timestamp", pa.timestamp("us")),  # UTC, local time without USE_TZ
+            ("status_code", pa.int16()),
+            ("method", pa.string()),
+            ("path", pa.string()),
+            ("full_path", pa.string()),
+            ("query_string", pa.string()),  # JSON
+            ("headers", pa.string()),  # JSON
+            ("is_secure", pa.bool_()),
+            ("ip", pa.string()),
+            ("user_id", pa.int64()),
+            ("referer", pa.string()),
+            ("user_agent", pa.string()),
+            ("language", pa.string()),
+        ]
+    )
+
+
+def to_utc(value):
+    """
+    Convert ``value`` to a naive UTC datetime, as stored in the segments.
+    """
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time.min)
+    value = handle_naive_datetime(value)
+    if timezone.is_naive(value):
+        return value
+    return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def local_date(value):
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date()
+
+
+def day_range(day):
+    """
+    Get the ``(start, end)`` datetimes of the local ``day``.
+    """
+    return period_range("day", day)
+
+
+def to_table(requests):
+    """
+    Convert ``Request`` instances to a segment table.
+    """
+    columns = {name: [] for name in COLUMNS}
+    for request in requests:
+        for name in COLUMNS:
+            value = getattr(request, name)
+            if name == "timestamp":
+                value = to_utc(value)
+            elif name in ("query_string", "headers"):
+                value = json.dumps(value, cls=JSONEncoder)
+            columns[name].append(value)
+    return pa.table(columns, schema=get_schema())
+
+
+class Archive:
+    """
+    Requests stored in a compressed Parquet file per (local) day, under
+    ``path/<year>/<month>/requests-<date>.parquet``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def segment(self, day):
+        return os.path.join(self.path, f"{day:%Y}", f"{day:%m}", f"requests-{day.isoformat()}.parquet")
+
+    def days(self, start, end):
+        """
+        Get the archived days of the ``start <= timestamp < end`` range.
+        """
+        first, last = local_date(start), local_date(end - datetime.timedelta(microseconds=1))
+        days = (first + datetime.timedelta(days=n) for n in range((last - first).days + 1))
+        return [day for day in days if os.path.exists(self.segment(day))]
+
+    def write(self, day, batches):
+        """
+        Write the segment of ``day`` from ``batches`` of requests, keeping the
+        requests already archived, and return the number of requests added.
+
+        The segment is replaced atomically once complete, so an interrupted run
+        can be started again.
+        """
+        path = self.segment(day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        existing = pq.read_table(path, schema=get_schema()) if os.path.exists(path) else None
+        archived = existing["id"] if existing is not None else pa.array([], pa.int64())
+        count = 0
+        with pq.ParquetWriter(f"{path}.tmp", get_schema(), compression="zstd") as writer:
+            if existing is not None:
+                writer.write_table(existing)
+            for batch in batches:
+                table = to_table(batch)
+                table = table.filter(pc.invert(pc.is_in(table["id"], value_set=archived)))
+                writer.write_table(table)
+                count += table.num_rows
+        os.replace(f"{path}.tmp", path)
+        return count
+
+    def read(self, start, end, columns=None):
+        """
+        Read the archived requests with ``start <= timestamp < end``.
+        """
+        columns = list(columns) if columns else list(COLUMNS)
+        if "timestamp" not in columns:
+            columns.append("timestamp")
+        filters = [("timestamp", ">=", to_utc(start)), ("timestamp", "<", to_utc(end))]
+        tables = [pq.read_table(self.segment(day), columns=columns, filters=filters) for day in self.days(start, end)]
+        if not tables:
+            return get_schema().empty_table().select(columns)
+        return pa.concat_tables(tables)
+
+
+def get_archive():
+    """
+    Get the ``Archive`` in ``settings.ARCHIVE_PATH``, or ``None`` if it isn't
+    set or pyarrow isn't installed.
+    """
+    if settings.ARCHIVE_PATH is None or pa is None:
+        return None
+    return Archive(settings.ARCHIVE_PATH)
+
+
+def load_archived(qs, columns=None):
+    """
+    Read the archived requests in the time range of ``qs`` (see
+    ``RequestQuerySet.between()``), or return ``None`` when it has no range,
+    or no archived day in it.
+    """
+    archive = get_archive()
+    if archive is None or getattr(qs, "archive_range", None) is None:
+        return None
+    start, end = qs.archive_range
+    if not archive.days(start, end):
+        return None
+    return archive.read(start, end, columns)
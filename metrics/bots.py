@@ -0,0 +1,90 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from functools import lru_cache
+import re
+
+from django.apps import apps
+from django.db import transaction
+
+from . import settings
+
+
+@lru_cache(maxsize=8)
+def compile_patterns(patterns):
+    """
+    Join the bot ``patterns`` in a single case insensitive regex, or
+    ``None`` if there aren't any.
+    """
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns), re.IGNORECASE)
+
+
+def is_bot(user_agent):
+    """
+    Tell if ``user_agent`` matches one of ``settings.BOT_PATTERNS``.
+    """
+    pattern = compile_patterns(tuple(settings.BOT_PATTERNS))
+    return bool(pattern and user_agent and pattern.search(user_agent))
+
+
+def classify_requests(using=None, chunk_size=10000, stdout=None):
+    """
+    Set ``is_bot`` on all the stored requests with the current
+    ``settings.BOT_PATTERNS``, ``chunk_size`` rows at a time, and return the
+    number of rows updated.
+    """
+    from .managers import string_lookup
+
+    manager = apps.get_model("metrics", "Request")._default_manager.db_manager(using)
+
+    updated = 0
+    last_pk = 0
+    while True:
+        # Each chunk is committed on its own.
+        with transaction.atomic(using=manager.db):
+            qs = manager.filter(pk__gt=last_pk).order_by("pk")
+            chunk = list(qs.values_list("pk", string_lookup("user_agent"), "is_bot")[:chunk_size])
+            if not chunk:
+                break
+            last_pk = chunk[-1][0]
+            changed = {True: [], False: []}
+            for pk, user_agent, flag in chunk:
+                if is_bot(user_agent) != flag:
+                    changed[not flag].append(pk)
+            for flag, pks in changed.items():
+                if pks:
+                    updated += manager.filter(pk__in=pks).update(is_bot=flag)
+        if stdout is not None:
+            stdout.write(f"{updated} requests updated, up to id {last_pk}")
+    return updated
+
+
+def human_frame(frame):
+    """
+    Get the rows of ``frame`` (a ``metrics.analytics.Frame`` with the user
+    agents) that aren't bots. The archived requests have no ``is_bot``
+    column, they are classified by their user agent.
+    """
+    return frame.take(~frame.matches("user_agent", is_bot))
@@ -0,0 +1,125 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from functools import lru_cache
+import math
+
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+PALETTE = ("#417690", "#f5dd5d", "#79aec8", "#ba2121", "#70bf2b", "#c4a000", "#5b80b2", "#999999")
+
+FONT = 'font-family="sans-serif" font-size="11"'
+
+
+def chart_items(items):
+    """
+    Get ``(label, count)`` pairs as a hashable tuple, the key of the cache.
+    """
+    return tuple((str(label), count) for label, count in items)
+
+
+def svg(width, height, body):
+    return mark_safe(
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}" role="img">{body}</svg>'
+    )
+
+
+def title(label, count, total):
+    share = count * 100 / total if total else 0
+    return f"<title>{escape(label)}: {count} ({share:.1f}%)</title>"
+
+
+def point(cx, cy, radius, angle):
+    return cx + radius * math.cos(angle), cy + radius * math.sin(angle)
+
+
+def pie_slice(cx, cy, radius, start, end, color):
+    if end - start >= 2 * math.pi - 1e-9:
+        return f'<circle cx="{cx}" cy="{cy}" r="{radius}" fill="{color}"/>'
+    x0, y0 = point(cx, cy, radius, start)
+    x1, y1 = point(cx, cy, radius, end)
+    large = 1 if end - start > math.pi else 0
+    return (
+        f'<path d="M{cx},{cy} L{x0:.2f},{y0:.2f} A{radius},{radius} 0 {large} 1 {x1:.2f},{y1:.2f} Z" '
+        f'fill="{color}"/>'
+    )
+
+
+@lru_cache(maxsize=256)
+def render_pie_chart(items, width, height):
+    total = sum(count for label, count in items)
+    radius = height / 2 - 5
+    cx = cy = height / 2
+    parts = []
+    angle = -math.pi / 2
+    for index, (label, count) in enumerate(items):
+        color = PALETTE[index % len(PALETTE)]
+        end = angle + (2 * math.pi * count / total if total else 0)
+        if count:
+            parts.append(f"<g>{title(label, count, total)}{pie_slice(cx, cy, radius, angle, end, color)}</g>")
+        angle = end
+        # Legend
+        y = 10 + index * 18
+        parts.append(
+            f'<rect x="{height + 10}" y="{y}" width="10" height="10" fill="{color}"/>'
+            f'<text x="{height + 26}" y="{y + 9}" {FONT}>{escape(label)} ({count})</text>'
+        )
+    return svg(width, height, "".join(parts))
+
+
+@lru_cache(maxsize=256)
+def render_bar_chart(items, width, height):
+    highest = max((count for label, count in items), default=0)
+    total = sum(count for label, count in items)
+    row = min(height / max(len(items), 1), 24)
+    label_width = width * 0.4
+    bar_width = width - label_width - 50
+    parts = []
+    for index, (label, count) in enumerate(items):
+        color = PALETTE[index % len(PALETTE)]
+        y = index * row
+        length = bar_width * count / highest if highest else 0
+        parts.append(
+            f"<g>{title(label, count, total)}"
+            f'<text x="{label_width - 5:.2f}" y="{y + row / 2 + 4:.2f}" text-anchor="end" {FONT}>{escape(label)}</text>'
+            f'<rect x="{label_width:.2f}" y="{y + 2:.2f}" width="{length:.2f}" height="{row - 4:.2f}" fill="{color}"/>'
+            f'<text x="{label_width + length + 5:.2f}" y="{y + row / 2 + 4:.2f}" {FONT}>{count}</text></g>'
+        )
+    return svg(width, height, "".join(parts))
+
+
+def pie_chart(items, width=440, height=190):
+    """
+    Render ``(label, count)`` pairs as an inline SVG pie chart, with a legend
+    on its right.
+    """
+    return render_pie_chart(chart_items(items), width, height)
+
+
+def bar_chart(items, width=440, height=190):
+    """
+    Render ``(label, count)`` pairs as an inline SVG horizontal bar chart.
+    """
+    return render_bar_chart(chart_items(items), width, height)
@@ -0,0 +1,243 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from bisect import bisect_left
+from collections import defaultdict
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+
+from . import settings
+from .traffic import counter_modules, Module
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+class LocalStore:
+    """
+    Keep counter samples in the memory of the current process.
+
+    Keys are ``(sample_name, labels)`` tuples, where ``labels`` is a
+    tuple of ``(name, value)`` pairs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = defaultdict(float)
+
+    def inc(self, key, amount=1):
+        with self._lock:
+            self._values[key] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Metric:
+    """
+    Base metric family class.
+    """
+
+    type = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _labels(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"'{self.name}' expects labels {self.labelnames!r}, got {tuple(labels)!r}")
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+    def samples(self, snapshot):
+        raise NotImplementedError("'samples' isn't defined.")
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        self.registry.store.inc((f"{self.name}_total", self._labels(labels)), amount)
+
+    def samples(self, snapshot):
+        sample_name = f"{self.name}_total"
+        samples = [(name, labels, value) for (name, labels), value in snapshot.items() if name == sample_name]
+        if not samples and not self.labelnames:
+            samples.append((sample_name, (), 0))
+        return sorted(samples)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=()):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(bucket) for bucket in buckets))
+
+    def observe(self, value, **labels):
+        labels = self._labels(labels)
+        index = bisect_left(self.buckets, value)
+        bound = _format_value(self.buckets[index]) if index < len(self.buckets) else "+Inf"
+        self.registry.store.inc((f"{self.name}_bucket", labels + (("le", bound),)))
+        self.registry.store.inc((f"{self.name}_sum", labels), value)
+
+    def samples(self, snapshot):
+        bounds = [_format_value(bucket) for bucket in self.buckets] + ["+Inf"]
+        buckets, sums = defaultdict(dict), {}
+        for (name, labels), value in snapshot.items():
+            if name == f"{self.name}_bucket":
+                buckets[labels[:-1]][labels[-1][1]] = value
+            elif name == f"{self.name}_sum":
+                sums[labels] = value
+
+        samples = []
+        for labels in sorted(buckets):
+            total = 0
+            for bound in bounds:
+                total += buckets[labels].get(bound, 0)
+                samples.append((f"{self.name}_bucket", labels + (("le", bound),), total))
+            samples.append((f"{self.name}_count", labels, total))
+            samples.append((f"{self.name}_sum", labels, sums.get(labels, 0)))
+        return samples
+
+
+class Registry:
+    """
+    Set of metric families sharing the same store.
+    """
+
+    def __init__(self, store=None):
+        self.store = store if store is not None else LocalStore()
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric '{metric.name}' is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=()):
+        return self.register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def collect(self):
+        snapshot = self.store.snapshot()
+        return [(metric, metric.samples(snapshot)) for metric in self._metrics.values()]
+
+
+def get_store():
+    """
+    Get the store configured by ``settings.SHARED_COUNTERS``.
+    """
+    if settings.SHARED_COUNTERS:
+        from .sharedstore import SharedStore
+
+        return SharedStore(settings.SHARED_COUNTERS, **settings.SHARED_COUNTERS_OPTIONS)
+    return LocalStore()
+
+
+def _format_value(value):
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def generate(registry):
+    """
+    Render the registry in the OpenMetrics text format.
+    """
+    lines = []
+    for metric, samples in registry.collect():
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+        for name, labels, value in samples:
+            if labels:
+                pairs = ",".join(f'{label}="{_escape(label_value)}"' for label, label_value in labels)
+                name = f"{name}{{{pairs}}}"
+            lines.append(f"{name} {_format_value(value)}")
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+registry = Registry(get_store())
+
+requests_total = registry.counter(
+    "metrics_requests",
+    "Requests seen by the capture path, by method, route and status code.",
+    ("method", "route", "status_code"),
+)
+request_duration = registry.histogram(
+    "metrics_request_duration_seconds",
+    "Time spent serving requests, by method and route.",
+    ("method", "route"),
+    settings.COUNTER_BUCKETS,
+)
+
+
+def module_counters():
+    """
+    Get the counters bound to ``settings.COUNTER_MODULES``, register
+    them if isn't already made.
+    """
+    counters = []
+    for module in counter_modules.modules:
+        if type(module).matches is Module.matches:
+            raise ImproperlyConfigured(f"Traffic module '{module.module_name}' can't be used as a counter")
+        name = f"metrics_{module.metric_name}"
+        counter = registry.get(name) or registry.counter(
+            name, f"Requests matched by the {module.module_name} traffic module."
+        )
+        counters.append((module, counter))
+    return counters
+
+
+def record(request, route="", duration=None):
+    """
+    Update the in-process counters with a single ``Request``. The traffic
+    modules skip the bots with ``settings.TRAFFIC_HUMANS_ONLY``, as they do in
+    the database.
+    """
+    requests_total.inc(method=request.method, route=route, status_code=request.status_code)
+    if duration is not None:
+        request_duration.observe(duration, method=request.method, route=route)
+    if request.is_bot and settings.TRAFFIC_HUMANS_ONLY:
+        return
+    for module, counter in module_counters():
+        if module.matches(request):
+            counter.inc()
@@ -0,0 +1,206 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from concurrent.futures import as_completed, ProcessPoolExecutor
+import datetime
+from ipaddress import IPv4Address
+from itertools import accumulate
+import math
+import random
+
+import django
+from django.apps import apps
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from . import settings
+from .archive import day_range, local_date
+from .bots import is_bot
+
+# (weight, user agent), roughly the share of the browsers and the bots.
+USER_AGENTS = (
+    (32, "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0 Safari/537.36"),
+    (14, "Mozilla/5.0 (Linux; Android 11; Pixel 5) AppleWebKit/537.36 Chrome/91.0 Mobile Safari/537.36"),
+    (13, "Mozilla/5.0 (iPhone; CPU iPhone OS 14_6 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148 Safari/604.1"),
+    (8, "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 Version/14.1 Safari/605.1.15"),
+    (7, "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:89.0) Gecko/20100101 Firefox/89.0"),
+    (6, "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0 Edg/91.0.864.59"),
+    (2, "Opera/9.80 (Windows NT 6.0) Presto/2.12.388 Version/12.14"),
+    (1, "Mozilla/5.0 (compatible; MSIE 9.0; Windows NT 6.1; Trident/5.0)"),
+    (8, "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)"),
+    (4, "Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)"),
+    (3, "python-requests/2.25.1"),
+    (2, "curl/7.68.0"),
+)
+LANGUAGES = ((60, "en-US,en;q=0.9"), (15, "de-DE,de;q=0.9,en;q=0.8"), (15, "fr-FR,fr;q=0.9"), (10, ""))
+SEARCH_ENGINES = (
+    (75, "https://www.google.com/search?q="),
+    (15, "https://www.bing.com/search?q="),
+    (10, "https://search.yahoo.com/search?p="),
+)
+SITES = ("https://news.ycombinator.com/", "https://www.reddit.com/r/django/", "https://twitter.com/", "https://t.co/")
+WORDS = ("django", "metrics", "python", "traffic", "analytics", "admin", "dashboard", "postgres", "tutorial", "api")
+SECTIONS = ("blog", "docs", "products", "tags", "users", "api")
+
+# Share of the requests by local hour, low at night and peaking in the afternoon.
+DIURNAL = [1.1 + math.cos((hour - 15) * math.pi / 12) for hour in range(24)]
+
+
+def cumulative(weights):
+    return list(accumulate(weights))
+
+
+def zipf(count, exponent):
+    """
+    Cumulative weights of ``count`` ranks following Zipf's law.
+    """
+    return cumulative(1 / rank**exponent for rank in range(1, count + 1))
+
+
+class TrafficGenerator:
+    """
+    Synthesize unsaved requests over the ``days`` days before ``end`` (a date,
+    today by default): Zipf distributed paths and visitors, each visitor with
+    an address, a user agent and a language, a diurnal pattern, errors,
+    redirects, and direct, internal, search and external referrers.
+
+    The requests of a stream only depend on the seed and the stream number.
+    """
+
+    def __init__(self, seed=0, days=30, end=None, paths=1000, visitors=10000, error_rate=0.02, users=0.1):
+        self.seed = seed
+        self.days = days
+        self.error_rate = error_rate
+        self.start = day_range((end or local_date(timezone.now())) - datetime.timedelta(days=days))[0]
+        self.model = apps.get_model("metrics", "Request")
+
+        self.hour_weights = cumulative(DIURNAL)
+        self.user_agent_weights = cumulative(weight for weight, user_agent in USER_AGENTS)
+        self.language_weights = cumulative(weight for weight, language in LANGUAGES)
+        self.engine_weights = cumulative(weight for weight, engine in SEARCH_ENGINES)
+
+        rng = random.Random(f"{seed}-setup")
+        self.paths = [self.make_path(rng, rank) for rank in range(paths)]
+        self.path_weights = zipf(paths, 1.1)
+        self.visitors = [self.make_visitor(rng, users) for _ in range(visitors)]
+        self.visitor_weights = zipf(visitors, 0.8)
+
+    def make_path(self, rng, rank):
+        if rank == 0:
+            return "/"
+        return f"/{rng.choice(SECTIONS)}/{'-'.join(rng.sample(WORDS, 2))}-{rank}/"
+
+    def make_visitor(self, rng, users):
+        user_agent = rng.choices(USER_AGENTS, cum_weights=self.user_agent_weights)[0][1]
+        language = rng.choices(LANGUAGES, cum_weights=self.language_weights)[0][1]
+        user_id = rng.randrange(1, 100000) if rng.random() < users else None
+        return str(IPv4Address(rng.getrandbits(32))), user_agent, language, user_id
+
+    def status_code(self, rng):
+        value = rng.random()
+        if value < self.error_rate * 0.8:
+            return 404
+        if value < self.error_rate:
+            return 500
+        if value < self.error_rate + 0.03:
+            return rng.choice((301, 302))
+        return 200
+
+    def referer(self, rng):
+        value = rng.random()
+        if value < 0.45:
+            return ""
+        if value < 0.75:
+            return settings.BASE_URL + rng.choices(self.paths, cum_weights=self.path_weights)[0]
+        if value < 0.9:
+            engine = rng.choices(SEARCH_ENGINES, cum_weights=self.engine_weights)[0][1]
+            return engine + "+".join(rng.sample(WORDS, rng.randint(1, 3)))
+        return rng.choice(SITES)
+
+    def make_request(self, rng):
+        path = rng.choices(self.paths, cum_weights=self.path_weights)[0]
+        ip, user_agent, language, user_id = rng.choices(self.visitors, cum_weights=self.visitor_weights)[0]
+        hour = rng.choices(range(24), cum_weights=self.hour_weights)[0]
+        offset = datetime.timedelta(days=rng.randrange(self.days), hours=hour, seconds=rng.random() * 3600)
+        return self.model(
+            timestamp=self.start + offset,
+            method="POST" if rng.random() < 0.05 else "GET",
+            path=path,
+            full_path=path,
+            status_code=self.status_code(rng),
+            is_secure=rng.random() < 0.9,
+            ip=ip,
+            user_id=user_id,
+            referer=self.referer(rng),
+            user_agent=user_agent,
+            language=language,
+            is_bot=is_bot(user_agent),
+        )
+
+    def requests(self, count, stream=0):
+        rng = random.Random(f"{self.seed}-{stream}")
+        for _ in range(count):
+            yield self.make_request(rng)
+
+
+_generators = {}
+
+
+def write_stream(options, stream, count, batch_size=10000, using=DEFAULT_DB_ALIAS):
+    """
+    Insert the ``count`` requests of ``stream``, and return their number.
+    """
+    key = tuple(sorted(options.items()))
+    if key not in _generators:
+        _generators[key] = TrafficGenerator(**options)
+    generator = _generators[key]
+    return generator.model.objects.db_manager(using).bulk_insert(generator.requests(count, stream), batch_size)
+
+
+def generate_requests(
+    count, workers=1, stream_size=100000, batch_size=10000, using=DEFAULT_DB_ALIAS, stdout=None, **options
+):
+    """
+    Insert ``count`` requests of a ``TrafficGenerator`` built with
+    ``options``, in streams of ``stream_size`` requests written by ``workers``
+    processes, and return their number.
+    """
+    streams = [(stream, min(stream_size, count - start)) for stream, start in enumerate(range(0, count, stream_size))]
+    if workers <= 1:
+        results = (write_stream(options, stream, size, batch_size, using) for stream, size in streams)
+        return report(results, stdout)
+
+    # The workers open their own connections.
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as executor:
+        futures = [executor.submit(write_stream, options, stream, size, batch_size, using) for stream, size in streams]
+        return report((future.result() for future in as_completed(futures)), stdout)
+
+
+def report(results, stdout=None):
+    total = 0
+    for count in results:
+        total += count
+        if stdout is not None:
+            stdout.write(f"{total} requests written.")
+    return total
@@ -0,0 +1,95 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from functools import lru_cache
+
+from django.db import connections
+
+from . import settings
+
+TABLE = "metrics_request"
+TRIGRAM_FIELDS = ("path", "referer", "user_agent")
+
+
+def trigram_indexes():
+    """
+    Get the SQL creating each trigram index of ``settings.TRIGRAM_INDEXES``,
+    by index name.
+    """
+    # UPPER() matches the SQL of the icontains, istartswith and iendswith lookups.
+    return {
+        f"{TABLE}_{field}_trgm": [
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {TABLE}_{field}_trgm "
+            f"ON {TABLE} USING gin (UPPER({field}) gin_trgm_ops)",
+        ]
+        for field in TRIGRAM_FIELDS
+    }
+
+
+def get_index_names(connection):
+    with connection.cursor() as cursor:
+        return set(connection.introspection.get_constraints(cursor, TABLE))
+
+
+def missing_indexes(using):
+    """
+    Get the SQL creating the optional indexes enabled by the settings but
+    missing from the ``using`` database, by index name.
+    """
+    connection = connections[using]
+    indexes = {}
+    if settings.TRIGRAM_INDEXES and connection.vendor == "postgresql":
+        indexes.update(trigram_indexes())
+    if not indexes:
+        return {}
+    existing = get_index_names(connection)
+    return {name: sql for name, sql in indexes.items() if name not in existing}
+
+
+def create_indexes(using, stdout=None):
+    """
+    Create the indexes of ``missing_indexes()``, and return their names.
+
+    They are built ``CONCURRENTLY`` on PostgreSQL, so this must not run in a
+    transaction.
+    """
+    missing = missing_indexes(using)
+    with connections[using].cursor() as cursor:
+        for name, statements in missing.items():
+            if stdout is not None:
+                stdout.write(f"Creating {name}")
+            for sql in statements:
+                cursor.execute(sql)
+    has_trigram_indexes.cache_clear()
+    return list(missing)
+
+
+@lru_cache(maxsize=None)
+def has_trigram_indexes(using):
+    """
+    Tell if the trigram indexes exist in the ``using`` database, looked up
+    once per process.
+    """
+    connection = connections[using]
+    return connection.vendor == "postgresql" and set(trigram_indexes()).issubset(get_index_names(connection))
@@ -0,0 +1,269 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+
+from django.apps import apps
+from django.db import IntegrityError, transaction
+
+from . import settings
+from .serializers import JSONEncoder
+
+# String columns of Request which can be stored as ids of Term rows.
+NORMALIZED_FIELDS = ("path", "full_path", "referer", "user_agent", "language")
+
+
+def get_digest(value):
+    return hashlib.sha1(value.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+class Interner:
+    """
+    Map the strings of the ``NORMALIZED_FIELDS`` to the ids of their ``Term``
+    rows, and back, through a bounded in-process cache.
+
+    Rows are created on first use; their ids are cached only once the
+    transaction creating them is committed.
+    """
+
+    model_name = "metrics.Term"
+    value_field = "value"
+
+    def __init__(self, model=None, using=None, max_size=10000):
+        self._model = model
+        self.using = using
+        self.max_size = max_size
+        self._ids = OrderedDict()
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = apps.get_model(self.model_name)
+        return self._model
+
+    def get_key(self, kind, value):
+        return (kind, value)
+
+    def get_lookup(self, kind, value):
+        return {"kind": kind, "digest": get_digest(value)}
+
+    def _remember(self, key, pk, value):
+        with self._lock:
+            if key is not None:
+                self._ids[key] = pk
+                self._ids.move_to_end(key)
+            self._values[pk] = value
+            self._values.move_to_end(pk)
+            for cache in (self._ids, self._values):
+                while len(cache) > self.max_size:
+                    cache.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._values.clear()
+
+    def intern(self, kind, value, using=None):
+        """
+        Get the id of the row of ``value`` of ``kind``.
+        """
+        key = self.get_key(kind, value)
+        with self._lock:
+            pk = self._ids.get(key)
+            if pk is not None:
+                self._ids.move_to_end(key)
+                return pk
+
+        manager = self.model._default_manager.db_manager(using or self.using)
+        lookup = self.get_lookup(kind, value)
+        pk = manager.filter(**lookup).values_list("pk", flat=True).first()
+        if pk is not None:
+            self._remember(key, pk, value)
+            return pk
+        try:
+            with transaction.atomic(using=manager.db):
+                pk = manager.create(**lookup, **{self.value_field: value}).pk
+        except IntegrityError:
+            # Created by a concurrent request.
+            pk = manager.filter(**lookup).values_list("pk", flat=True).get()
+            self._remember(key, pk, value)
+        else:
+            transaction.on_commit(lambda: self._remember(key, pk, value), using=manager.db)
+        return pk
+
+    def values(self, ids, using=None):
+        """
+        Get the values of the rows ``ids``, as a dict.
+        """
+        values = {}
+        with self._lock:
+            for pk in ids:
+                if pk in self._values:
+                    self._values.move_to_end(pk)
+                    values[pk] = self._values[pk]
+        missing = set(ids).difference(values)
+        if missing:
+            manager = self.model._default_manager.db_manager(using or self.using)
+            for pk, value in manager.filter(pk__in=missing).values_list("pk", self.value_field):
+                values[pk] = value
+                self._remember(None, pk, value)
+        return values
+
+
+class HeaderSetInterner(Interner):
+    """
+    Map the captured headers to the ids of their ``HeaderSet`` rows, keyed by
+    the hash of their canonical JSON.
+    """
+
+    model_name = "metrics.HeaderSet"
+    value_field = "headers"
+
+    def get_key(self, kind, headers):
+        return get_digest(json.dumps(headers, cls=JSONEncoder, sort_keys=True, separators=(",", ":")))
+
+    def get_lookup(self, kind, headers):
+        return {"digest": self.get_key(kind, headers)}
+
+
+interner = Interner(max_size=settings.INTERN_CACHE_SIZE)
+header_sets = HeaderSetInterner(max_size=settings.INTERN_CACHE_SIZE)
+
+
+def intern_fields(request, using=None):
+    """
+    Move the strings (with ``settings.NORMALIZE_STRINGS``) and the headers
+    (with ``settings.DEDUPLICATE_HEADERS``) of ``request`` to the ids of their
+    rows, and return them so they can be restored once saved.
+    """
+    interned = {}
+    if settings.NORMALIZE_STRINGS:
+        for field in NORMALIZED_FIELDS:
+            value = getattr(request, field)
+            if value:
+                setattr(request, f"{field}_term_id", interner.intern(field, value, using=using))
+                setattr(request, field, "")
+                interned[field] = value
+    if settings.DEDUPLICATE_HEADERS and request.headers:
+        request.header_set_id = header_sets.intern(None, request.headers, using=using)
+        interned["headers"], request.headers = request.headers, {}
+    return interned
+
+
+def attach_fields(requests, using=None):
+    """
+    Set the string fields and the headers of ``requests`` stored as ids, with
+    at most a query each.
+    """
+    attach_strings(requests, using=using)
+    attach_headers(requests, using=using)
+
+
+def attach_strings(requests, using=None):
+    attnames = [(field, f"{field}_term_id") for field in NORMALIZED_FIELDS]
+    pending = []
+    for request in requests:
+        for field, attname in attnames:
+            pk = request.__dict__.get(attname)
+            if pk is not None:
+                pending.append((request, field, pk))
+    if pending:
+        values = interner.values({pk for request, field, pk in pending}, using=using)
+        for request, field, pk in pending:
+            if pk in values:
+                request.__dict__[field] = values[pk]
+
+
+def attach_headers(requests, using=None):
+    pending = [request for request in requests if request.__dict__.get("header_set_id") is not None]
+    if pending:
+        values = header_sets.values({request.header_set_id for request in pending}, using=using)
+        for request in pending:
+            if request.header_set_id in values:
+                # Copied, the cached headers are shared.
+                request.__dict__["headers"] = dict(values[request.header_set_id])
+
+
+def _normalize(requests, interner):
+    changed = []
+    for request in requests:
+        fields = [field for field in NORMALIZED_FIELDS if getattr(request, field)]
+        for field in fields:
+            setattr(request, f"{field}_term_id", interner.intern(field, getattr(request, field)))
+            setattr(request, field, "")
+        if fields:
+            changed.append(request)
+    return changed
+
+
+def _denormalize(requests, interner):
+    values = interner.values(
+        {getattr(request, f"{field}_term_id") for request in requests for field in NORMALIZED_FIELDS} - {None}
+    )
+    changed = []
+    for request in requests:
+        fields = [field for field in NORMALIZED_FIELDS if getattr(request, f"{field}_term_id") is not None]
+        for field in fields:
+            setattr(request, field, values.get(getattr(request, f"{field}_term_id"), ""))
+            setattr(request, f"{field}_term_id", None)
+        if fields:
+            changed.append(request)
+    return changed
+
+
+def normalize_requests(using=None, chunk_size=10000, reverse=False, Request=None, Term=None, stdout=None):
+    """
+    Move the strings of all the stored requests to the term ids (or back to
+    the string columns with ``reverse``), ``chunk_size`` rows at a time, and
+    return the number of rows updated.
+
+    The models can be given to run from a migration.
+    """
+    Request = Request or apps.get_model("metrics", "Request")
+    local = Interner(model=Term or apps.get_model("metrics", "Term"), using=using, max_size=settings.INTERN_CACHE_SIZE)
+    manager = Request._default_manager.db_manager(using)
+    terms = [f"{field}_term" for field in NORMALIZED_FIELDS]
+
+    updated = 0
+    last_pk = 0
+    while True:
+        # Each chunk is committed on its own.
+        with transaction.atomic(using=manager.db):
+            # iterator() skips attach_fields(), the rows are loaded as stored.
+            qs = manager.filter(pk__gt=last_pk).order_by("pk").only(*NORMALIZED_FIELDS, *terms)
+            chunk = list(qs[:chunk_size].iterator())
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+            changed = (_denormalize if reverse else _normalize)(chunk, local)
+            if changed:
+                manager.bulk_update(changed, [*NORMALIZED_FIELDS, *terms], batch_size=1000)
+                updated += len(changed)
+        if stdout is not None:
+            stdout.write(f"{updated} requests updated, up to id {last_pk}")
+    return updated
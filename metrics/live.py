@@ -0,0 +1,193 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+from queue import Empty, Full, Queue
+import select
+import threading
+import time
+
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from . import settings
+from .serializers import JSONEncoder
+
+# NOTIFY payloads must be shorter than 8000 bytes.
+MAX_PAYLOAD = 7900
+MAX_PATH = 200
+
+
+def row(request):
+    return [
+        request.id,
+        request.timestamp,
+        request.method,
+        request.path[:MAX_PATH],
+        request.status_code,
+        request.ip,
+        request.user_id,
+    ]
+
+
+def encode(requests):
+    """
+    Get the payloads of the notifications for ``requests``, as few as fit.
+    """
+    payloads, rows, size = [], [], 2
+    for request in requests:
+        encoded = json.dumps(row(request), cls=JSONEncoder, separators=(",", ":"))
+        length = len(encoded.encode()) + 1
+        if rows and size + length > MAX_PAYLOAD:
+            payloads.append(f"[{','.join(rows)}]")
+            rows, size = [], 2
+        rows.append(encoded)
+        size += length
+    if rows:
+        payloads.append(f"[{','.join(rows)}]")
+    return payloads
+
+
+def publish(requests, using=DEFAULT_DB_ALIAS):
+    """
+    Notify the listeners of all the processes of the saved ``requests``, as
+    JSON arrays of ``[id, timestamp, method, path, status_code, ip, user_id]``
+    rows on ``settings.LIVE_FEED_CHANNEL``. The notifications are delivered
+    when the current transaction commits.
+    """
+    if not settings.LIVE_FEED:
+        return
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        for payload in encode(requests):
+            cursor.execute("SELECT pg_notify(%s, %s)", [settings.LIVE_FEED_CHANNEL, payload])
+
+
+class Listener:
+    """
+    Listen to ``channel`` on a dedicated connection to the ``using`` database,
+    in a thread running while there are subscribers.
+
+    Each subscriber gets its own bounded queue of payloads: a subscriber not
+    keeping up loses notifications instead of holding up the others.
+    """
+
+    def __init__(self, channel, using=DEFAULT_DB_ALIAS, timeout=5.0, max_size=1000):
+        self.channel = channel
+        self.using = using
+        self.timeout = timeout
+        self.max_size = max_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self):
+        queue = Queue(self.max_size)
+        with self._lock:
+            self._subscribers.add(queue)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="metrics-live", daemon=True)
+                self._thread.start()
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._lock:
+            self._subscribers.discard(queue)
+
+    def dispatch(self, payload):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for queue in subscribers:
+            try:
+                queue.put_nowait(payload)
+            except Full:
+                pass
+
+    def connect(self):
+        wrapper = connections[self.using]
+        connection = wrapper.get_new_connection(wrapper.get_connection_params())
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {wrapper.ops.quote_name(self.channel)}")
+        return connection
+
+    def listening(self):
+        with self._lock:
+            if not self._subscribers:
+                self._thread = None
+                return False
+        return True
+
+    def _run(self):
+        errors = (connections[self.using].Database.Error, OSError)
+        connection = None
+        try:
+            while self.listening():
+                try:
+                    if connection is None:
+                        connection = self.connect()
+                    if select.select([connection], [], [], self.timeout)[0]:
+                        connection.poll()
+                        while connection.notifies:
+                            self.dispatch(connection.notifies.pop(0).payload)
+                except errors:
+                    # Connect again after a while.
+                    if connection is not None:
+                        connection.close()
+                    connection = None
+                    threading.Event().wait(self.timeout)
+        finally:
+            # Let the next subscriber start another thread, whatever stopped
+            # this one.
+            with self._lock:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+            if connection is not None:
+                connection.close()
+
+
+listener = Listener(settings.LIVE_FEED_CHANNEL)
+
+
+def events(queue, keepalive=15.0, lifetime=300.0):
+    """
+    Stream the payloads of ``queue`` as server-sent events, with a comment
+    every ``keepalive`` seconds to keep the connection open. The queue is
+    unsubscribed when the stream is closed.
+
+    The stream ends after ``lifetime`` seconds, freeing the worker serving
+    it; the browser connects again after the ``retry`` delay.
+    """
+    deadline = time.monotonic() + lifetime
+    try:
+        yield "retry: 5000\n\n"
+        while time.monotonic() < deadline:
+            try:
+                payload = queue.get(timeout=min(keepalive, max(deadline - time.monotonic(), 0)))
+            except Empty:
+                yield ": keepalive\n\n"
+            else:
+                yield f"data: {payload}\n\n"
+    finally:
+        listener.unsubscribe(queue)
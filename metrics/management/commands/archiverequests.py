@@ -0,0 +1,101 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from metrics import settings
+from metrics.archive import day_range, get_archive, local_date
+from metrics.models import Request
+
+
+def batches(qs, size):
+    """
+    Iterate ``qs`` by ``size`` requests at a time, in id order.
+    """
+    last_pk = 0
+    while True:
+        batch = list(qs.filter(pk__gt=last_pk).order_by("pk")[:size])
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1].pk
+
+
+class Command(BaseCommand):
+    help = "Move old requests to the archive, in a compressed Parquet file per day."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.ARCHIVE_AFTER_DAYS,
+            help="Archive the requests older than this number of days (default: METRICS_ARCHIVE_AFTER_DAYS).",
+        )
+        parser.add_argument("--batch-size", type=int, default=10000, help="Number of requests read at once.")
+        parser.add_argument(
+            "--noinput",
+            action="store_false",
+            dest="interactive",
+            default=True,
+            help="Tells Django to NOT prompt the user for input of any kind.",
+        )
+
+    def handle(self, *args, **options):
+        archive = get_archive()
+        if archive is None:
+            raise CommandError("Archiving needs METRICS_ARCHIVE_PATH to be set, and pyarrow to be installed.")
+        if options["days"] < 1:
+            raise CommandError("--days must be at least 1.")
+
+        first = Request.objects.order_by("timestamp").values_list("timestamp", flat=True).first()
+        last_day = local_date(timezone.now()) - datetime.timedelta(days=options["days"])
+        if first is None or local_date(first) >= last_day:
+            self.stdout.write("There are no requests to archive.")
+            return
+
+        if options["interactive"]:
+            confirm = input(
+                f"""
+This will move the requests from {local_date(first)} to {last_day - datetime.timedelta(days=1)}
+to {archive.path}, and DELETE them from the database.
+Are you sure you want to do this?
+
+Type 'yes' to continue, or 'no' to cancel:"""
+            )
+            if confirm != "yes":
+                self.stdout.write("Archive cancelled")
+                return
+
+        day = local_date(first)
+        while day < last_day:
+            start, end = day_range(day)
+            qs = Request.objects.filter(timestamp__gte=start, timestamp__lt=end)
+            if qs.exists():
+                count = archive.write(day, batches(qs, options["batch_size"]))
+                # Deleted only once the segment is written.
+                qs.delete()
+                self.stdout.write(f"{day}: {count} requests archived.")
+            day += datetime.timedelta(days=1)
@@ -0,0 +1,85 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from metrics.generator import generate_requests
+
+
+class Command(BaseCommand):
+    help = "Insert synthetic requests with realistic distributions, for benchmarks and capacity planning."
+
+    def add_arguments(self, parser):
+        parser.add_argument("count", type=int, help="Number of requests to insert.")
+        parser.add_argument(
+            "--days", type=int, default=30, help="Spread the requests over the last days (default: 30)."
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator, for reproducible runs.")
+        parser.add_argument("--paths", type=int, default=1000, help="Number of distinct paths (default: 1000).")
+        parser.add_argument("--visitors", type=int, default=10000, help="Number of distinct visitors (default: 10000).")
+        parser.add_argument(
+            "--error-rate", type=float, default=0.02, help="Share of the 404 and 500 responses (default: 0.02)."
+        )
+        parser.add_argument("--workers", type=int, default=1, help="Number of processes writing the requests.")
+        parser.add_argument("--batch-size", type=int, default=10000, help="Number of requests written at once.")
+        parser.add_argument(
+            "--database", default=DEFAULT_DB_ALIAS, help="Nominates a database. Defaults to the 'default' database."
+        )
+        parser.add_argument(
+            "--noinput",
+            action="store_false",
+            dest="interactive",
+            default=True,
+            help="Tells Django to NOT prompt the user for input of any kind.",
+        )
+
+    def handle(self, *args, **options):
+        if options["count"] < 1 or options["days"] < 1 or options["paths"] < 1 or options["visitors"] < 1:
+            raise CommandError("count, --days, --paths and --visitors must be at least 1.")
+
+        if options["interactive"]:
+            confirm = input(
+                f"""
+This will add {options["count"]} synthetic requests to the '{options["database"]}' database.
+Are you sure you want to do this?
+
+Type 'yes' to continue, or 'no' to cancel:"""
+            )
+            if confirm != "yes":
+                self.stdout.write("Generation cancelled")
+                return
+
+        count = generate_requests(
+            options["count"],
+            workers=options["workers"],
+            batch_size=options["batch_size"],
+            using=options["database"],
+            stdout=self.stdout if options["verbosity"] > 1 else None,
+            seed=options["seed"],
+            days=options["days"],
+            paths=options["paths"],
+            visitors=options["visitors"],
+            error_rate=options["error_rate"],
+        )
+        self.stdout.write(f"{count} requests generated.")
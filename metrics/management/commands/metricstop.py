@@ -0,0 +1,73 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import shutil
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from metrics.top import get_source, render, Window
+
+CLEAR = "\x1b[H\x1b[2J"
+
+
+class Command(BaseCommand):
+    help = "Show the requests per second, errors, latency, top routes and IPs, refreshed live."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--source",
+            choices=("auto", "counters", "buffers", "database"),
+            default="auto",
+            help="Where to read the requests from (default: the first available).",
+        )
+        parser.add_argument("--interval", type=float, default=2.0, help="Seconds between two refreshes (default 2).")
+        parser.add_argument("--iterations", type=int, default=0, help="Stop after this many refreshes.")
+        parser.add_argument("--limit", type=int, default=10, help="Number of routes and IPs shown (default 10).")
+        parser.add_argument(
+            "--database", default=DEFAULT_DB_ALIAS, help='Database of the "database" source (default "default").'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            source = get_source(options["source"], using=options["database"])
+        except ValueError as e:
+            raise CommandError(e)
+
+        clear = self.stdout.isatty()
+        width = shutil.get_terminal_size().columns
+        iteration = 0
+        started = time.monotonic()
+        try:
+            while not options["iterations"] or iteration < options["iterations"]:
+                time.sleep(options["interval"])
+                now = time.monotonic()
+                window = Window(now - started)
+                started = now
+                source.poll(window)
+                lines = render(window, source, limit=options["limit"], width=width)
+                self.stdout.write((CLEAR if clear else "") + "\n".join(lines) + ("" if clear else "\n"))
+                iteration += 1
+        except KeyboardInterrupt:
+            pass
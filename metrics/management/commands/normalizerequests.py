@@ -0,0 +1,58 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from metrics import settings
+from metrics.interning import normalize_requests
+
+
+class Command(BaseCommand):
+    help = "Move the strings of the stored requests to the term table, or back with --reverse."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reverse",
+            action="store_true",
+            help="Move the strings back to the requests table, before disabling METRICS_NORMALIZE_STRINGS.",
+        )
+        parser.add_argument("--chunk-size", type=int, default=10000, help="Number of requests updated at once.")
+        parser.add_argument(
+            "--database", default=DEFAULT_DB_ALIAS, help="Nominates a database. Defaults to the 'default' database."
+        )
+
+    def handle(self, *args, **options):
+        if not options["reverse"] and not settings.NORMALIZE_STRINGS:
+            raise CommandError("METRICS_NORMALIZE_STRINGS is disabled, new requests would not be normalized.")
+        if options["reverse"] and settings.NORMALIZE_STRINGS:
+            raise CommandError("METRICS_NORMALIZE_STRINGS is enabled, new requests would still be normalized.")
+
+        stdout = self.stdout if options["verbosity"] > 1 else None
+        count = normalize_requests(
+            using=options["database"],
+            chunk_size=options["chunk_size"],
+            reverse=options["reverse"],
+            stdout=stdout,
+        )
+        self.stdout.write(f"{count} requests updated.")
@@ -27,7 +27,7 @@ from dateutil.relativedelta import relativedelta
 from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
 
-from metrics.models import Request
+from metrics.models import Hostname, Request
 
 DURATION_OPTIONS = {
     "hours": lambda amount: timezone.now() - timedelta(hours=amount),
@@ -51,6 +51,11 @@ class Command(BaseCommand):
             default=True,
             help="Tells Django to NOT prompt the user for input of any kind.",
         )
+        parser.add_argument(
+            "--bots",
+            action="store_true",
+            help="Purge only the requests of bots, to keep them for less time than the others.",
+        )
 
     def handle(self, *args, **options):
         amount = options["amount"]
@@ -65,7 +70,12 @@ class Command(BaseCommand):
         if duration_plural not in DURATION_OPTIONS:
             raise CommandError("Amount must be {0}".format(", ".join(DURATION_OPTIONS)))
 
+        # The hostnames are resolved again once expired, whatever is purged.
+        Hostname.objects.expired().delete()
+
         qs = Request.objects.filter(timestamp__lte=DURATION_OPTIONS[duration_plural](amount))
+        if options.get("bots"):
+            qs = qs.bots()
         count = qs.count()
 
         if count == 0:
@@ -77,12 +87,12 @@ class Command(BaseCommand):
                 """
 You have requested a database reset.
 This will IRREVERSIBLY DESTROY any
-requests created before {0} {1} ago.
+{3}requests created before {0} {1} ago.
 That is a total of {2} requests.
 Are you sure you want to do this?
 
 Type 'yes' to continue, or 'no' to cancel:""".format(
-                    amount, duration, count
+                    amount, duration, count, "bot " if options.get("bots") else ""
                 )
             )
         else:
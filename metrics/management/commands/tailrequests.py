@@ -0,0 +1,71 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from metrics import recent, settings
+
+
+class Command(BaseCommand):
+    help = "Show the latest requests served by the running processes of this host."
+
+    def add_arguments(self, parser):
+        parser.add_argument("-n", "--lines", type=int, default=20, help="Number of requests to show (default 20).")
+        parser.add_argument("-f", "--follow", action="store_true", help="Keep showing the new requests.")
+        parser.add_argument(
+            "--interval", type=float, default=1.0, help="Seconds between two checks with --follow (default 1)."
+        )
+
+    def handle(self, *args, **options):
+        if not settings.RECENT_REQUESTS_SOCKETS:
+            raise CommandError("Set METRICS_RECENT_REQUESTS and METRICS_RECENT_REQUESTS_SOCKETS to tail the requests.")
+
+        seen = {}
+        self.show(self.collect(seen, options["lines"])[-options["lines"] :])
+        try:
+            while options["follow"]:
+                time.sleep(options["interval"])
+                self.show(self.collect(seen))
+        except KeyboardInterrupt:
+            pass
+
+    def collect(self, seen, limit=None):
+        """
+        Get the records not in ``seen`` of all the processes, oldest first,
+        and remember the latest ones in ``seen``.
+        """
+        records = recent.poll(settings.RECENT_REQUESTS_SOCKETS, seen, limit)
+        return sorted(records, key=lambda record: record["timestamp"])
+
+    def show(self, records):
+        for record in records:
+            timestamp = recent.to_datetime(record["timestamp"]).strftime("%Y-%m-%d %H:%M:%S")
+            line = f"{timestamp} [{record['pid']}] {record['method']} {record['path']} {record['status_code']}"
+            line += f" {record['ip']}"
+            if record["user_id"] is not None:
+                line += f" user={record['user_id']}"
+            if record["duration"] is not None:
+                line += f" {record['duration'] * 1000:.1f}ms"
+            self.stdout.write(line)
@@ -22,17 +22,27 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import datetime
+import io
+from itertools import islice
+import json
 import time
 
 from django.contrib.auth import get_user_model
-from django.db import models
-from django.db.models import Q
+from django.core.exceptions import EmptyResultSet
+from django.db import connections, IntegrityError, models, transaction
+from django.db.models import Count, Q
 from django.utils import timezone
 
-from . import settings
-from .utils import handle_naive_datetime
+from . import live, settings
+from .interning import attach_fields, intern_fields, interner, NORMALIZED_FIELDS
+from .resolver import resolver
+from .utils import period_range
+
+SEARCH_ENGINES = ("google", "yahoo", "bing")
 
 QUERYSET_PROXY_METHODS = (
+    "between",
+    "period",
     "year",
     "month",
     "week",
@@ -44,90 +54,275 @@ QUERYSET_PROXY_METHODS = (
     "unique_visits",
     "attr_list",
     "search",
+    "humans",
+    "bots",
+    "errors",
+    "path_contains",
+    "referer_contains",
+    "user_agent_contains",
+    "prefetch_users",
+    "top",
 )
 
 
+def string_lookup(field, lookup=None):
+    """
+    Get the lookup on the string ``field``, through its ``Term`` with
+    ``settings.NORMALIZE_STRINGS``.
+    """
+    if settings.NORMALIZE_STRINGS and field in NORMALIZED_FIELDS:
+        field = f"{field}_term__value"
+    return f"{field}__{lookup}" if lookup else field
+
+
+def copy_value(value):
+    """
+    Format ``value`` as a field of ``COPY ... WITH (FORMAT csv)``: everything
+    is quoted, so that only the unquoted empty fields are ``NULL``.
+    """
+    if value is None:
+        return ""
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def copy_prep_value(field, value, connection):
+    """
+    Get the value of ``field`` written by ``COPY``. The JSON is serialized
+    here: depending on the Django version, the database value of a JSON
+    field is a driver adapter, quoted as SQL by ``str()``.
+    """
+    if field.get_internal_type() == "JSONField":
+        return None if value is None else json.dumps(value, cls=field.encoder)
+    return field.get_db_prep_save(value, connection)
+
+
+def attach_users(requests):
+    """
+    Resolve the users of ``requests`` with a single query on the users
+    database. Requests of the same user share the same instance.
+    """
+    user_ids = {request.user_id for request in requests if request.user_id}
+    users = get_user_model()._default_manager.in_bulk(user_ids) if user_ids else {}
+    for request in requests:
+        if request.user_id:
+            request._user_cache = (request.user_id, users.get(request.user_id))
+
+
+def estimate_count(qs):
+    """
+    Get the number of rows of ``qs`` estimated by the PostgreSQL planner,
+    or ``None`` when the database can't tell.
+    """
+    connection = connections[qs.db]
+    if connection.vendor != "postgresql":
+        return None
+    try:
+        sql, params = qs.order_by().query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
 class RequestQuerySet(models.QuerySet):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._prefetch_users = False
+        self._estimate_count = False
+        self._archive_range = None
+        self.count_is_estimated = False
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._prefetch_users = self._prefetch_users
+        clone._estimate_count = self._estimate_count
+        clone._archive_range = self._archive_range
+        return clone
+
+    def _filter_or_exclude(self, *args, **kwargs):
+        clone = super()._filter_or_exclude(*args, **kwargs)
+        # The archive can only answer for the time range.
+        clone._archive_range = None
+        return clone
+
+    @property
+    def archive_range(self):
+        """
+        ``(start, end)`` of the requests given by ``between()``, for which the
+        archived requests are counted too, or ``None``.
+        """
+        return self._archive_range
+
+    def _fetch_all(self):
+        fetched = self._result_cache is not None
+        super()._fetch_all()
+        if not fetched and self._iterable_class is models.query.ModelIterable:
+            attach_fields(self._result_cache, using=self.db)
+            if self._prefetch_users:
+                attach_users(self._result_cache)
+
+    def count(self):
+        if self._estimate_count and self._result_cache is None:
+            estimate = estimate_count(self)
+            if estimate is not None and estimate >= settings.ESTIMATED_COUNT_THRESHOLD:
+                self.count_is_estimated = True
+                return estimate
+        return super().count()
+
+    def estimated(self):
+        """
+        Let ``count()`` return the planner estimate when it's above
+        ``settings.ESTIMATED_COUNT_THRESHOLD``; ``count_is_estimated`` tells
+        which one was returned.
+        """
+        clone = self._chain()
+        clone._estimate_count = True
+        return clone
+
+    def prefetch_users(self):
+        """
+        Resolve ``Request.user`` of all the results with a single query
+        when the queryset is evaluated.
+        """
+        clone = self._chain()
+        clone._prefetch_users = True
+        return clone
+
+    def between(self, start, end):
+        """
+        Get the requests with ``start <= timestamp < end``.
+
+        Traffic modules count the archived requests of the range too (see
+        ``settings.ARCHIVE_PATH``), unless the queryset is filtered further.
+        """
+        clone = self.filter(timestamp__gte=start, timestamp__lt=end)
+        clone._archive_range = (start, end)
+        return clone
+
+    def period(self, kind, anchor=None, tz=None):
+        """
+        Get the requests of the ``"day"``, ``"week"``, ``"month"`` or
+        ``"year"`` holding ``anchor`` (now by default), with the boundaries
+        taken in ``tz`` (the current time zone by default).
+        """
+        return self.between(*period_range(kind, anchor, tz))
+
     def year(self, year):
-        return self.filter(timestamp__year=year)
+        return self.period("year", datetime.date(int(year), 1, 1))
 
     def month(self, year=None, month=None, month_format="%b", date=None):
         if not date:
             try:
                 if year and month:
-                    date = timezone.make_aware(datetime.datetime(*time.strptime(year + month, "%Y" + month_format)[:3]))
+                    date = datetime.date(*time.strptime(year + month, "%Y" + month_format)[:3])
                 else:
                     raise TypeError("Request.objects.month() takes exactly 2 arguments")
             except ValueError:
                 return
-
-        # Truncate to date.
-        if isinstance(date, datetime.datetime):
-            date = date.date()
-
-        first_day = datetime.datetime.combine(date, datetime.time.min)
-        last_day = first_day + datetime.timedelta(days=7)
-        return self.filter(
-            time__gte=handle_naive_datetime(first_day),
-            time__lt=handle_naive_datetime(last_day),
-        )
+        return self.period("month", date)
 
     def week(self, year, week):
         try:
-            date = timezone.make_aware(datetime.datetime(*time.strptime(year + "-0-" + week, "%Y-%w-%U")[:3]))
+            date = datetime.date(*time.strptime(year + "-0-" + week, "%Y-%w-%U")[:3])
         except ValueError:
             return
-
-        # Calculate first and last day of week, for use in a date-range lookup.
-        first_day = date
-        last_day = date + datetime.timedelta(days=7)
-        lookup_kwargs = {
-            "timestamp__gte": first_day,
-            "timestamp__lt": last_day,
-        }
-
-        return self.filter(**lookup_kwargs)
+        return self.period("week", date)
 
     def day(self, year=None, month=None, day=None, month_format="%b", day_format="%d", date=None):
         if not date:
             try:
                 if year and month and day:
-                    date = timezone.make_aware(
-                        datetime.datetime(*time.strptime(year + month + day, "%Y" + month_format + day_format)[:3])
-                    )
+                    date = datetime.date(*time.strptime(year + month + day, "%Y" + month_format + day_format)[:3])
                 else:
                     raise TypeError("Request.objects.day() takes exactly 3 arguments")
             except ValueError:
                 return
-
-        return self.filter(
-            time__range=(
-                handle_naive_datetime(datetime.datetime.combine(date, datetime.time.min)),
-                handle_naive_datetime(datetime.datetime.combine(date, datetime.time.max)),
-            )
-        )
+        return self.period("day", date)
 
     def today(self):
-        return self.day(date=datetime.date.today())
+        return self.period("day")
 
     def this_year(self):
-        return self.year(timezone.now().year)
+        return self.period("year")
 
     def this_month(self):
-        return self.month(date=datetime.date.today())
+        return self.period("month")
 
     def this_week(self):
-        today = datetime.date.today()
-        return self.week(str(today.year), today.strftime("%U"))
+        return self.period("week")
 
     def unique_visits(self):
-        return self.exclude(referer__startswith=settings.BASE_URL)
+        return self.exclude(**{string_lookup("referer", "startswith"): settings.BASE_URL})
 
     def attr_list(self, name):
         return [getattr(item, name, None) for item in self if hasattr(item, name)]
 
     def search(self):
-        return self.filter(Q(referer__contains="google") | Q(referer__contains="yahoo") | Q(referer__contains="bing"))
+        query = Q()
+        for engine in SEARCH_ENGINES:
+            query |= Q(**{string_lookup("referer", "icontains"): engine})
+        return self.filter(query)
+
+    def humans(self):
+        """
+        Exclude the requests of bots (see ``settings.BOT_PATTERNS``), using
+        the partial index on the human traffic. The time range of
+        ``between()`` is kept, for the archived requests.
+        """
+        clone = self.filter(is_bot=False)
+        clone._archive_range = self._archive_range
+        return clone
+
+    def bots(self):
+        return self.filter(is_bot=True)
+
+    def errors(self):
+        """
+        Keep the requests answered with an error. Narrower status filters
+        should be added to this one: the partial indexes of
+        ``settings.ERROR_INDEXES`` are only used by the queries repeating
+        their condition (SQLite can't infer it from ``status_code = 404``).
+        """
+        return self.filter(status_code__gte=400)
+
+    # Case insensitive substring searches, served by the trigram indexes on
+    # PostgreSQL when settings.TRIGRAM_INDEXES is enabled.
+
+    def path_contains(self, text):
+        return self.filter(**{string_lookup("path", "icontains"): text})
+
+    def referer_contains(self, text):
+        return self.filter(**{string_lookup("referer", "icontains"): text})
+
+    def user_agent_contains(self, text):
+        return self.filter(**{string_lookup("user_agent", "icontains"): text})
+
+    def top(self, field, limit=10):
+        """
+        Get the most frequent non empty values of the string ``field``, as a
+        list of ``{field: value, "<field>__count": count, "<field>_term": id}``
+        dicts, all of them when ``limit`` is ``None``.
+
+        With ``settings.NORMALIZE_STRINGS`` the rows are grouped by the integer
+        term ids, and the strings of the top ones only are fetched.
+        """
+        count, term = f"{field}__count", f"{field}_term"
+        if settings.NORMALIZE_STRINGS and field in NORMALIZED_FIELDS:
+            qs = self.exclude(**{term: None}).values(term).annotate(**{count: Count("pk")}).order_by(f"-{count}")
+            rows = list(qs[:limit] if limit is not None else qs)
+            values = interner.values([row[term] for row in rows], using=self.db)
+            for row in rows:
+                row[field] = values.get(row[term], "")
+            return rows
+        qs = self.exclude(**{field: ""}).values(field).annotate(**{count: Count("pk")}).order_by(f"-{count}")
+        rows = list(qs[:limit] if limit is not None else qs)
+        for row in rows:
+            row[term] = None
+        return rows
 
 
 class RequestManager(models.Manager.from_queryset(RequestQuerySet)):
@@ -143,14 +338,133 @@ class RequestManager(models.Manager.from_queryset(RequestQuerySet)):
         [<User: kylef>, <User: krisje8>]
         """
 
-        qs = self.exclude(user_id=None)
+        from .models import LastSeen
+
+        qs = LastSeen.objects.db_manager(self.db).all()
 
         if options:
             timestamp = timezone.now() - datetime.timedelta(**options)
             qs = qs.filter(timestamp__gte=timestamp)
 
-        user_ids = qs.values_list("user_id", flat=True).order_by("user_id").distinct()
+        user_ids = qs.values_list("user_id", flat=True)
 
         return get_user_model().objects.filter(
             pk__in=list(user_ids),  # explicit cast to list, otherwise django will join between unrelated databases
         )
+
+    def bulk_insert(self, requests, batch_size=10000):
+        """
+        Insert the unsaved ``requests`` in batches of ``batch_size``, with
+        ``COPY`` on PostgreSQL and ``bulk_create()`` elsewhere, and return how
+        many were inserted.
+
+        As with ``bulk_create()``, ``save()`` isn't called and the ids aren't
+        set on the instances, but the strings and the headers are interned as
+        ``save()`` does. Each batch is published to the live feed.
+        """
+        requests = iter(requests)
+        count = 0
+        while True:
+            batch = list(islice(requests, batch_size))
+            if not batch:
+                return count
+            interned = [intern_fields(request, using=self.db) for request in batch]
+            try:
+                if connections[self.db].vendor == "postgresql":
+                    self._copy(batch)
+                else:
+                    self.bulk_create(batch)
+            finally:
+                for request, fields in zip(batch, interned):
+                    for field, value in fields.items():
+                        setattr(request, field, value)
+            live.publish(batch, using=self.db)
+            count += len(batch)
+
+    def _copy(self, requests):
+        connection = connections[self.db]
+        fields = [field for field in self.model._meta.concrete_fields if not field.primary_key]
+        buffer = io.StringIO()
+        for request in requests:
+            values = (copy_prep_value(field, field.pre_save(request, True), connection) for field in fields)
+            buffer.write(",".join(map(copy_value, values)) + "\n")
+        buffer.seek(0)
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+class LastSeenManager(models.Manager):
+    def __init__(self):
+        super().__init__()
+        self._touched = {}
+
+    def touch(self, user_id, timestamp):
+        """
+        Record that the user has been seen at ``timestamp``.
+
+        Users already seen by this process in the last
+        ``settings.PRESENCE_RESOLUTION`` seconds are skipped, so most
+        requests don't issue any query.
+        """
+        last = self._touched.get(user_id)
+        if last is not None and abs((timestamp - last).total_seconds()) < settings.PRESENCE_RESOLUTION:
+            return
+
+        if not self.filter(pk=user_id, timestamp__lt=timestamp).update(timestamp=timestamp):
+            try:
+                with transaction.atomic(using=self.db):
+                    self.create(user_id=user_id, timestamp=timestamp)
+            except IntegrityError:
+                pass  # already seen with a newer timestamp, or created by a concurrent request
+
+        def remember():
+            if len(self._touched) >= 10000:
+                self._touched.clear()
+            self._touched[user_id] = timestamp
+
+        transaction.on_commit(remember, using=self.db)
+
+
+class HostnameManager(models.Manager):
+    def expired(self):
+        """
+        Get the hostnames resolved more than ``settings.HOSTNAME_TTL`` seconds
+        ago, which ``resolve()`` doesn't use anymore.
+        """
+        return self.filter(timestamp__lt=timezone.now() - datetime.timedelta(seconds=settings.HOSTNAME_TTL))
+
+    def resolve(self, ips):
+        """
+        Get the hostnames of ``ips`` as a dict, ``""`` for the addresses
+        without a name.
+
+        Addresses are looked up in the process cache, then in the table of
+        hostnames resolved in the last ``settings.HOSTNAME_TTL`` seconds, then
+        in the DNS, concurrently. Addresses the DNS didn't resolve in time are
+        left out.
+        """
+        ips = {ip for ip in ips if ip}
+        hostnames = resolver.cached(ips)
+        missing = ips.difference(hostnames)
+        if missing:
+            now = timezone.now()
+            since = now - datetime.timedelta(seconds=settings.HOSTNAME_TTL)
+            for ip, hostname, timestamp in self.filter(pk__in=missing, timestamp__gte=since).values_list(
+                "ip", "hostname", "timestamp"
+            ):
+                hostnames[ip] = hostname
+                resolver.store(ip, hostname, ttl=(timestamp - since).total_seconds())
+            missing.difference_update(hostnames)
+        if missing:
+            resolved = resolver.resolve_many(missing)
+            if resolved:
+                now = timezone.now()
+                self.filter(pk__in=list(resolved)).delete()
+                self.bulk_create(
+                    [self.model(ip=ip, hostname=hostname, timestamp=now) for ip, hostname in resolved.items()],
+                    ignore_conflicts=True,
+                )
+            hostnames.update(resolved)
+        return hostnames
@@ -21,37 +21,60 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+from time import perf_counter
+
 from django.utils.deprecation import MiddlewareMixin
 
-from . import settings
+from . import counters, live, recent, settings
 from .models import Request
 from .router import Patterns
 
 
 class RequestMiddleware(MiddlewareMixin):
+    def process_request(self, request):
+        request._metrics_started = perf_counter()
+
     def process_response(self, request, response):
         if request.method.lower() not in settings.VALID_METHOD_NAMES:
             return response
 
-        if response.status_code < 400 and settings.ONLY_ERRORS:
+        store = response.status_code >= 400 or not settings.ONLY_ERRORS
+        if not store and not settings.COUNTERS and not settings.RECENT_REQUESTS:
+            return response
+
+        if self.ignored(request):
             return response
 
+        r = Request()
+        r.from_http_request(request, response, commit=False)
+
+        started = getattr(request, "_metrics_started", None)
+        duration = perf_counter() - started if started is not None else None
+        if settings.COUNTERS:
+            counters.record(r, route=getattr(request.resolver_match, "route", None) or "", duration=duration)
+        if settings.RECENT_REQUESTS:
+            recent.capture(r, duration)
+
+        if store:
+            r.save()
+            live.publish([r])
+
+        return response
+
+    def ignored(self, request):
         ignore = Patterns(False, *settings.IGNORE_PATHS)
         if ignore.resolve(request.path[1:]):
-            return response
+            return True
 
         if request.META.get("REMOTE_ADDR") in settings.IGNORE_IP:
-            return response
+            return True
 
         ignore = Patterns(False, *settings.IGNORE_USER_AGENTS)
         if ignore.resolve(request.META.get("HTTP_USER_AGENT", "")):
-            return response
+            return True
 
         if getattr(request, "user", False):
             if request.user.get_username() in settings.IGNORE_USERNAME:
-                return response
-
-        r = Request()
-        r.from_http_request(request, response)
+                return True
 
-        return response
+        return False
@@ -0,0 +1,78 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from django.db import migrations, models
+from django.db.models import Max, Min
+
+# Requests aggregated by each query, by id range.
+CHUNK_SIZE = 100000
+
+
+def populate_last_seen(apps, schema_editor):
+    # active_users() reads the table for any window, so all the requests are
+    # covered, a range of ids at a time to keep each query short.
+    Request = apps.get_model("metrics", "Request")
+    LastSeen = apps.get_model("metrics", "LastSeen")
+    db_alias = schema_editor.connection.alias
+    requests = Request.objects.using(db_alias)
+    bounds = requests.aggregate(first=Min("pk"), last=Max("pk"))
+    if bounds["first"] is None:
+        return
+    last_seen = {}
+    for start in range(bounds["first"], bounds["last"] + 1, CHUNK_SIZE):
+        users = (
+            requests.filter(pk__gte=start, pk__lt=start + CHUNK_SIZE)
+            .exclude(user_id=None)
+            .values("user_id")
+            .annotate(timestamp=Max("timestamp"))
+            .order_by()
+        )
+        for user in users:
+            if user["user_id"] not in last_seen or user["timestamp"] > last_seen[user["user_id"]]:
+                last_seen[user["user_id"]] = user["timestamp"]
+    LastSeen.objects.using(db_alias).bulk_create(
+        [LastSeen(user_id=user_id, timestamp=timestamp) for user_id, timestamp in last_seen.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("metrics", "0008_switch_to_big_auto_field"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LastSeen",
+            fields=[
+                ("user_id", models.IntegerField(primary_key=True, serialize=False, verbose_name="user")),
+                ("timestamp", models.DateTimeField(db_index=True, verbose_name="timestamp")),
+            ],
+            options={
+                "verbose_name": "last seen",
+                "verbose_name_plural": "last seen",
+            },
+        ),
+        migrations.RunPython(populate_last_seen, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,125 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+
+from django.conf import settings
+from django.db import IntegrityError, migrations, transaction
+
+# As in metrics.interning when this migration was written, the migration must
+# not depend on the live code.
+NORMALIZED_FIELDS = ("path", "full_path", "referer", "user_agent", "language")
+TERM_FIELDS = [f"{field}_term" for field in NORMALIZED_FIELDS]
+CHUNK_SIZE = 10000
+CACHE_SIZE = 10000
+
+
+def get_digest(value):
+    return hashlib.sha1(value.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def get_term_id(Term, db_alias, kind, value):
+    lookup = {"kind": kind, "digest": get_digest(value)}
+    pk = Term.objects.using(db_alias).filter(**lookup).values_list("pk", flat=True).first()
+    if pk is None:
+        try:
+            with transaction.atomic(using=db_alias):
+                pk = Term.objects.using(db_alias).create(value=value, **lookup).pk
+        except IntegrityError:
+            # Created by a concurrent request.
+            pk = Term.objects.using(db_alias).filter(**lookup).values_list("pk", flat=True).get()
+    return pk
+
+
+def normalize(requests, Term, db_alias, ids):
+    changed = []
+    for request in requests:
+        fields = [field for field in NORMALIZED_FIELDS if getattr(request, field)]
+        for field in fields:
+            key = (field, getattr(request, field))
+            if key not in ids:
+                if len(ids) >= CACHE_SIZE:
+                    ids.clear()
+                ids[key] = get_term_id(Term, db_alias, *key)
+            setattr(request, f"{field}_term_id", ids[key])
+            setattr(request, field, "")
+        if fields:
+            changed.append(request)
+    return changed
+
+
+def denormalize(requests, Term, db_alias, ids):
+    pks = list({getattr(request, f"{field}_term_id") for request in requests for field in NORMALIZED_FIELDS} - {None})
+    values = {}
+    for start in range(0, len(pks), 500):
+        values.update(Term.objects.using(db_alias).filter(pk__in=pks[start : start + 500]).values_list("pk", "value"))
+    changed = []
+    for request in requests:
+        fields = [field for field in NORMALIZED_FIELDS if getattr(request, f"{field}_term_id") is not None]
+        for field in fields:
+            setattr(request, field, values.get(getattr(request, f"{field}_term_id"), ""))
+            setattr(request, f"{field}_term_id", None)
+        if fields:
+            changed.append(request)
+    return changed
+
+
+def convert_requests(apps, schema_editor, convert):
+    Request = apps.get_model("metrics", "Request")
+    Term = apps.get_model("metrics", "Term")
+    db_alias = schema_editor.connection.alias
+    ids = {}
+    last_pk = 0
+    while True:
+        # Each chunk is committed on its own.
+        with transaction.atomic(using=db_alias):
+            qs = Request.objects.using(db_alias).filter(pk__gt=last_pk).order_by("pk")
+            chunk = list(qs.only(*NORMALIZED_FIELDS, *TERM_FIELDS)[:CHUNK_SIZE])
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+            changed = convert(chunk, Term, db_alias, ids)
+            if changed:
+                Request.objects.using(db_alias).bulk_update(changed, [*NORMALIZED_FIELDS, *TERM_FIELDS], batch_size=1000)
+
+
+def forwards(apps, schema_editor):
+    if getattr(settings, "METRICS_NORMALIZE_STRINGS", False):
+        convert_requests(apps, schema_editor, normalize)
+
+
+def backwards(apps, schema_editor):
+    convert_requests(apps, schema_editor, denormalize)
+
+
+class Migration(migrations.Migration):
+    # The requests are converted in chunks, each one committed on its own.
+    atomic = False
+
+    dependencies = [
+        ("metrics", "0013_term"),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
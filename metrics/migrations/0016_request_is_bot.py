@@ -0,0 +1,70 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from django.db import migrations, models
+
+HUMAN_INDEX = models.Index(
+    condition=models.Q(("is_bot", False)),
+    fields=["timestamp", "id"],
+    name="metrics_request_human_ts_idx",
+)
+
+
+def create_human_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        # CONCURRENTLY doesn't lock the writes to the requests table while the
+        # index is built.
+        schema_editor.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {HUMAN_INDEX.name} "
+            'ON metrics_request ("timestamp", "id") WHERE NOT "is_bot"'
+        )
+    else:
+        schema_editor.add_index(apps.get_model("metrics", "Request"), HUMAN_INDEX)
+
+
+def drop_human_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {HUMAN_INDEX.name}")
+    else:
+        schema_editor.remove_index(apps.get_model("metrics", "Request"), HUMAN_INDEX)
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run in a transaction.
+    atomic = False
+
+    dependencies = [
+        ("metrics", "0015_headerset"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="request",
+            name="is_bot",
+            field=models.BooleanField(default=False, verbose_name="is bot"),
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(create_human_index, drop_human_index)],
+            state_operations=[migrations.AddIndex(model_name="request", index=HUMAN_INDEX)],
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from django.db import migrations
+
+from metrics.operations import OptionalRunSQL
+
+# Partial indexes on the error requests, by name and column. The path is
+# grouped by its term id with METRICS_NORMALIZE_STRINGS, which can be switched
+# after migrating, so both columns are indexed.
+ERROR_INDEXES = {
+    "metrics_request_error_ts_idx": "timestamp",
+    "metrics_request_error_path_idx": "path",
+    "metrics_request_error_path_term_idx": "path_term_id",
+}
+# The condition of RequestQuerySet.errors().
+ERROR_CONDITION = "status_code >= 400"
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run in a transaction, and doesn't lock
+    # the requests table while the indexes are built.
+    atomic = False
+
+    dependencies = [
+        ("metrics", "0016_request_is_bot"),
+    ]
+
+    operations = [
+        OptionalRunSQL(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON metrics_request ({column}) WHERE {ERROR_CONDITION}",
+            reverse_sql=f"DROP INDEX CONCURRENTLY IF EXISTS {name}",
+            setting="ERROR_INDEXES",
+        )
+        for name, column in ERROR_INDEXES.items()
+    ] + [
+        OptionalRunSQL(
+            f"CREATE INDEX IF NOT EXISTS {name} ON metrics_request ({column}) WHERE {ERROR_CONDITION}",
+            reverse_sql=f"DROP INDEX IF EXISTS {name}",
+            setting="ERROR_INDEXES",
+            vendor="sqlite",
+        )
+        for name, column in ERROR_INDEXES.items()
+    ]
@@ -21,16 +21,17 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from socket import gethostbyaddr
-
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db.models import Q
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from . import settings
+from .bots import is_bot
 from .fields import JSONField, StringField, URLField
-from .managers import RequestManager
+from .interning import intern_fields
+from .managers import HostnameManager, LastSeenManager, RequestManager
 from .utils import browsers, engines, HTTP_STATUS_CODES
 
 
@@ -56,12 +57,77 @@ class Request(models.Model):
     referer = URLField(blank=True, verbose_name=_("referer"))
     user_agent = StringField(blank=True, verbose_name=_("user agent"))
     language = StringField(blank=True, verbose_name=_("language"))
+    is_bot = models.BooleanField(default=False, verbose_name=_("is bot"))
+
+    # With settings.NORMALIZE_STRINGS, the ids of the Term rows of the string
+    # columns above, stored empty.
+    path_term = models.ForeignKey(
+        "Term", models.DO_NOTHING, null=True, blank=True, editable=False, db_constraint=False, related_name="+"
+    )
+    full_path_term = models.ForeignKey(
+        "Term",
+        models.DO_NOTHING,
+        null=True,
+        blank=True,
+        editable=False,
+        db_constraint=False,
+        db_index=False,
+        related_name="+",
+    )
+    referer_term = models.ForeignKey(
+        "Term",
+        models.DO_NOTHING,
+        null=True,
+        blank=True,
+        editable=False,
+        db_constraint=False,
+        db_index=False,
+        related_name="+",
+    )
+    user_agent_term = models.ForeignKey(
+        "Term",
+        models.DO_NOTHING,
+        null=True,
+        blank=True,
+        editable=False,
+        db_constraint=False,
+        db_index=False,
+        related_name="+",
+    )
+    language_term = models.ForeignKey(
+        "Term",
+        models.DO_NOTHING,
+        null=True,
+        blank=True,
+        editable=False,
+        db_constraint=False,
+        db_index=False,
+        related_name="+",
+    )
+
+    # With settings.DEDUPLICATE_HEADERS, the id of the HeaderSet of the
+    # headers, stored empty.
+    header_set = models.ForeignKey(
+        "HeaderSet",
+        models.DO_NOTHING,
+        null=True,
+        blank=True,
+        editable=False,
+        db_constraint=False,
+        db_index=False,
+        related_name="+",
+    )
 
     objects = RequestManager()
 
     class Meta:
         verbose_name = _("request")
         verbose_name_plural = _("requests")
+        indexes = [
+            models.Index(fields=["timestamp", "id"], name="metrics_request_ts_id_idx"),
+            # Only the human traffic, see RequestQuerySet.humans().
+            models.Index(fields=["timestamp", "id"], name="metrics_request_human_ts_idx", condition=Q(is_bot=False)),
+        ]
 
     def __str__(self):
         return f"[{self.timestamp}] {self.method} {self.path} {self.status_code}"
@@ -76,17 +142,31 @@ class Request(models.Model):
         if not settings.LOG_USER:
             self.user_id = None
 
-        super().save(*args, **kwargs)
+        interned = intern_fields(self, using=kwargs.get("using"))
+        try:
+            super().save(*args, **kwargs)
+        finally:
+            for field, value in interned.items():
+                setattr(self, field, value)
+
+        if self.user_id and settings.TRACK_PRESENCE:
+            LastSeen.objects.db_manager(self._state.db).touch(self.user_id, self.timestamp)
 
     @property
     def user(self):
-        if self.user_id:
-            return get_user_model().objects.get(pk=self.user_id)
-        return None
+        if not self.user_id:
+            return None
+        # The id the user was looked up for, and the user, None once deleted.
+        user_id, user = getattr(self, "_user_cache", (None, None))
+        if user_id != self.user_id:
+            user = get_user_model()._default_manager.filter(pk=self.user_id).first()
+            self._user_cache = (self.user_id, user)
+        return user
 
     @user.setter
     def user(self, user):
         self.user_id = user.pk
+        self._user_cache = (user.pk, user)
 
     def from_http_request(self, request, response=None, commit=True):
         # Request information.
@@ -106,6 +186,7 @@ class Request(models.Model):
         self.referer = request.META.get("HTTP_REFERER", "")
         self.user_agent = request.META.get("HTTP_USER_AGENT", "")
         self.language = request.META.get("HTTP_ACCEPT_LANGUAGE", "")
+        self.is_bot = is_bot(self.user_agent)
 
         if hasattr(request, "user") and hasattr(request.user, "is_authenticated"):
             if request.user.is_authenticated:
@@ -142,7 +223,84 @@ class Request(models.Model):
 
     @property
     def hostname(self):
-        try:
-            return gethostbyaddr(self.ip)[0]
-        except Exception:  # socket.gaierror, socket.herror, etc
-            return self.ip
+        if not hasattr(self, "_hostname_cache"):
+            hostname = Hostname.objects.db_manager(self._state.db).resolve([self.ip]).get(self.ip)
+            if hostname is None:
+                return self.ip  # not resolved in time, try again next time
+            self._hostname_cache = hostname
+        return self._hostname_cache or self.ip
+
+
+class LastSeen(models.Model):
+    """
+    Time of the latest request of each user, used to find active users
+    without scanning the requests.
+    """
+
+    user_id = models.IntegerField(primary_key=True, verbose_name=_("user"))
+    timestamp = models.DateTimeField(db_index=True, verbose_name=_("timestamp"))
+
+    objects = LastSeenManager()
+
+    class Meta:
+        verbose_name = _("last seen")
+        verbose_name_plural = _("last seen")
+
+    def __str__(self):
+        return f"{self.user_id} [{self.timestamp}]"
+
+
+class Hostname(models.Model):
+    """
+    Reverse DNS names of the IP addresses, so the pages showing them don't
+    wait for the DNS.
+    """
+
+    ip = models.GenericIPAddressField(primary_key=True, verbose_name=_("ip address"))
+    hostname = StringField(blank=True, verbose_name=_("hostname"))
+    timestamp = models.DateTimeField(default=timezone.now, verbose_name=_("timestamp"))
+
+    objects = HostnameManager()
+
+    class Meta:
+        verbose_name = _("hostname")
+        verbose_name_plural = _("hostnames")
+
+    def __str__(self):
+        return f"{self.ip} {self.hostname}"
+
+
+class Term(models.Model):
+    """
+    Strings of the ``Request`` columns stored once, see
+    ``settings.NORMALIZE_STRINGS``.
+    """
+
+    kind = models.CharField(max_length=20, verbose_name=_("kind"))
+    digest = models.CharField(max_length=40, verbose_name=_("digest"))
+    value = StringField(verbose_name=_("value"))
+
+    class Meta:
+        verbose_name = _("term")
+        verbose_name_plural = _("terms")
+        unique_together = [("kind", "digest")]
+
+    def __str__(self):
+        return self.value
+
+
+class HeaderSet(models.Model):
+    """
+    Headers captured with the requests stored once, see
+    ``settings.DEDUPLICATE_HEADERS``.
+    """
+
+    digest = models.CharField(max_length=40, unique=True, verbose_name=_("digest"))
+    headers = JSONField(default=dict, verbose_name=_("headers"))
+
+    class Meta:
+        verbose_name = _("header set")
+        verbose_name_plural = _("header sets")
+
+    def __str__(self):
+        return self.digest
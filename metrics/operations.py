@@ -0,0 +1,66 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from django.db import migrations
+
+from . import settings
+
+
+class OptionalRunSQL(migrations.RunSQL):
+    """
+    ``RunSQL`` for optional, database specific schema changes (e.g. index
+    types only PostgreSQL has).
+
+    The SQL runs only on ``vendor`` databases and, when ``setting`` is given,
+    only if that ``metrics.settings`` value is enabled at migration time.
+    ``reverse_sql`` runs on every ``vendor`` database, so it must not fail when
+    the forward SQL was skipped (use ``IF EXISTS``).
+    """
+
+    def __init__(self, sql, reverse_sql=None, setting=None, vendor="postgresql", **kwargs):
+        self.setting = setting
+        self.vendor = vendor
+        super().__init__(sql, reverse_sql, **kwargs)
+
+    def deconstruct(self):
+        name, args, kwargs = super().deconstruct()
+        if self.setting is not None:
+            kwargs["setting"] = self.setting
+        kwargs["vendor"] = self.vendor
+        return name, args, kwargs
+
+    def is_enabled(self, connection):
+        return connection.vendor == self.vendor and (self.setting is None or bool(getattr(settings, self.setting)))
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if self.is_enabled(schema_editor.connection):
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == self.vendor:
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+    def describe(self):
+        if self.setting is None:
+            return f"Raw SQL operation ({self.vendor} only)"
+        return f"Raw SQL operation ({self.vendor} only, if {self.setting} is enabled)"
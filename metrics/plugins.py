@@ -21,12 +21,18 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from django.db.models import Count
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import threading
+import time
+
+from django.db import connections
 from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone, translation
 
-from . import settings
+from . import recent, settings
 from .models import Request
-from .traffic import modules
+from .traffic import is_search_referer, modules
 from .utils import get_verbose_name
 
 
@@ -55,6 +61,22 @@ def set_count(items):
     return [(k, v) for v, k in items]
 
 
+def weighted_count(items):
+    """
+    Like ``set_count()``, for ``(item, count)`` pairs.
+
+    Example:
+        >>> weighted_count([("apple", 2), ("lemon", 3), ("apple", 2)])
+        [("apple", 4), ("lemon", 3)]
+    """
+    item_count = {}
+    for item, count in items:
+        if not item:
+            continue
+        item_count[item] = item_count.get(item, 0) + count
+    return sorted(item_count.items(), key=lambda item: (item[1], item[0]), reverse=True)
+
+
 class Plugins:
     def load(self):
         from importlib import import_module
@@ -88,11 +110,24 @@ class Plugins:
 
     plugins = property(plugins)
 
+    def get(self, name):
+        """
+        Get the plugin by its lowercase class name, or raise ``KeyError``.
+        """
+        for plugin in self.plugins:
+            if plugin.module_name.lower() == name:
+                return plugin
+        raise KeyError(name)
+
 
 plugins = Plugins()
 
 
 class Plugin:
+    # Requests in memory (a metrics.analytics.Frame) with the "memory"
+    # settings.OVERVIEW_BACKEND, else None.
+    frame = None
+
     def __init__(self):
         self.module_name = self.__class__.__name__
 
@@ -102,6 +137,13 @@ class Plugin:
     def template_context(self):
         return {}
 
+    def frame_context(self, frame):
+        """
+        Like ``template_context()``, computed from the requests of ``frame``.
+        Plugins without a vectorized implementation query the database.
+        """
+        return self.template_context()
+
     def render(self):
         templates = [
             f"metrics/plugins/{self.__class__.__name__.lower()}.html",
@@ -111,15 +153,114 @@ class Plugin:
         if hasattr(self, "template"):
             templates.insert(0, self.template)
 
-        kwargs = self.template_context()
+        kwargs = self.template_context() if self.frame is None else self.frame_context(self.frame)
         kwargs["verbose_name"] = self.verbose_name
         kwargs["plugin"] = self
         return render_to_string(templates, kwargs)
 
+    def render_timeout(self, timeout):
+        """
+        Render the placeholder shown when the plugin took longer than
+        ``timeout`` seconds.
+        """
+        return render_to_string(
+            "metrics/plugins/timeout.html",
+            {"verbose_name": self.verbose_name, "plugin": self, "timeout": timeout},
+        )
+
+
+class PluginRenderer:
+    """
+    Render the plugins of the overview concurrently on a pool of ``threads``,
+    each with its own database connections, or one after another without
+    ``threads``.
+
+    The plugins are rendered in their threads too, as their context usually
+    holds querysets evaluated by the template, with the language and the time
+    zone of the calling thread. A plugin not rendered within ``timeout``
+    seconds of getting a thread, or not getting one within ``timeout``
+    seconds, is replaced by a placeholder. A plugin timed out keeps its
+    thread until it's done, and no work is handed to the pool meanwhile.
+    """
+
+    def __init__(self, threads=0, timeout=10.0):
+        self.threads = threads
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+
+    def _render(self, plugin, language, tz):
+        try:
+            with translation.override(language), timezone.override(tz):
+                return plugin.render()
+        finally:
+            # Don't leave the connections of the pool threads open between
+            # requests.
+            connections.close_all()
+
+    def _get_slots(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix="metrics-plugins")
+                self._slots = threading.BoundedSemaphore(self.threads)
+        return self._slots
+
+    def _submit(self, plugin, *args):
+        # The slot is released once the plugin is done, even after it timed
+        # out, so a busy thread is never handed more work.
+        future = self._executor.submit(self._render, plugin, *args)
+        future.add_done_callback(lambda future: self._slots.release())
+        return future
+
+    def render(self, plugins):
+        """
+        Get the HTML of ``plugins``, in order.
+        """
+        if not self.threads:
+            return [plugin.render() for plugin in plugins]
+
+        args = (translation.get_language(), timezone.get_current_timezone())
+        slots = self._get_slots()
+        rendered = [None] * len(plugins)
+        pending = list(enumerate(plugins))
+        running = {}
+        while pending or running:
+            while pending and slots.acquire(timeout=0 if running else self.timeout):
+                index, plugin = pending.pop(0)
+                running[self._submit(plugin, *args)] = (index, time.monotonic() + self.timeout)
+            if not running:
+                # No thread freed up in time.
+                index, plugin = pending.pop(0)
+                rendered[index] = plugin.render_timeout(self.timeout)
+                continue
+            deadline = min(deadline for index, deadline in running.values())
+            done, not_done = wait(running, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            for future, (index, deadline) in list(running.items()):
+                if future in done:
+                    rendered[index] = future.result()
+                elif deadline <= now:
+                    rendered[index] = plugins[index].render_timeout(self.timeout)
+                else:
+                    continue
+                del running[future]
+        return rendered
+
+
+renderer = PluginRenderer(threads=settings.PLUGIN_THREADS, timeout=settings.PLUGIN_TIMEOUT)
+
 
 class LatestRequests(Plugin):
     def template_context(self):
-        return {"requests": Request.objects.order_by("-timestamp").all()[:5]}
+        if settings.LATEST_REQUESTS_SOURCE == "buffer":
+            requests = recent.latest(5)
+        else:
+            requests = Request.objects.order_by("-timestamp").prefetch_users()[:5]
+        return {
+            "requests": requests,
+            "live_url": reverse("admin:metrics_request_live") if settings.LIVE_FEED else None,
+        }
 
 
 class TrafficInformation(Plugin):
@@ -134,35 +275,60 @@ class TopPaths(Plugin):
     def queryset(self):
         return self.qs.filter(status_code__lt=400)
 
+    def select(self, frame):
+        return frame.take(frame["status_code"] < 400)
+
     def template_context(self):
-        return {"paths": self.queryset().values("path").annotate(Count("path")).order_by("-path__count")[:10]}
+        return {"paths": self.queryset().top("path")}
+
+    def frame_context(self, frame):
+        return {"paths": self.select(frame).top("path")}
 
 
 class TopErrorPaths(TopPaths):
     template = "metrics/plugins/toppaths.html"
 
     def queryset(self):
-        return self.qs.filter(status_code__gte=400)
+        return self.qs.errors()
+
+    def select(self, frame):
+        return frame.take(frame["status_code"] >= 400)
 
 
 class TopReferrers(Plugin):
     def queryset(self):
-        return self.qs.unique_visits().exclude(referer="")
+        return self.qs.unique_visits()
 
     def template_context(self):
-        return {
-            "referrers": self.queryset().values("referer").annotate(Count("referer")).order_by("-referer__count")[:10]
-        }
+        return {"referrers": self.queryset().top("referer")}
+
+    def frame_context(self, frame):
+        internal = frame.matches("referer", lambda referer: referer.startswith(settings.BASE_URL))
+        return {"referrers": frame.take(~internal).top("referer")}
 
 
 class TopSearchPhrases(Plugin):
     def template_context(self):
-        return {"phrases": set_count(self.qs.search().only("referer").attr_list("keywords"))[:10]}
+        return self.get_context(self.qs.search().top("referer", limit=None))
+
+    def frame_context(self, frame):
+        return self.get_context(frame.take(frame.matches("referer", is_search_referer)).top("referer", limit=None))
+
+    def get_context(self, referrers):
+        phrases = ((Request(referer=row["referer"]).keywords, row["referer__count"]) for row in referrers)
+        return {"phrases": weighted_count(phrases)[:10]}
 
 
 class TopBrowsers(Plugin):
     def template_context(self):
-        return {"browsers": set_count(self.qs.only("user_agent").attr_list("browser"))[:5]}
+        return self.get_context(self.qs.top("user_agent", limit=None))
+
+    def frame_context(self, frame):
+        return self.get_context(frame.top("user_agent", limit=None))
+
+    def get_context(self, user_agents):
+        browsers = ((Request(user_agent=row["user_agent"]).browser, row["user_agent__count"]) for row in user_agents)
+        return {"browsers": weighted_count(browsers)[:5]}
 
 
 class ActiveUsers(Plugin):
@@ -0,0 +1,289 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from collections import namedtuple
+import datetime
+import json
+import logging
+import os
+import socket
+import stat
+import struct
+import threading
+
+from django.conf import settings as django_settings
+from django.utils import timezone
+
+from . import settings
+from .managers import attach_users
+from .models import Request
+
+logger = logging.getLogger("metrics")
+
+# sequence, timestamp, duration, status code, user id, method, ip, path
+RECORD = struct.Struct("=QddHq8s45s128s")
+NO_USER = -1
+
+Capture = namedtuple("Capture", "seq timestamp duration status_code user_id method ip path")
+
+
+def _encode(value, size):
+    # Truncated UTF-8 sequences are dropped when decoded.
+    return (value or "").encode()[:size]
+
+
+def _decode(value):
+    return value.rstrip(b"\0").decode(errors="ignore")
+
+
+class RingBuffer:
+    """
+    Keep the last ``size`` requests captured by the current process, in a
+    preallocated buffer of fixed size records.
+
+    Paths are truncated to 128 bytes. Each record has a sequence number, so
+    readers can ask for the records they haven't seen yet.
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self._buffer = bytearray(RECORD.size * size)
+        self._written = 0
+        self._lock = threading.Lock()
+
+    def append(self, request, duration=None):
+        user_id = NO_USER if request.user_id is None else request.user_id
+        with self._lock:
+            self._written += 1
+            RECORD.pack_into(
+                self._buffer,
+                (self._written - 1) % self.size * RECORD.size,
+                self._written,
+                request.timestamp.timestamp(),
+                -1.0 if duration is None else duration,
+                request.status_code,
+                user_id,
+                _encode(request.method, 8),
+                _encode(request.ip, 45),
+                _encode(request.path, 128),
+            )
+
+    def records(self, after=0, limit=None):
+        """
+        Get the records with a sequence number above ``after``, at most the
+        ``limit`` latest ones, oldest first.
+        """
+        with self._lock:
+            written = self._written
+            data = bytes(self._buffer)
+        first = max(after, written - self.size, 0 if limit is None else written - limit)
+        records = []
+        for seq in range(first + 1, written + 1):
+            seq, stamp, duration, status_code, user_id, method, ip, path = RECORD.unpack_from(
+                data, (seq - 1) % self.size * RECORD.size
+            )
+            records.append(
+                Capture(
+                    seq,
+                    stamp,
+                    None if duration < 0 else duration,
+                    status_code,
+                    None if user_id == NO_USER else user_id,
+                    _decode(method),
+                    _decode(ip),
+                    _decode(path),
+                )
+            )
+        return records
+
+    def clear(self):
+        with self._lock:
+            self._written = 0
+
+
+def to_datetime(stamp):
+    value = datetime.datetime.fromtimestamp(stamp, datetime.timezone.utc)
+    if django_settings.USE_TZ:
+        return value
+    return timezone.make_naive(value, timezone.get_default_timezone())
+
+
+class Server:
+    """
+    Serve the records of ``buffer`` on a Unix socket named after the process
+    id in ``directory``, for ``tailrequests``.
+
+    A client sends a JSON object with ``after`` and ``limit`` (see
+    ``RingBuffer.records()``) on a line, and receives the records as JSON
+    lines. The socket is bound on the first ``start()`` in each process, so
+    forked workers get their own, readable by the user running them only.
+    """
+
+    def __init__(self, buffer, directory):
+        self.buffer = buffer
+        self.directory = directory
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f"{os.getpid()}.sock")
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            try:
+                os.makedirs(self.directory, mode=0o700, exist_ok=True)
+                # Bound and listening under another name first, so that a
+                # client never finds it refusing connections (see poll()).
+                temporary = f"{self.path}.new"
+                if os.path.exists(temporary):
+                    os.unlink(temporary)
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.bind(temporary)
+                os.chmod(temporary, 0o600)
+                sock.listen(8)
+                os.replace(temporary, self.path)
+            except OSError as e:
+                logger.warning("Can't serve the recent requests on %s: %s", self.path, e)
+                return
+            thread = threading.Thread(target=self._serve, args=(sock,), name="metrics-recent", daemon=True)
+            thread.start()
+
+    def _serve(self, sock):
+        while True:
+            connection, address = sock.accept()
+            try:
+                self.handle(connection)
+            except (OSError, TypeError, ValueError) as e:
+                logger.debug("Recent requests client error: %s", e)
+            finally:
+                connection.close()
+
+    def handle(self, connection):
+        connection.settimeout(1.0)
+        with connection.makefile("rwb") as stream:
+            query = json.loads(stream.readline() or b"{}")
+            for record in self.buffer.records(query.get("after", 0), query.get("limit")):
+                stream.write(json.dumps({"pid": os.getpid(), **record._asdict()}).encode() + b"\n")
+
+
+def query(path, after=0, limit=None, timeout=1.0):
+    """
+    Get the records served on the socket at ``path``, as dicts.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        with sock.makefile("rwb") as stream:
+            stream.write(json.dumps({"after": after, "limit": limit}).encode() + b"\n")
+            stream.flush()
+            sock.shutdown(socket.SHUT_WR)
+            return [json.loads(line) for line in stream]
+
+
+def sockets(directory):
+    """
+    Get the paths of the sockets of the processes in ``directory``.
+    """
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, name) for name in names if name.endswith(".sock")]
+
+
+def socket_id(path):
+    """
+    Identify the socket at ``path``: a process reusing the id of a dead one
+    serves on a new socket file at the same path.
+    """
+    info = os.stat(path)
+    return (path, info.st_ino, info.st_ctime_ns)
+
+
+def poll(directory, seen, limit=None):
+    """
+    Get the records of the processes serving on the sockets of ``directory``
+    after the ones in ``seen``, at most ``limit`` each, and remember the
+    latest ones in ``seen``. The sockets left by dead processes are removed.
+    """
+    records = []
+    current = set()
+    for path in sockets(directory):
+        try:
+            key = socket_id(path)
+            current.add(key)
+            process_records = query(path, after=seen.get(key, 0), limit=limit)
+        except ConnectionRefusedError:
+            try:
+                if stat.S_ISSOCK(os.stat(path).st_mode):
+                    os.unlink(path)
+            except OSError:
+                pass
+            continue
+        except OSError:
+            continue
+        if process_records:
+            seen[key] = process_records[-1]["seq"]
+        records.extend(process_records)
+    for key in set(seen).difference(current):
+        del seen[key]
+    return records
+
+
+buffer = RingBuffer(settings.RECENT_REQUESTS or 1)
+server = Server(buffer, settings.RECENT_REQUESTS_SOCKETS) if settings.RECENT_REQUESTS_SOCKETS else None
+
+
+def latest(limit):
+    """
+    Get the ``limit`` latest requests of the buffer, newest first, as unsaved
+    ``Request`` instances.
+    """
+    requests = [
+        Request(
+            timestamp=to_datetime(record.timestamp),
+            method=record.method,
+            path=record.path,
+            status_code=record.status_code,
+            ip=record.ip,
+            user_id=record.user_id,
+        )
+        for record in reversed(buffer.records(limit=limit))
+    ]
+    attach_users(requests)
+    return requests
+
+
+def capture(request, duration=None):
+    """
+    Add a request captured by ``RequestMiddleware`` to the buffer.
+    """
+    buffer.append(request, duration)
+    if server is not None:
+        server.start()
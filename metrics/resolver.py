@@ -0,0 +1,146 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+import socket
+import threading
+import time
+
+from . import settings
+
+
+class Resolver:
+    """
+    Reverse DNS resolver with a bounded, time limited cache.
+
+    ``resolve_many()`` looks up all the addresses not in cache concurrently on
+    a thread pool and waits at most ``timeout`` seconds in all, however many
+    addresses there are: addresses not resolved in time are left out of the
+    result, and cached as soon as their lookup completes. At most
+    ``max_pending`` lookups are queued, so a slow DNS doesn't pile up work
+    behind the busy workers; the addresses over the limit are left out until
+    a later call. Addresses without a name resolve to ``""``.
+
+    ``lookup`` has the signature of ``socket.gethostbyaddr``; tests can pass a
+    stub instead of querying the DNS.
+    """
+
+    def __init__(
+        self, lookup=socket.gethostbyaddr, timeout=1.0, max_workers=8, max_size=4096, ttl=86400, max_pending=256
+    ):
+        self.lookup = lookup
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_size = max_size
+        self.ttl = ttl
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._lock = threading.RLock()
+        self._executor = None
+
+    def cached(self, ips):
+        """
+        Get the cached hostnames of ``ips``, as a dict.
+        """
+        now = time.monotonic()
+        hostnames = {}
+        with self._lock:
+            for ip in ips:
+                entry = self._cache.get(ip)
+                if entry is None:
+                    continue
+                expires, hostname = entry
+                if expires <= now:
+                    del self._cache[ip]
+                    continue
+                self._cache.move_to_end(ip)
+                hostnames[ip] = hostname
+        return hostnames
+
+    def store(self, ip, hostname, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._cache[ip] = (expires, hostname)
+            self._cache.move_to_end(ip)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def _resolve(self, ip):
+        try:
+            hostname = self.lookup(ip)[0]
+        except (OSError, UnicodeError):  # socket.herror, socket.gaierror, etc
+            hostname = ""
+        self.store(ip, hostname)
+        return hostname
+
+    def _submit(self, ip):
+        # Concurrent callers share the lookups in progress.
+        with self._lock:
+            future = self._pending.get(ip)
+            if future is None:
+                if len(self._pending) >= self.max_pending:
+                    return None
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="metrics-resolver")
+                future = self._pending[ip] = self._executor.submit(self._resolve, ip)
+                future.add_done_callback(lambda future: self._done(ip, future))
+        return future
+
+    def _done(self, ip, future):
+        with self._lock:
+            if self._pending.get(ip) is future:
+                del self._pending[ip]
+
+    def resolve_many(self, ips):
+        """
+        Resolve ``ips`` concurrently, returning a dict of the addresses
+        resolved within the timeout.
+        """
+        ips = set(ips)
+        hostnames = self.cached(ips)
+        futures = {ip: self._submit(ip) for ip in ips if ip not in hostnames}
+        futures = {ip: future for ip, future in futures.items() if future is not None}
+        if futures:
+            done, not_done = wait(futures.values(), timeout=self.timeout)
+            hostnames.update((ip, future.result()) for ip, future in futures.items() if future in done)
+        return hostnames
+
+    def resolve(self, ip):
+        """
+        Resolve a single address, or return ``None`` on timeout.
+        """
+        return self.resolve_many([ip]).get(ip)
+
+
+resolver = Resolver(
+    timeout=settings.RESOLVER_TIMEOUT,
+    max_workers=settings.RESOLVER_THREADS,
+    max_size=settings.RESOLVER_CACHE_SIZE,
+    ttl=settings.HOSTNAME_TTL,
+)
@@ -38,6 +38,37 @@ LOG_USER = getattr(settings, "METRICS_LOG_USER", True)
 IGNORE_USERNAME = getattr(settings, "METRICS_IGNORE_USERNAME", tuple())
 IGNORE_PATHS = getattr(settings, "METRICS_IGNORE_PATHS", tuple())
 IGNORE_USER_AGENTS = getattr(settings, "METRICS_IGNORE_USER_AGENTS", tuple())
+BOT_PATTERNS = getattr(
+    settings,
+    "METRICS_BOT_PATTERNS",
+    (
+        r"bot\b",
+        r"crawler",
+        r"spider",
+        r"Yahoo! Slurp",
+        r"Ask Jeeves",
+        r"FollowSite",
+        r"ScoutJet",
+        r"PostRank",
+        r"Sphider",
+        r"Feedfetcher-Google",
+        r"Mediapartners-Google",
+        r"Apple-PubSub",
+        r"IrssiUrlLog",
+        r"Python-urllib",
+        r"python-requests",
+        r"Wget",
+        r"curl/",
+    ),
+)
+TRAFFIC_HUMANS_ONLY = getattr(settings, "METRICS_TRAFFIC_HUMANS_ONLY", True)
+TRACK_PRESENCE = getattr(settings, "METRICS_TRACK_PRESENCE", True)
+PRESENCE_RESOLUTION = getattr(settings, "METRICS_PRESENCE_RESOLUTION", 60)
+ACTIVE_USERS_CACHE_TIMEOUT = getattr(settings, "METRICS_ACTIVE_USERS_CACHE_TIMEOUT", 30)
+HOSTNAME_TTL = getattr(settings, "METRICS_HOSTNAME_TTL", 86400)
+RESOLVER_TIMEOUT = getattr(settings, "METRICS_RESOLVER_TIMEOUT", 1.0)
+RESOLVER_THREADS = getattr(settings, "METRICS_RESOLVER_THREADS", 8)
+RESOLVER_CACHE_SIZE = getattr(settings, "METRICS_RESOLVER_CACHE_SIZE", 4096)
 
 TRAFFIC_MODULES = getattr(
     settings,
@@ -48,6 +79,46 @@ TRAFFIC_MODULES = getattr(
         "metrics.traffic.Hit",
     ),
 )
+ESTIMATED_COUNT_THRESHOLD = getattr(settings, "METRICS_ESTIMATED_COUNT_THRESHOLD", 100000)
+ADMIN_KEYSET_PAGINATION = getattr(settings, "METRICS_ADMIN_KEYSET_PAGINATION", False)
+TRIGRAM_INDEXES = getattr(settings, "METRICS_TRIGRAM_INDEXES", False)
+ERROR_INDEXES = getattr(settings, "METRICS_ERROR_INDEXES", False)
+NORMALIZE_STRINGS = getattr(settings, "METRICS_NORMALIZE_STRINGS", False)
+INTERN_CACHE_SIZE = getattr(settings, "METRICS_INTERN_CACHE_SIZE", 10000)
+DEDUPLICATE_HEADERS = getattr(settings, "METRICS_DEDUPLICATE_HEADERS", False)
+ARCHIVE_PATH = getattr(settings, "METRICS_ARCHIVE_PATH", None)
+ARCHIVE_AFTER_DAYS = getattr(settings, "METRICS_ARCHIVE_AFTER_DAYS", 30)
+OVERVIEW_BACKEND = getattr(settings, "METRICS_OVERVIEW_BACKEND", "database")
+PLUGIN_THREADS = getattr(settings, "METRICS_PLUGIN_THREADS", 0)
+PLUGIN_TIMEOUT = getattr(settings, "METRICS_PLUGIN_TIMEOUT", 10.0)
+LAZY_PLUGINS = getattr(settings, "METRICS_LAZY_PLUGINS", False)
+PLUGIN_CACHE_TIMEOUT = getattr(settings, "METRICS_PLUGIN_CACHE_TIMEOUT", 0)
+LIVE_FEED = getattr(settings, "METRICS_LIVE_FEED", False)
+LIVE_FEED_CHANNEL = getattr(settings, "METRICS_LIVE_FEED_CHANNEL", "metrics_requests")
+RECENT_REQUESTS = getattr(settings, "METRICS_RECENT_REQUESTS", 0)
+RECENT_REQUESTS_SOCKETS = getattr(settings, "METRICS_RECENT_REQUESTS_SOCKETS", None)
+LATEST_REQUESTS_SOURCE = getattr(settings, "METRICS_LATEST_REQUESTS_SOURCE", "database")
+
+COUNTERS = getattr(settings, "METRICS_COUNTERS", False)
+OPENMETRICS_ALLOWED_IPS = getattr(settings, "METRICS_OPENMETRICS_ALLOWED_IPS", ("127.0.0.1", "::1"))
+COUNTER_MODULES = getattr(
+    settings,
+    "METRICS_COUNTER_MODULES",
+    (
+        "metrics.traffic.Hit",
+        "metrics.traffic.Error",
+        "metrics.traffic.Error404",
+        "metrics.traffic.Secure",
+        "metrics.traffic.Unsecure",
+    ),
+)
+COUNTER_BUCKETS = getattr(
+    settings,
+    "METRICS_COUNTER_BUCKETS",
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+SHARED_COUNTERS = getattr(settings, "METRICS_SHARED_COUNTERS", None)
+SHARED_COUNTERS_OPTIONS = getattr(settings, "METRICS_SHARED_COUNTERS_OPTIONS", {})
 
 PLUGINS = getattr(
     settings,
@@ -0,0 +1,269 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from hashlib import sha256
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+logger = logging.getLogger("metrics")
+
+MAGIC = b"METRICS1"
+# magic, generation digest, epoch, key count, max keys, max stripes, key size
+HEADER = struct.Struct("=8s32sQIIII")
+HEADER_SIZE = 64
+STRIPE = struct.Struct("=q")
+KEY_LENGTH = struct.Struct("=H")
+VALUE = struct.Struct("=d")
+
+
+class SharedStore:
+    """
+    Keep counter samples in a memory-mapped file shared by every process
+    of the host.
+
+    Each process claims a stripe (a row of values) and is the only writer
+    of it, so increments don't need any inter-process lock; readers sum all
+    the stripes. Stripes of dead processes are reused by new ones and keep
+    their values, so totals survive worker recycling. The file is reset
+    when it was created with a different ``generation`` (e.g. a new deploy).
+
+    When every stripe is taken, the last one is shared by the remaining
+    processes and updated under a file lock.
+    """
+
+    def __init__(self, path, generation="", max_keys=4096, max_stripes=64, key_size=256):
+        if fcntl is None:
+            raise RuntimeError("SharedStore requires a POSIX platform")
+        self.path = path
+        self.generation = sha256(str(generation).encode()).digest()
+        self.max_keys = max_keys
+        self.max_stripes = max_stripes
+        self.key_size = key_size
+        self.stripes_offset = HEADER_SIZE
+        self.keys_offset = self.stripes_offset + max_stripes * STRIPE.size
+        self.values_offset = self.keys_offset + max_keys * key_size
+        self.size = self.values_offset + max_stripes * max_keys * VALUE.size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._mmap = None
+        self._stripe = None
+        self._indexes = {}
+        self._epoch = None
+        self._warned = False
+
+    # File handling.
+
+    def _open(self):
+        if self._pid == os.getpid() and self._mmap is not None:
+            return
+        if self._mmap is not None:
+            # Forked from the process which opened the file.
+            self._mmap.close()
+            os.close(self._fd)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size != self.size:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, self.size)
+            mm = mmap.mmap(fd, self.size)
+            magic, generation, epoch, _, max_keys, max_stripes, key_size = HEADER.unpack_from(mm, 0)
+            if (magic, generation, max_keys, max_stripes, key_size) != (
+                MAGIC,
+                self.generation,
+                self.max_keys,
+                self.max_stripes,
+                self.key_size,
+            ):
+                self._initialize(mm, epoch + 1 if magic == MAGIC else 1)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd, self._mmap, self._pid = fd, mm, os.getpid()
+        self._stripe = self._epoch = None
+        self._indexes = {}
+
+    def _initialize(self, mm, epoch):
+        mm[HEADER_SIZE:] = bytes(self.size - HEADER_SIZE)
+        HEADER.pack_into(mm, 0, MAGIC, self.generation, epoch, 0, self.max_keys, self.max_stripes, self.key_size)
+
+    def _header(self):
+        return HEADER.unpack_from(self._mmap, 0)
+
+    def close(self):
+        if self._mmap is not None:
+            self._release_stripe()
+            self._mmap.close()
+            os.close(self._fd)
+        self._pid = self._fd = self._mmap = self._stripe = None
+        self._indexes = {}
+
+    # Stripes.
+
+    def _claim_stripe(self):
+        pid = os.getpid()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            for stripe in range(self.max_stripes - 1):
+                offset = self.stripes_offset + stripe * STRIPE.size
+                (owner,) = STRIPE.unpack_from(self._mmap, offset)
+                if owner in (0, pid) or not _is_alive(owner):
+                    STRIPE.pack_into(self._mmap, offset, pid)
+                    return stripe
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return None
+
+    def _release_stripe(self):
+        if self._stripe is not None:
+            STRIPE.pack_into(self._mmap, self.stripes_offset + self._stripe * STRIPE.size, 0)
+
+    # Keys.
+
+    def _read_keys(self, start, stop):
+        keys = {}
+        for index in range(start, stop):
+            offset = self.keys_offset + index * self.key_size
+            (length,) = KEY_LENGTH.unpack_from(self._mmap, offset)
+            if length:
+                offset += KEY_LENGTH.size
+                keys[_decode(self._mmap[offset : offset + length])] = index
+        return keys
+
+    def _index(self, key):
+        _, _, epoch, count, _, _, _ = self._header()
+        if epoch != self._epoch:
+            # The file was reset: forget the known keys and claim the stripe again.
+            self._epoch, self._indexes = epoch, {}
+            self._stripe = self._claim_stripe()
+        if key in self._indexes:
+            return self._indexes[key]
+        self._indexes.update(self._read_keys(len(self._indexes), count))
+        if key in self._indexes:
+            return self._indexes[key]
+
+        encoded = _encode(key)
+        if len(encoded) > self.key_size - KEY_LENGTH.size:
+            return self._drop(f"key {key!r} is too long")
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            magic, generation, epoch, count, max_keys, max_stripes, key_size = self._header()
+            self._indexes.update(self._read_keys(len(self._indexes), count))
+            if key in self._indexes:
+                return self._indexes[key]
+            if count >= self.max_keys:
+                return self._drop("no room left for new keys")
+            offset = self.keys_offset + count * self.key_size
+            KEY_LENGTH.pack_into(self._mmap, offset, len(encoded))
+            self._mmap[offset + KEY_LENGTH.size : offset + KEY_LENGTH.size + len(encoded)] = encoded
+            HEADER.pack_into(self._mmap, 0, magic, generation, epoch, count + 1, max_keys, max_stripes, key_size)
+            self._indexes[key] = count
+            return count
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _drop(self, reason):
+        if not self._warned:
+            logger.warning("Shared counters in %s: %s, samples are dropped", self.path, reason)
+            self._warned = True
+        return None
+
+    # Store API.
+
+    def inc(self, key, amount=1):
+        with self._lock:
+            self._open()
+            index = self._index(key)
+            if index is None:
+                return
+            stripe = self.max_stripes - 1 if self._stripe is None else self._stripe
+            offset = self.values_offset + (stripe * self.max_keys + index) * VALUE.size
+            if self._stripe is None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                (value,) = VALUE.unpack_from(self._mmap, offset)
+                VALUE.pack_into(self._mmap, offset, value + amount)
+            finally:
+                if self._stripe is None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def snapshot(self):
+        """
+        Sum the values of every stripe, no lock is taken.
+        """
+        with self._lock:
+            self._open()
+            count = self._header()[3]
+            keys = self._read_keys(0, count)
+            values = memoryview(self._mmap)[self.values_offset :].cast("d")
+            try:
+                snapshot = {}
+                for key, index in keys.items():
+                    snapshot[key] = sum(values[stripe * self.max_keys + index] for stripe in range(self.max_stripes))
+                return snapshot
+            finally:
+                values.release()
+
+    def reset(self):
+        """
+        Drop every key and value, stripe claims are kept.
+        """
+        with self._lock:
+            self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                _, _, epoch, _, _, _, _ = self._header()
+                stripes = self._mmap[self.stripes_offset : self.keys_offset]
+                self._initialize(self._mmap, epoch + 1)
+                self._mmap[self.stripes_offset : self.keys_offset] = stripes
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _encode(key):
+    name, labels = key
+    return json.dumps([name, labels], separators=(",", ":")).encode()
+
+
+def _decode(data):
+    name, labels = json.loads(bytes(data).decode())
+    return name, tuple(tuple(label) for label in labels)
@@ -2,6 +2,8 @@ var monthNames = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep",
 
 $(document).ready(function() {
     $("abbr.timeago").timeago();
+    loadPlugins($("[data-plugin-url]"));
+    $("[data-live-url]").each(function() { liveRequests($(this)); });
 
     $(".btn-graph").on("click", function() {
       var days = $(this).data("days");
@@ -13,6 +15,47 @@ $(document).ready(function() {
     });
 });
 
+function loadPlugin(placeholder) {
+    placeholder.load(placeholder.data("plugin-url"), function() {
+        placeholder.find("abbr.timeago").timeago();
+        placeholder.find("[data-live-url]").each(function() { liveRequests($(this)); });
+    });
+}
+
+function liveRequests(rows) {
+    // Rows are [id, timestamp, method, path, status_code, ip, user_id].
+    var size = rows.children("tr").length || 5;
+    var source = new EventSource(rows.data("live-url"));
+    source.onmessage = function(event) {
+        JSON.parse(event.data).forEach(function(request) {
+            var row = $("<tr>");
+            $("<td>").text(request[3]).attr("title", request[3]).appendTo(row);
+            $("<td>").text(request[5]).appendTo(row);
+            $("<td>").text(request[4]).appendTo(row);
+            $("<td>").append($("<abbr>").attr("title", request[1]).text(request[1]).timeago()).appendTo(row);
+            rows.prepend(row);
+        });
+        rows.children("tr").slice(size).remove();
+    };
+}
+
+function loadPlugins(placeholders) {
+    // Load the plugins when they are scrolled into view.
+    if (!("IntersectionObserver" in window)) {
+        placeholders.each(function() { loadPlugin($(this)); });
+        return;
+    }
+    var observer = new IntersectionObserver(function(entries) {
+        entries.forEach(function(entry) {
+            if (entry.isIntersecting) {
+                observer.unobserve(entry.target);
+                loadPlugin($(entry.target));
+            }
+        });
+    });
+    placeholders.each(function() { observer.observe(this); });
+}
+
 function showTooltip(x, y, contents) {
     $("#tooltip").remove();
     
@@ -21,15 +21,18 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from urllib.parse import quote
-
 from django import template
 
+from .. import charts
+
 register = template.Library()
 
 
 @register.simple_tag
 def pie_chart(items, width=440, height=190):
-    chd = quote(",".join([str(item[1]) for item in items]))
-    chl = quote("|".join([str(item[0]) for item in items]))
-    return f"//chart.googleapis.com/chart?cht=p3&chd=t:{chd}&chs={width}x{height}&chl={chl}"
+    return charts.pie_chart(items, width, height)
+
+
+@register.simple_tag
+def bar_chart(items, width=440, height=190):
+    return charts.bar_chart(items, width, height)
@@ -22,7 +22,9 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 from django import template
+from django.core.cache import cache
 
+from .. import settings
 from ..models import Request
 
 register = template.Library()
@@ -51,9 +53,20 @@ class ActiveUserNode(template.Node):
             self.as_varname = tokens[1]
 
     def render(self, context):
-        context[self.as_varname] = Request.objects.active_users(**self.kwargs)
+        context[self.as_varname] = self.get_users()
         return ""
 
+    def get_users(self):
+        if not settings.ACTIVE_USERS_CACHE_TIMEOUT:
+            return Request.objects.active_users(**self.kwargs)
+
+        key = "metrics:active_users:" + ",".join(f"{name}={value}" for name, value in sorted(self.kwargs.items()))
+        users = cache.get(key)
+        if users is None:
+            users = list(Request.objects.active_users(**self.kwargs))
+            cache.set(key, users, settings.ACTIVE_USERS_CACHE_TIMEOUT)
+        return users
+
 
 @register.tag
 def active_users(parser, token):
@@ -0,0 +1,208 @@
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from collections import Counter
+import math
+
+from django.db import DEFAULT_DB_ALIAS
+
+from . import counters, recent, settings
+from .managers import string_lookup
+from .models import Request
+
+
+class Window:
+    """
+    What happened during the last ``seconds``, as seen by a source.
+
+    ``latency`` holds ``(seconds, count)`` pairs: single durations, or the
+    upper bounds of histogram buckets. ``ips`` is ``None`` when the source
+    doesn't know them.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.requests = 0
+        self.errors = 0
+        self.server_errors = 0
+        self.routes = Counter()
+        self.ips = None
+        self.latency = []
+        self.truncated = False
+
+    def add(self, status_code, route, ip=None, duration=None, count=1):
+        self.requests += count
+        if status_code >= 400:
+            self.errors += count
+        if status_code >= 500:
+            self.server_errors += count
+        self.routes[route or "-"] += count
+        if ip is not None:
+            if self.ips is None:
+                self.ips = Counter()
+            self.ips[ip] += count
+        if duration is not None:
+            self.latency.append((duration, count))
+
+    def rate(self, count=None):
+        return (self.requests if count is None else count) / self.seconds if self.seconds else 0.0
+
+    def share(self, count):
+        return count / self.requests if self.requests else 0.0
+
+    def percentile(self, q):
+        """
+        Get the duration under which are ``q`` percent of the requests, or
+        ``None`` without durations.
+        """
+        latency = sorted(self.latency)
+        total = sum(count for duration, count in latency)
+        if not total:
+            return None
+        rank = math.ceil(total * q / 100)
+        seen = 0
+        for duration, count in latency:
+            seen += count
+            if seen >= rank:
+                return duration
+        return latency[-1][0]
+
+
+class CounterSource:
+    """
+    Read the counters of ``RequestMiddleware`` from ``store``, which has to
+    be shared with the served processes (see ``settings.SHARED_COUNTERS``).
+    Routes are the URL patterns; the IPs aren't known.
+    """
+
+    name = "counters"
+
+    def __init__(self, store):
+        self.store = store
+        self.previous = store.snapshot()
+
+    def poll(self, window):
+        snapshot = self.store.snapshot()
+        for (name, labels), value in snapshot.items():
+            count = value - self.previous.get((name, labels), 0)
+            if count <= 0:
+                continue
+            labels = dict(labels)
+            if name == f"{counters.requests_total.name}_total":
+                window.add(int(labels["status_code"]), labels["route"], count=count)
+            elif name == f"{counters.request_duration.name}_bucket":
+                bound = math.inf if labels["le"] == "+Inf" else float(labels["le"])
+                window.latency.append((bound, count))
+        self.previous = snapshot
+
+
+class BufferSource:
+    """
+    Read the recent requests of the processes serving them on the sockets of
+    ``directory`` (see ``settings.RECENT_REQUESTS_SOCKETS``). A process
+    serving more requests than its buffer holds between two polls is
+    undercounted.
+    """
+
+    name = "buffers"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.seen = {}
+        # Only the requests served from now on.
+        recent.poll(directory, self.seen, limit=1)
+
+    def poll(self, window):
+        for record in recent.poll(self.directory, self.seen):
+            window.add(record["status_code"], record["path"], record["ip"], record["duration"])
+
+
+class DatabaseSource:
+    """
+    Read the requests saved since the last poll, above an ``id`` high-water
+    mark, at most ``batch_size`` per poll. There are no durations.
+    """
+
+    name = "database"
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, batch_size=10000):
+        self.using = using
+        self.batch_size = batch_size
+        self.last_id = Request.objects.using(using).order_by("-id").values_list("id", flat=True).first() or 0
+
+    def poll(self, window):
+        qs = Request.objects.using(self.using).filter(id__gt=self.last_id).order_by("id")
+        rows = list(qs.values_list("id", "status_code", string_lookup("path"), "ip")[: self.batch_size])
+        for request_id, status_code, path, ip in rows:
+            window.add(status_code, path, ip)
+        if rows:
+            self.last_id = rows[-1][0]
+        window.truncated = len(rows) == self.batch_size
+
+
+def get_source(name="auto", using=DEFAULT_DB_ALIAS):
+    """
+    Get the source called ``name``; ``"auto"`` is the first available of the
+    shared counters, the recent requests buffers and the database.
+    """
+    if name == "counters" or (name == "auto" and settings.SHARED_COUNTERS):
+        if not settings.SHARED_COUNTERS:
+            raise ValueError("The counters source needs METRICS_SHARED_COUNTERS")
+        return CounterSource(counters.registry.store)
+    if name == "buffers" or (name == "auto" and settings.RECENT_REQUESTS_SOCKETS):
+        if not settings.RECENT_REQUESTS_SOCKETS:
+            raise ValueError("The buffers source needs METRICS_RECENT_REQUESTS_SOCKETS")
+        return BufferSource(settings.RECENT_REQUESTS_SOCKETS)
+    return DatabaseSource(using)
+
+
+def format_duration(value):
+    if value is None:
+        return "-"
+    if math.isinf(value):
+        return "inf"
+    return f"{value * 1000:.0f}ms"
+
+
+def render(window, source, limit=10, width=80):
+    """
+    Get the lines showing ``window``.
+    """
+    lines = [
+        f"Requests/s: {window.rate():.1f}{'+' if window.truncated else ''}"
+        f"   Errors: {window.share(window.errors):.1%} (5xx {window.share(window.server_errors):.1%})"
+        f"   p50 {format_duration(window.percentile(50))}"
+        f"   p90 {format_duration(window.percentile(90))}"
+        f"   p99 {format_duration(window.percentile(99))}",
+        f"Source: {source.name}, last {window.seconds:.1f}s",
+    ]
+    tables = [("Top routes", window.routes), ("Top IPs", window.ips)]
+    for title, counts in tables:
+        lines.append("")
+        lines.append(f"{title:<{width - 10}}{'req/s':>10}")
+        if counts is None:
+            lines.append(f"  (not known by the {source.name})")
+            continue
+        for name, count in counts.most_common(limit):
+            lines.append(f"{name[: width - 12]:<{width - 10}}{window.rate(count):>10.1f}")
+    return lines
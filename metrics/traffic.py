@@ -30,6 +30,10 @@ from django.utils.translation import gettext
 from django.utils.translation import gettext_lazy as _
 
 from . import settings
+from .analytics import Frame, NO_USER, np
+from .archive import load_archived
+from .bots import human_frame
+from .managers import SEARCH_ENGINES
 from .utils import get_verbose_name
 
 
@@ -38,15 +42,19 @@ class Modules:
     Set of :class:`.Module`.
     """
 
+    def __init__(self, setting="TRAFFIC_MODULES"):
+        self.setting = setting
+
     def load(self):
         """
         Import and instanciate modules defined in
-        ``settings.TRAFFIC_MODULES``.
+        ``settings.TRAFFIC_MODULES`` (or in the setting given
+        at construction time).
         """
         from importlib import import_module
 
         self._modules = ()
-        for module_path in settings.TRAFFIC_MODULES:
+        for module_path in getattr(settings, self.setting):
             try:
                 dot = module_path.rindex(".")
             except ValueError:
@@ -77,28 +85,88 @@ class Modules:
             self.load()
         return self._modules
 
+    @property
+    def frame_columns(self):
+        """
+        Columns of the requests read by the modules from frames.
+        """
+        columns = {"timestamp"}.union(*(module.frame_columns for module in self.modules))
+        if settings.TRAFFIC_HUMANS_ONLY:
+            columns.add("user_agent")
+        return columns
+
+    def counts(self, qs):
+        """
+        Get the counters of all the modules for ``qs``, including the archived
+        requests of its time range, read once for all the modules.
+
+        ``qs`` can be a ``metrics.analytics.Frame`` too. With
+        ``settings.TRAFFIC_HUMANS_ONLY`` the bots aren't counted.
+        """
+        if isinstance(qs, Frame):
+            frame = human_frame(qs) if settings.TRAFFIC_HUMANS_ONLY else qs
+            return [module.count_frame(frame) for module in self.modules]
+        if settings.TRAFFIC_HUMANS_ONLY:
+            qs = qs.humans()
+        table = load_archived(qs, self.frame_columns)
+        if table is None:
+            return [module.count(qs) for module in self.modules]
+        frame = Frame.from_table(table)
+        if settings.TRAFFIC_HUMANS_ONLY:
+            frame = human_frame(frame)
+        return [module.count_with_archive(qs, frame) for module in self.modules]
+
     def table(self, queries):
         """
         Get a list of modules" counters.
         """
-        return tuple([(module.verbose_name_plural, [module.count(qs) for qs in queries]) for module in self.modules])
+        counts = [self.counts(qs) for qs in queries]
+        return tuple(
+            [(module.verbose_name_plural, [row[index] for row in counts]) for index, module in enumerate(self.modules)]
+        )
 
     def graph(self, days):
         """
         Get a list of modules" counters for all the given days.
         """
+        counts = self.day_counts(days)
         return tuple(
             [
                 {
-                    "data": [(mktime(day.timetuple()) * 1000, module.count(qs)) for day, qs in days],
+                    "data": [(timestamp, row[index]) for timestamp, row in counts],
                     "label": str(gettext(module.verbose_name_plural)),
                 }
-                for module in self.modules
+                for index, module in enumerate(self.modules)
             ]
         )
 
+    def columns(self, days):
+        """
+        Like ``graph()``, with the timestamps listed once for all the modules.
+        """
+        counts = self.day_counts(days)
+        return {
+            "timestamps": [timestamp for timestamp, row in counts],
+            "series": [
+                {
+                    "data": [row[index] for timestamp, row in counts],
+                    "label": str(gettext(module.verbose_name_plural)),
+                }
+                for index, module in enumerate(self.modules)
+            ],
+        }
+
+    def day_counts(self, days):
+        return [(mktime(day.timetuple()) * 1000, self.counts(qs)) for day, qs in days]
+
+
+def is_search_referer(referer):
+    referer = referer.lower()
+    return any(engine in referer for engine in SEARCH_ENGINES)
+
 
 modules = Modules()
+counter_modules = Modules("COUNTER_MODULES")
 
 
 class Module:
@@ -115,24 +183,64 @@ class Module:
         if not hasattr(self, "verbose_name_plural"):
             self.verbose_name_plural = format_lazy("{}{}", self.verbose_name, "s")
 
+        if not hasattr(self, "metric_name"):
+            self.metric_name = get_verbose_name(self.module_name).lower().replace(" ", "_")
+
+    # Columns of the frames read by count_frame().
+    frame_columns = ()
+
     def count(self, qs):
         raise NotImplementedError("'count' isn't defined.")
 
+    def count_frame(self, frame):
+        """
+        Count the requests of ``frame`` (a ``metrics.analytics.Frame``)
+        falling in this module, with vectorized operations.
+        """
+        raise NotImplementedError("'count_frame' isn't defined.")
+
+    def count_with_archive(self, qs, frame):
+        """
+        Count the requests of ``qs`` and the archived requests of ``frame``.
+        """
+        return self.count(qs) + self.count_frame(frame)
+
+    def matches(self, request):
+        """
+        Tell if a single (possibly unsaved) ``Request`` falls in this
+        module, used by the in-process counters.
+        """
+        raise NotImplementedError("'matches' isn't defined.")
+
 
 class Error(Module):
     verbose_name = _("Error")
     verbose_name_plural = _("Errors")
+    frame_columns = ("status_code",)
 
     def count(self, qs):
-        return qs.filter(status_code__gte=400).count()
+        return qs.errors().count()
+
+    def matches(self, request):
+        return request.status_code >= 400
+
+    def count_frame(self, frame):
+        return int(np.count_nonzero(frame["status_code"] >= 400))
 
 
 class Error404(Module):
     verbose_name = _("Error 404")
     verbose_name_plural = _("Errors 404")
+    frame_columns = ("status_code",)
 
     def count(self, qs):
-        return qs.filter(status_code=404).count()
+        return qs.errors().filter(status_code=404).count()
+
+    def matches(self, request):
+        return request.status_code == 404
+
+    def count_frame(self, frame):
+        return int(np.count_nonzero(frame["status_code"] == 404))
 
 
 class Hit(Module):
@@ -142,58 +250,122 @@ class Hit(Module):
     def count(self, qs):
         return qs.count()
 
+    def matches(self, request):
+        return True
+
+    def count_frame(self, frame):
+        return len(frame)
+
 
 class Search(Module):
     verbose_name = _("Search")
     verbose_name_plural = _("Searches")
+    frame_columns = ("referer",)
 
     def count(self, qs):
         return qs.search().count()
 
+    def matches(self, request):
+        return is_search_referer(request.referer)
+
+    def count_frame(self, frame):
+        return int(np.count_nonzero(frame.matches("referer", is_search_referer)))
+
 
 class Secure(Module):
     verbose_name = _("Secure")
     verbose_name_plural = _("Secure")
+    frame_columns = ("is_secure",)
 
     def count(self, qs):
         return qs.filter(is_secure=True).count()
 
+    def matches(self, request):
+        return request.is_secure
+
+    def count_frame(self, frame):
+        return int(np.count_nonzero(frame["is_secure"]))
+
 
 class Unsecure(Module):
     verbose_name = _("Unsecure")
     verbose_name_plural = _("Unsecure")
+    frame_columns = ("is_secure",)
 
     def count(self, qs):
         return qs.filter(is_secure=False).count()
 
+    def matches(self, request):
+        return not request.is_secure
+
+    def count_frame(self, frame):
+        return len(frame) - int(np.count_nonzero(frame["is_secure"]))
+
 
 class UniqueVisit(Module):
     verbose_name = _("Unique Visit")
     verbose_name_plural = _("Unique Visits")
+    frame_columns = ("referer",)
 
     def count(self, qs):
-        return qs.exclude(referer__startswith=settings.BASE_URL).count()
+        return qs.unique_visits().count()
+
+    def matches(self, request):
+        return not request.referer.startswith(settings.BASE_URL)
+
+    def count_frame(self, frame):
+        internal = frame.matches("referer", lambda referer: referer.startswith(settings.BASE_URL))
+        return len(frame) - int(np.count_nonzero(internal))
 
 
 class UniqueVisitor(Module):
     verbose_name = _("Unique Visitor")
     verbose_name_plural = _("Unique Visitor")
+    frame_columns = ("ip",)
 
     def count(self, qs):
         return qs.aggregate(Count("ip", distinct=True))["ip__count"]
 
+    def count_frame(self, frame):
+        return len(frame.unique("ip"))
+
+    def count_with_archive(self, qs, frame):
+        # The same visitor can be both in the database and in the archive.
+        ips = set(qs.order_by().values_list("ip", flat=True).distinct())
+        return len(ips.union(frame.unique("ip")))
+
 
 class User(Module):
     verbose_name = _("User")
     verbose_name_plural = _("User")
+    frame_columns = ("user_id",)
 
     def count(self, qs):
-        return qs.exclude(user__isnull=False).count()
+        return qs.exclude(user_id__isnull=True).count()
+
+    def matches(self, request):
+        return request.user_id is not None
+
+    def count_frame(self, frame):
+        return int(np.count_nonzero(frame["user_id"] != NO_USER))
 
 
 class UniqueUser(Module):
     verbose_name = _("Unique User")
     verbose_name_plural = _("Unique User")
+    frame_columns = ("user_id",)
 
     def count(self, qs):
-        return qs.aggregate(Count("user", distinct=True))["user__count"]
+        return qs.aggregate(count=Count("user_id", distinct=True))["count"]
+
+    def count_frame(self, frame):
+        return len(self.user_ids(frame))
+
+    def user_ids(self, frame):
+        users = frame.unique("user_id")
+        return users[users != NO_USER]
+
+    def count_with_archive(self, qs, frame):
+        # The same user can be both in the database and in the archive.
+        users = set(qs.exclude(user_id=None).order_by().values_list("user_id", flat=True).distinct())
+        return len(users.union(self.user_ids(frame).tolist()))
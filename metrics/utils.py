@@ -21,6 +21,7 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import datetime
 import re
 
 from django.conf import settings
@@ -181,7 +182,46 @@ def get_verbose_name(class_name):
     ).strip()
 
 
-def handle_naive_datetime(value):
+def handle_naive_datetime(value, tz=None):
     if settings.USE_TZ and timezone.is_naive(value):
-        return timezone.make_aware(value)
+        return timezone.make_aware(value, tz)
     return value
+
+
+PERIODS = ("day", "week", "month", "year")
+
+
+def period_range(kind, anchor=None, tz=None):
+    """
+    Get the ``(start, end)`` datetimes of the ``kind`` period (one of
+    ``PERIODS``) holding ``anchor``, as seen in ``tz``.
+
+    ``anchor`` is a date or a datetime, today by default; ``tz`` is the current
+    time zone by default. Weeks start on Sunday, like ``%U`` does. ``end`` is
+    the start of the following period, for ``start <= timestamp < end``.
+    """
+    if kind not in PERIODS:
+        raise ValueError(f"Unknown period {kind!r}, expected one of {', '.join(PERIODS)}")
+    if anchor is None:
+        anchor = timezone.now()
+    if isinstance(anchor, datetime.datetime):
+        if settings.USE_TZ and timezone.is_aware(anchor):
+            anchor = timezone.localtime(anchor, tz)
+        anchor = anchor.date()
+
+    if kind == "day":
+        first, following = anchor, anchor + datetime.timedelta(days=1)
+    elif kind == "week":
+        first = anchor - datetime.timedelta(days=(anchor.weekday() + 1) % 7)
+        following = first + datetime.timedelta(days=7)
+    elif kind == "month":
+        first = anchor.replace(day=1)
+        following = (first + datetime.timedelta(days=32)).replace(day=1)
+    else:
+        first = anchor.replace(month=1, day=1)
+        following = first.replace(year=first.year + 1)
+
+    # Local midnights, so DST changes are handled by the time zone.
+    start = datetime.datetime.combine(first, datetime.time.min)
+    end = datetime.datetime.combine(following, datetime.time.min)
+    return handle_naive_datetime(start, tz), handle_naive_datetime(end, tz)
@@ -21,16 +21,24 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+from datetime import timedelta
 import json
 
 from django.contrib.admin import site
 from django.contrib.auth import get_user_model
-from django.core.urlresolvers import reverse
+from django.core.cache import cache
+from django.db import connection
 from django.test import RequestFactory, TestCase
-from django.test.utils import override_settings
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.timezone import now
 from django.utils.translation import _trans
+import mock
 
+from metrics import plugins
 from metrics.admin import RequestAdmin
+from metrics.archive import day_range, local_date
 from metrics.models import Request
 
 User = get_user_model()
@@ -55,6 +63,33 @@ class RequestFromTest(TestCase):
         request = Request.objects.create(ip="1.2.3.4")
         admin.request_from(request)
 
+    def test_deleted_user(self):
+        admin = RequestAdmin(Request, site)
+        request = Request.objects.create(user_id=42, ip="1.2.3.4")
+        self.assertIn("?ip=1.2.3.4", admin.request_from(request))
+
+
+class SearchFieldsTest(TestCase):
+    def test_without_trigram_indexes(self):
+        admin = RequestAdmin(Request, site)
+        self.assertEqual(admin.get_search_fields(RequestFactory().get("/")), ())
+        self.assertIn("?path=%2Ffoo", admin._path(Request(path="/foo")))
+
+    @mock.patch("metrics.settings.TRIGRAM_INDEXES", True)
+    @mock.patch("metrics.admin.has_trigram_indexes", return_value=True)
+    def test_with_trigram_indexes(self, has_trigram_indexes):
+        admin = RequestAdmin(Request, site)
+        self.assertEqual(admin.get_search_fields(RequestFactory().get("/")), ("path", "referer", "user_agent"))
+        self.assertIn("?path__iexact=%2Ffoo", admin._path(Request(path="/foo")))
+        has_trigram_indexes.assert_called_with("default")
+
+    @mock.patch("metrics.settings.TRIGRAM_INDEXES", True)
+    def test_trigram_indexes_missing(self):
+        # Enabled after migrating, without running indexrequests.
+        admin = RequestAdmin(Request, site)
+        self.assertEqual(admin.get_search_fields(RequestFactory().get("/")), ())
+        self.assertIn("?path=%2Ffoo", admin._path(Request(path="/foo")))
+
 
 class GetUrlsTest(TestCase):
     def test_get_urls(self):
@@ -69,6 +104,15 @@ class OverviewTest(TestCase):
         request = factory.get("/foo")
         admin.overview(request)
 
+    def test_overview_on_threads(self):
+        overview_plugins = [plugins.Plugin(), plugins.Plugin()]
+        admin = RequestAdmin(Request, site)
+        request = RequestFactory().get("/foo")
+        with mock.patch.object(plugins.plugins, "_plugins", overview_plugins, create=True):
+            with mock.patch.object(plugins.renderer, "threads", 2):
+                response = admin.overview(request)
+        self.assertContains(response, "<h2>Plugin</h2>", count=2)
+
 
 class TrafficTest(TestCase):
     def setUp(self):
@@ -101,6 +145,78 @@ class TrafficTest(TestCase):
             for single_data in data:
                 self.assertEqual(len(single_data["data"]), intervals)
 
+    def test_compact(self):
+        request = self.factory.get("/foo", {"days": 3})
+        content = self.admin.traffic(request).content.decode()
+        self.assertNotIn(" ", content.replace("Unique ", ""))
+        self.assertNotIn("\n", content)
+
+    def test_columnar(self):
+        request = self.factory.get("/foo", {"days": 3})
+        series = json.loads(self.admin.traffic(request).content.decode())
+        request = self.factory.get("/foo", {"days": 3, "layout": "columnar"})
+        data = json.loads(self.admin.traffic(request).content.decode())
+        self.assertEqual(data["timestamps"], [timestamp for timestamp, count in series[0]["data"]])
+        for module, columns in zip(series, data["series"]):
+            self.assertEqual(columns["label"], module["label"])
+            self.assertEqual(columns["data"], [count for timestamp, count in module["data"]])
+
+    def test_not_modified(self):
+        Request.objects.create(ip="1.2.3.4")
+        response = self.admin.traffic(self.factory.get("/foo"))
+        self.assertEqual(response["Cache-Control"], "private, no-cache")
+        self.assertIn("Last-Modified", response)
+        request = self.factory.get("/foo", HTTP_IF_NONE_MATCH=response["ETag"])
+        with CaptureQueriesContext(connection) as queries:
+            not_modified = self.admin.traffic(request)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(len(queries), 1)  # the latest request
+
+        Request.objects.create(ip="1.2.3.4")
+        response = self.admin.traffic(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], not_modified["ETag"])
+
+    def test_etag_depends_on_the_graph(self):
+        etags = {
+            self.admin.traffic(self.factory.get("/foo", params))["ETag"]
+            for params in ({}, {"days": 7}, {"layout": "columnar"})
+        }
+        self.assertEqual(len(etags), 3)
+
+    def test_past(self):
+        end = local_date(now()) - timedelta(days=10)
+        request = self.factory.get("/foo", {"days": 7, "end": end.isoformat()})
+        response = self.admin.traffic(request)
+        self.assertEqual(response["Cache-Control"], "private, max-age=300")
+        data = json.loads(response.content.decode())
+        self.assertEqual(len(data[0]["data"]), 8)
+        request = self.factory.get("/foo", {"days": 7, "end": end.isoformat()}, HTTP_IF_NONE_MATCH=response["ETag"])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.admin.traffic(request).status_code, 304)
+        self.assertEqual(len(queries), 1)  # the requests of the range
+
+        # Changed by purgerequests, archiverequests or classifyrequests.
+        old = Request.objects.create(ip="1.2.3.4", timestamp=day_range(end)[0])
+        self.assertEqual(self.admin.traffic(request).status_code, 200)
+        etag = self.admin.traffic(request)["ETag"]
+        Request.objects.filter(pk=old.pk).update(is_bot=True)
+        self.assertNotEqual(self.admin.traffic(request)["ETag"], etag)
+
+    def test_etag_depends_on_the_settings(self):
+        etag = self.admin.traffic(self.factory.get("/foo"))["ETag"]
+        with mock.patch("metrics.settings.TRAFFIC_HUMANS_ONLY", False):
+            self.assertNotEqual(self.admin.traffic(self.factory.get("/foo"))["ETag"], etag)
+        with mock.patch("metrics.settings.TRAFFIC_MODULES", ("metrics.traffic.Hit",)):
+            self.assertNotEqual(self.admin.traffic(self.factory.get("/foo"))["ETag"], etag)
+        with timezone.override("Europe/Rome"):
+            self.assertNotEqual(self.admin.traffic(self.factory.get("/foo"))["ETag"], etag)
+
+    def test_end_is_at_most_today(self):
+        for end in ("2999-01-01", "2015-02-30", "foo"):
+            response = self.admin.traffic(self.factory.get("/foo", {"end": end}))
+            self.assertEqual(response["Cache-Control"], "private, no-cache")
+
 
 class RequestAdminViewsTest(TestCase):
     def setUp(self):
@@ -109,6 +225,18 @@ class RequestAdminViewsTest(TestCase):
         user.save()
         self.client.login(username=user.username, password="bar")
 
+    def test_changelist_users_are_prefetched(self):
+        for index in range(10):
+            user = User.objects.create(username=f"user{index}")
+            Request.objects.create(user=user, ip="1.2.3.4")
+        url = reverse("admin:metrics_request_changelist")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "user9")
+        user_queries = [query for query in queries if User._meta.db_table in query["sql"]]
+        self.assertEqual(len(user_queries), 2)  # the logged user and the prefetched ones
+
     def test_overview(self):
         url = reverse("admin:metrics_request_overview")
         response = self.client.get(url)
@@ -126,3 +254,72 @@ class RequestAdminViewsTest(TestCase):
         for time, value in json_response[0]["data"]:
             self.assertIsInstance(time, float)
             self.assertIsInstance(value, int)
+
+
+class PluginViewTest(TestCase):
+    def setUp(self):
+        user = User(username="foo", is_superuser=True, is_staff=True)
+        user.set_password("bar")
+        user.save()
+        self.client.login(username=user.username, password="bar")
+        Request.objects.create(path="/foo", ip="1.2.3.4")
+        cache.clear()
+
+    def requests_queries(self, queries):
+        return [query for query in queries if Request._meta.db_table in query["sql"]]
+
+    @mock.patch("metrics.settings.LAZY_PLUGINS", True)
+    def test_lazy_overview(self):
+        url = reverse("admin:metrics_request_overview")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(self.requests_queries(queries), [])
+        for plugin in plugins.plugins.plugins:
+            plugin_url = reverse("admin:metrics_request_plugin", args=[plugin.module_name.lower()])
+            self.assertContains(response, f'data-plugin-url="{plugin_url}"')
+
+    def test_plugin(self):
+        for plugin in plugins.plugins.plugins:
+            url = reverse("admin:metrics_request_plugin", args=[plugin.module_name.lower()])
+            response = self.client.get(url)
+            self.assertContains(response, plugin.verbose_name)
+
+    def test_plugin_json(self):
+        url = reverse("admin:metrics_request_plugin", args=["toppaths"])
+        response = self.client.get(url, {"format": "json", "period": "day"})
+        data = response.json()
+        self.assertEqual(data["name"], "toppaths")
+        self.assertEqual(data["verbose_name"], "Top Paths")
+        self.assertIn("/foo", data["html"])
+        start, end = Request.objects.today().archive_range
+        self.assertEqual((data["start"], data["end"]), (start.isoformat(), end.isoformat()))
+
+    def test_plugin_not_shared(self):
+        url = reverse("admin:metrics_request_plugin", args=["toppaths"])
+        self.client.get(url, {"period": "day"})
+        self.client.get(reverse("admin:metrics_request_overview"))
+        for plugin in plugins.plugins.plugins:
+            self.assertFalse(hasattr(plugin, "qs"))
+
+    def test_unknown_period(self):
+        url = reverse("admin:metrics_request_plugin", args=["toppaths"])
+        data = self.client.get(url, {"format": "json", "period": "decade"}).json()
+        start, end = Request.objects.this_month().archive_range
+        self.assertEqual((data["start"], data["end"]), (start.isoformat(), end.isoformat()))
+
+    def test_unknown_plugin(self):
+        url = reverse("admin:metrics_request_plugin", args=["foo"])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    @mock.patch("metrics.settings.PLUGIN_CACHE_TIMEOUT", 60)
+    def test_cache(self):
+        url = reverse("admin:metrics_request_plugin", args=["toppaths"])
+        first = self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(url)
+        self.assertEqual(self.requests_queries(queries), [])
+        self.assertEqual(first.content, second.content)
+        # Another range is another fragment.
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, {"period": "day"})
+        self.assertNotEqual(self.requests_queries(queries), [])
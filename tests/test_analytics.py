@@ -0,0 +1,172 @@
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from datetime import timedelta
+import json
+import shutil
+import tempfile
+from unittest import skipIf
+
+from django.contrib.admin import site
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
+import mock
+
+from metrics import plugins
+from metrics.admin import RequestAdmin
+from metrics.analytics import Frame, load_frame, np
+from metrics.archive import Archive, day_range, local_date, pa
+from metrics.models import Request
+from metrics.traffic import Modules, UniqueUser, User
+
+TRAFFIC_MODULES = (
+    "metrics.traffic.Error",
+    "metrics.traffic.Error404",
+    "metrics.traffic.Hit",
+    "metrics.traffic.Search",
+    "metrics.traffic.Secure",
+    "metrics.traffic.Unsecure",
+    "metrics.traffic.UniqueVisit",
+    "metrics.traffic.UniqueVisitor",
+)
+
+
+def unordered(context):
+    # The database returns the values with the same count in any order.
+    return {key: sorted(value, key=repr) for key, value in context.items()}
+
+
+@skipIf(np is None, "numpy isn't installed")
+class FrameTest(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        chrome = "Mozilla/5.0 (Windows NT 10.0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0 Safari/537.36"
+        Request.objects.create(ip="1.2.3.4", path="/foo/", timestamp=self.now - timedelta(hours=2))
+        Request.objects.create(ip="1.2.3.4", path="/foo/", referer="https://www.google.com/?q=foo+bar")
+        Request.objects.create(ip="5.6.7.8", path="/bar/", status_code=404, is_secure=True, user_agent=chrome)
+        Request.objects.create(ip="5.6.7.8", path="/baz/", status_code=500, user_id=1)
+        self.qs = Request.objects.between(self.now - timedelta(days=1), self.now + timedelta(days=1))
+
+    def test_from_queryset(self):
+        with self.assertNumQueries(1):
+            frame = Frame.from_queryset(self.qs)
+        self.assertEqual(len(frame), 4)
+        self.assertEqual(frame["path"].dtype, np.int32)
+        self.assertEqual(list(frame.dictionaries["path"]), ["/bar/", "/baz/", "/foo/"])
+        self.assertEqual(frame.values("path")[0], "/foo/")  # sorted by timestamp
+        self.assertEqual(sorted(frame.unique("ip")), ["1.2.3.4", "5.6.7.8"])
+        self.assertGreater(frame.nbytes, 0)
+
+    def test_empty(self):
+        frame = Frame.from_queryset(Request.objects.none())
+        self.assertEqual(len(frame), 0)
+        self.assertEqual(frame.top("path"), [])
+        self.assertEqual(Modules().counts(frame), [0] * len(Modules().modules))
+
+    def test_between(self):
+        frame = Frame.from_queryset(self.qs)
+        self.assertEqual(len(frame.between(self.now - timedelta(hours=3), self.now - timedelta(hours=1))), 1)
+        self.assertEqual(len(frame.between(self.now - timedelta(hours=1), self.now + timedelta(hours=1))), 3)
+
+    def test_top(self):
+        frame = Frame.from_queryset(self.qs)
+        self.assertEqual(unordered({"path": frame.top("path")}), unordered({"path": self.qs.top("path")}))
+        self.assertEqual(frame.top("path", limit=1), [{"path": "/foo/", "path__count": 2, "path_term": None}])
+        self.assertEqual(frame.top("referer"), self.qs.top("referer"))
+
+    def test_concat(self):
+        frame = Frame.from_queryset(self.qs)
+        frames = [Frame.from_queryset(self.qs.filter(ip=ip)) for ip in ("5.6.7.8", "1.2.3.4")]
+        merged = Frame.concat(frames)
+        for name in ("path", "ip", "referer", "user_agent"):
+            self.assertEqual(list(merged.values(name)), list(frame.values(name)))
+        self.assertEqual(list(merged["status_code"]), list(frame["status_code"]))
+
+    def test_traffic_modules(self):
+        with mock.patch("metrics.settings.TRAFFIC_MODULES", TRAFFIC_MODULES):
+            modules = Modules()
+            self.assertEqual(modules.counts(Frame.from_queryset(self.qs)), modules.counts(self.qs))
+
+    def test_users(self):
+        frame = Frame.from_queryset(self.qs)
+        self.assertEqual(User().count_frame(frame), 1)
+        self.assertEqual(UniqueUser().count_frame(frame), 1)
+
+    def test_plugins(self):
+        frame = Frame.from_queryset(self.qs)
+        for plugin_class in (
+            plugins.TopPaths,
+            plugins.TopErrorPaths,
+            plugins.TopReferrers,
+            plugins.TopSearchPhrases,
+            plugins.TopBrowsers,
+        ):
+            plugin = plugin_class()
+            plugin.qs = self.qs
+            self.assertEqual(unordered(plugin.frame_context(frame)), unordered(plugin.template_context()), plugin_class)
+
+    def test_normalized_strings(self):
+        with mock.patch("metrics.settings.NORMALIZE_STRINGS", True):
+            Request.objects.create(ip="1.2.3.4", path="/normalized/")
+            frame = Frame.from_queryset(Request.objects.all())
+        self.assertIn("/normalized/", frame.values("path"))
+        self.assertIn("/foo/", frame.values("path"))
+
+
+@skipIf(np is None or pa is None, "numpy or pyarrow isn't installed")
+class ArchivedFrameTest(TestCase):
+    def test_load_frame(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        old = timezone.now() - timedelta(days=40)
+        archived = Request.objects.create(ip="1.2.3.4", path="/old/", timestamp=old)
+        Archive(path).write(local_date(old), [[archived]])
+        archived.delete()
+        Request.objects.create(ip="1.2.3.4", path="/new/")
+        qs = Request.objects.between(day_range(local_date(old))[0], timezone.now() + timedelta(days=1))
+        with mock.patch("metrics.settings.ARCHIVE_PATH", path):
+            frame = load_frame(qs)
+        self.assertEqual(list(frame.values("path")), ["/old/", "/new/"])
+        self.assertEqual(frame.unique("ip").tolist(), ["1.2.3.4"])
+
+
+@skipIf(np is None, "numpy isn't installed")
+@mock.patch("metrics.settings.OVERVIEW_BACKEND", "memory")
+class MemoryBackendTest(TestCase):
+    def setUp(self):
+        self.admin = RequestAdmin(Request, site)
+        self.factory = RequestFactory()
+        Request.objects.create(ip="1.2.3.4", path="/foo/")
+
+    def test_overview(self):
+        with mock.patch.object(plugins.plugins, "_plugins", [plugins.TopPaths(), plugins.TopBrowsers()], create=True):
+            response = self.admin.overview(self.factory.get("/foo"))
+        self.assertContains(response, "1 requests of this month loaded in memory")
+        self.assertContains(response, "/foo/")
+
+    def test_traffic(self):
+        with self.assertNumQueries(2):  # the latest request for the ETag, and the frame
+            response = self.admin.traffic(self.factory.get("/foo", {"days": 9}))
+        data = json.loads(response.content.decode())
+        hits = dict(data[-1]["data"]) if data else {}
+        self.assertEqual(sum(hits.values()), 1)
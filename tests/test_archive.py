@@ -0,0 +1,111 @@
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from datetime import timedelta
+from io import StringIO
+import os
+import shutil
+import tempfile
+from unittest import skipIf
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import timezone
+import mock
+
+from metrics.archive import Archive, day_range, local_date, pa
+from metrics.models import Request
+from metrics.traffic import Error, Error404, Hit, Modules, Search, Secure, UniqueVisitor
+
+
+@skipIf(pa is None, "pyarrow isn't installed")
+class ArchiveTest(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        patcher = mock.patch("metrics.settings.ARCHIVE_PATH", self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.old = timezone.now() - timedelta(days=40)
+        self.old_day = local_date(self.old)
+        Request.objects.create(ip="1.2.3.4", timestamp=self.old, status_code=404, path="/foo/")
+        Request.objects.create(
+            ip="5.6.7.8", timestamp=self.old, user_id=1, is_secure=True, referer="https://www.google.com/?q=foo"
+        )
+        Request.objects.create(ip="1.2.3.4", path="/bar/", headers={"HTTP_HOST": "example.com"})
+
+    def archive(self):
+        call_command("archiverequests", interactive=False, stdout=StringIO())
+
+    def test_command(self):
+        self.archive()
+        self.assertEqual(Request.objects.count(), 1)
+        archive = Archive(self.path)
+        self.assertTrue(os.path.exists(archive.segment(self.old_day)))
+        table = archive.read(*day_range(self.old_day))
+        self.assertEqual(table.num_rows, 2)
+        self.assertEqual(sorted(table["ip"].to_pylist()), ["1.2.3.4", "5.6.7.8"])
+
+    def test_write_is_idempotent(self):
+        archive = Archive(self.path)
+        requests = list(Request.objects.filter(timestamp__lt=timezone.now() - timedelta(days=30)))
+        self.assertEqual(archive.write(self.old_day, [requests]), 2)
+        self.assertEqual(archive.write(self.old_day, [requests]), 0)
+        self.assertEqual(archive.read(*day_range(self.old_day)).num_rows, 2)
+
+    def test_read_range(self):
+        self.archive()
+        archive = Archive(self.path)
+        start, end = day_range(self.old_day)
+        self.assertEqual(archive.days(start, end), [self.old_day])
+        self.assertEqual(archive.read(self.old + timedelta(seconds=1), end).num_rows, 0)
+        self.assertEqual(archive.read(start - timedelta(days=5), start).num_rows, 0)
+
+    def test_traffic_modules(self):
+        modules = Modules()
+        modules._modules = (Hit(), Error(), Error404(), Search(), Secure(), UniqueVisitor())
+        qs = Request.objects.between(self.old - timedelta(days=1), timezone.now() + timedelta(days=1))
+        expected = modules.counts(qs)
+        self.archive()
+        with self.assertNumQueries(6):
+            self.assertEqual(modules.counts(qs), expected)
+        self.assertEqual(expected, [3, 1, 1, 1, 1, 2])
+        # Further filtered querysets don't read the archive.
+        self.assertEqual(modules.counts(qs.filter(path="/bar/"))[0], 1)
+
+    def test_traffic_modules_humans_only(self):
+        Request.objects.create(ip="9.9.9.9", timestamp=self.old, user_agent="Googlebot/2.1", is_bot=True)
+        modules = Modules()
+        modules._modules = (Hit(),)
+        qs = Request.objects.between(self.old - timedelta(days=1), timezone.now() + timedelta(days=1))
+        self.assertEqual(modules.counts(qs), [3])
+        self.archive()
+        # The archived bots are told apart by their user agent.
+        self.assertEqual(modules.counts(qs), [3])
+        with mock.patch("metrics.settings.TRAFFIC_HUMANS_ONLY", False):
+            self.assertEqual(modules.counts(qs), [4])
+
+    def test_not_configured(self):
+        with mock.patch("metrics.settings.ARCHIVE_PATH", None), self.assertRaises(CommandError):
+            self.archive()
@@ -0,0 +1,103 @@
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from io import StringIO
+
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+import mock
+
+from metrics import bots
+from metrics.analytics import Frame
+from metrics.middleware import RequestMiddleware
+from metrics.models import Request
+from metrics.traffic import Hit, Modules
+
+GOOGLEBOT = "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)"
+FIREFOX = "Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0"
+
+
+class IsBotTest(TestCase):
+    def test_patterns(self):
+        for user_agent in (GOOGLEBOT, "msnbot/1.1", "Baiduspider", "Yahoo! Slurp", "curl/8.0.1", "YandexBot/3.0"):
+            self.assertTrue(bots.is_bot(user_agent), user_agent)
+        for user_agent in (FIREFOX, "", None):
+            self.assertFalse(bots.is_bot(user_agent), user_agent)
+
+    @mock.patch("metrics.settings.BOT_PATTERNS", [r"firefox"])
+    def test_setting(self):
+        self.assertTrue(bots.is_bot(FIREFOX))
+        self.assertFalse(bots.is_bot(GOOGLEBOT))
+
+    @mock.patch("metrics.settings.BOT_PATTERNS", ())
+    def test_no_patterns(self):
+        self.assertFalse(bots.is_bot(GOOGLEBOT))
+
+    def test_captured(self):
+        middleware = RequestMiddleware(lambda request: HttpResponse())
+        middleware(RequestFactory().get("/foo", HTTP_USER_AGENT=GOOGLEBOT))
+        middleware(RequestFactory().get("/bar", HTTP_USER_AGENT=FIREFOX))
+        self.assertEqual(dict(Request.objects.values_list("path", "is_bot")), {"/foo": True, "/bar": False})
+
+
+class HumansTest(TestCase):
+    def setUp(self):
+        Request.objects.create(ip="1.2.3.4", user_agent=FIREFOX)
+        Request.objects.create(ip="1.2.3.4", user_agent=GOOGLEBOT, is_bot=True)
+
+    def test_humans(self):
+        self.assertEqual(Request.objects.humans().count(), 1)
+        self.assertEqual(Request.objects.bots().count(), 1)
+
+    def test_keeps_archive_range(self):
+        qs = Request.objects.this_month()
+        self.assertEqual(qs.humans().archive_range, qs.archive_range)
+
+    def test_traffic_modules(self):
+        modules = Modules()
+        modules._modules = (Hit(),)
+        self.assertEqual(modules.counts(Request.objects.all()), [1])
+        with mock.patch("metrics.settings.TRAFFIC_HUMANS_ONLY", False):
+            self.assertEqual(modules.counts(Request.objects.all()), [2])
+
+    def test_frame(self):
+        modules = Modules()
+        modules._modules = (Hit(),)
+        self.assertIn("user_agent", modules.frame_columns)
+        frame = Frame.from_queryset(Request.objects.all(), modules.frame_columns)
+        self.assertEqual(modules.counts(frame), [1])
+
+
+class ClassifyRequestsTest(TestCase):
+    def test_classify(self):
+        human = Request.objects.create(ip="1.2.3.4", user_agent=FIREFOX, is_bot=True)
+        bot = Request.objects.create(ip="1.2.3.4", user_agent=GOOGLEBOT)
+        Request.objects.create(ip="1.2.3.4", user_agent="")
+        stdout = StringIO()
+        call_command("classifyrequests", chunk_size=2, verbosity=2, stdout=stdout)
+        self.assertEqual(list(Request.objects.bots()), [bot])
+        self.assertFalse(Request.objects.get(pk=human.pk).is_bot)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(lines[-1], "2 requests updated.")
+        self.assertEqual(bots.classify_requests(), 0)
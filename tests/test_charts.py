@@ -0,0 +1,68 @@
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from django.test import SimpleTestCase
+
+from metrics import charts
+
+
+class PieChartTest(SimpleTestCase):
+    def test_slices(self):
+        svg = charts.pie_chart([("Chrome", 3), ("Firefox", 1)])
+        self.assertEqual(svg.count("<path "), 2)
+        self.assertIn("<title>Chrome: 3 (75.0%)</title>", svg)
+        self.assertIn("Firefox (1)", svg)
+
+    def test_single_item(self):
+        svg = charts.pie_chart([("Chrome", 3)])
+        self.assertIn("<circle ", svg)
+        self.assertNotIn("<path ", svg)
+
+    def test_empty(self):
+        self.assertNotIn("<path ", charts.pie_chart([]))
+        self.assertNotIn("<path ", charts.pie_chart([("Chrome", 0)]))
+
+    def test_escaped(self):
+        svg = charts.pie_chart([('<script>"', 1)])
+        self.assertNotIn("<script>", svg)
+        self.assertIn("&lt;script&gt;&quot;", svg)
+
+    def test_cached(self):
+        charts.render_pie_chart.cache_clear()
+        first = charts.pie_chart([("Chrome", 3), ("Firefox", 1)])
+        second = charts.pie_chart(iter([("Chrome", 3), ("Firefox", 1)]))
+        self.assertIs(first, second)
+        self.assertEqual(charts.render_pie_chart.cache_info().hits, 1)
+
+
+class BarChartTest(SimpleTestCase):
+    def test_bars(self):
+        svg = charts.bar_chart([("/foo", 4), ("/bar", 2)], width=400)
+        self.assertEqual(svg.count("<rect "), 2)
+        # 160 for the labels, 50 for the values: the longest bar is 190 wide.
+        self.assertIn('width="190.00"', svg)
+        self.assertIn('width="95.00"', svg)
+
+    def test_empty(self):
+        self.assertNotIn("<rect ", charts.bar_chart([]))
+        self.assertIn('width="0.00"', charts.bar_chart([("/foo", 0)]))
@@ -24,6 +24,7 @@
 from datetime import timedelta
 from io import StringIO
 
+from django.core.management import call_command
 from django.core.management.base import CommandError
 from django.test import TestCase
 from django.utils.timezone import now
@@ -31,7 +32,7 @@ import mock
 
 from metrics.management.commands.purgerequests import Command as PurgeRequest
 from metrics.management.commands.purgerequests import DURATION_OPTIONS
-from metrics.models import Request
+from metrics.models import Hostname, Request
 
 
 class PurgeRequestsTest(TestCase):
@@ -77,3 +78,21 @@ class PurgeRequestsTest(TestCase):
         PurgeRequest().handle(amount=1, duration="days", interactive=False)
         self.assertFalse(mock[0].called)
         self.assertEqual(1, Request.objects.count())
+
+
+class PurgeHostnamesTest(TestCase):
+    def test_expired(self):
+        Hostname.objects.create(ip="1.2.3.4", hostname="old.net", timestamp=now() - timedelta(days=2))
+        Hostname.objects.create(ip="5.6.7.8", hostname="new.net")
+        call_command("purgerequests", 1, "day", interactive=False, stdout=StringIO())
+        self.assertEqual(list(Hostname.objects.values_list("ip", flat=True)), ["5.6.7.8"])
+
+
+class PurgeBotRequestsTest(TestCase):
+    def test_bots(self):
+        old = now() - timedelta(days=31)
+        human = Request.objects.create(ip="1.2.3.4", timestamp=old)
+        Request.objects.create(ip="1.2.3.4", timestamp=old, is_bot=True)
+        bot = Request.objects.create(ip="1.2.3.4", is_bot=True)
+        call_command("purgerequests", 1, "day", bots=True, interactive=False, stdout=StringIO())
+        self.assertQuerysetEqual(Request.objects.order_by("id"), [human, bot], transform=lambda request: request)
@@ -0,0 +1,173 @@
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from django.contrib.auth.models import User
+from django.core import exceptions
+from django.http import HttpResponse, HttpResponseNotFound
+from django.test import RequestFactory, TestCase
+import mock
+
+from metrics import counters, traffic
+from metrics.middleware import RequestMiddleware
+from metrics.models import Request
+from metrics.views import openmetrics
+
+
+class RegistryTest(TestCase):
+    def setUp(self):
+        self.registry = counters.Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter("foo", "Foo help.", ("method",))
+        counter.inc(method="GET")
+        counter.inc(2, method="GET")
+        counter.inc(method="POST")
+        self.assertEqual(
+            counter.samples(self.registry.store.snapshot()),
+            [("foo_total", (("method", "GET"),), 3), ("foo_total", (("method", "POST"),), 1)],
+        )
+
+    def test_counter_bad_labels(self):
+        counter = self.registry.counter("foo", "Foo help.", ("method",))
+        self.assertRaises(ValueError, counter.inc, path="/")
+
+    def test_counter_without_labels_is_exposed_at_zero(self):
+        counter = self.registry.counter("foo", "Foo help.")
+        self.assertEqual(counter.samples({}), [("foo_total", (), 0)])
+
+    def test_register_twice(self):
+        self.registry.counter("foo", "Foo help.")
+        self.assertRaises(ValueError, self.registry.counter, "foo", "Foo help.")
+
+    def test_histogram(self):
+        histogram = self.registry.histogram("bar", "Bar help.", buckets=(0.1, 1))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(3)
+        self.assertEqual(
+            histogram.samples(self.registry.store.snapshot()),
+            [
+                ("bar_bucket", (("le", "0.1"),), 1),
+                ("bar_bucket", (("le", "1"),), 2),
+                ("bar_bucket", (("le", "+Inf"),), 3),
+                ("bar_count", (), 3),
+                ("bar_sum", (), 3.55),
+            ],
+        )
+
+    def test_generate(self):
+        counter = self.registry.counter("foo", "Foo help.", ("path",))
+        counter.inc(path='/a"b')
+        self.assertEqual(
+            counters.generate(self.registry),
+            '# TYPE foo counter\n# HELP foo Foo help.\nfoo_total{path="/a\\"b"} 1\n# EOF\n',
+        )
+
+
+class RecordTest(TestCase):
+    def setUp(self):
+        counters.registry.store.reset()
+
+    def sample(self, name, **labels):
+        labels = tuple(sorted(labels.items()))
+        for key, value in counters.registry.store.snapshot().items():
+            if key[0] == name and tuple(sorted(key[1])) == labels:
+                return value
+        return 0
+
+    def test_record(self):
+        counters.record(Request(method="GET", status_code=404), route="foo/", duration=0.2)
+        self.assertEqual(self.sample("metrics_requests_total", method="GET", route="foo/", status_code="404"), 1)
+        self.assertEqual(self.sample("metrics_hit_total"), 1)
+        self.assertEqual(self.sample("metrics_error_total"), 1)
+        self.assertEqual(self.sample("metrics_error404_total"), 1)
+        self.assertEqual(self.sample("metrics_unsecure_total"), 1)
+        self.assertEqual(self.sample("metrics_secure_total"), 0)
+        self.assertEqual(self.sample("metrics_request_duration_seconds_sum", method="GET", route="foo/"), 0.2)
+
+    def test_record_bot(self):
+        counters.record(Request(method="GET", is_bot=True), route="foo/")
+        self.assertEqual(self.sample("metrics_requests_total", method="GET", route="foo/", status_code="200"), 1)
+        self.assertEqual(self.sample("metrics_hit_total"), 0)
+        with mock.patch("metrics.settings.TRAFFIC_HUMANS_ONLY", False):
+            counters.record(Request(method="GET", is_bot=True), route="foo/")
+        self.assertEqual(self.sample("metrics_hit_total"), 1)
+
+    @mock.patch("metrics.settings.COUNTER_MODULES", ("metrics.traffic.UniqueVisitor",))
+    @mock.patch("metrics.counters.counter_modules", traffic.Modules("COUNTER_MODULES"))
+    def test_module_without_matches(self):
+        self.assertRaises(exceptions.ImproperlyConfigured, counters.module_counters)
+
+    @mock.patch("metrics.middleware.settings.COUNTERS", True)
+    def test_middleware(self):
+        request = RequestFactory().get("/foo")
+        RequestMiddleware(lambda request: HttpResponseNotFound())(request)
+        self.assertEqual(self.sample("metrics_error404_total"), 1)
+        self.assertEqual(self.sample("metrics_request_duration_seconds_count", method="GET", route=""), 0)
+        self.assertEqual(Request.objects.count(), 1)
+
+    @mock.patch("metrics.middleware.settings.ONLY_ERRORS", True)
+    @mock.patch("metrics.middleware.settings.COUNTERS", True)
+    def test_middleware_counts_unstored_requests(self):
+        request = RequestFactory().get("/foo")
+        RequestMiddleware(lambda request: HttpResponse())(request)
+        self.assertEqual(self.sample("metrics_hit_total"), 1)
+        self.assertEqual(Request.objects.count(), 0)
+
+    @mock.patch("metrics.middleware.settings.COUNTERS", False)
+    def test_middleware_counters_disabled(self):
+        request = RequestFactory().get("/foo")
+        RequestMiddleware(lambda request: HttpResponse())(request)
+        self.assertEqual(self.sample("metrics_hit_total"), 0)
+
+
+class OpenMetricsViewTest(TestCase):
+    def test_openmetrics(self):
+        counters.registry.store.reset()
+        counters.record(Request(method="GET"), route="foo/")
+        request = RequestFactory().get("/metrics/")
+        with self.assertNumQueries(0):
+            response = openmetrics(request)
+        self.assertEqual(response["Content-Type"], counters.CONTENT_TYPE)
+        content = response.content.decode()
+        self.assertIn("# TYPE metrics_hit counter\n", content)
+        self.assertIn("metrics_hit_total 1\n", content)
+        self.assertIn('metrics_requests_total{method="GET",route="foo/",status_code="200"} 1\n', content)
+        self.assertTrue(content.endswith("# EOF\n"))
+
+    def test_not_allowed(self):
+        request = RequestFactory().get("/metrics/", REMOTE_ADDR="10.1.2.3")
+        with self.assertRaises(exceptions.PermissionDenied):
+            openmetrics(request)
+        request.user = User(is_staff=True)
+        self.assertEqual(openmetrics(request).status_code, 200)
+
+    @mock.patch("metrics.settings.OPENMETRICS_ALLOWED_IPS", ["10.0.0.0/8"])
+    def test_allowed_network(self):
+        self.assertEqual(openmetrics(RequestFactory().get("/metrics/", REMOTE_ADDR="10.1.2.3")).status_code, 200)
+        with self.assertRaises(exceptions.PermissionDenied):
+            openmetrics(RequestFactory().get("/metrics/"))
+
+    @mock.patch("metrics.settings.OPENMETRICS_ALLOWED_IPS", None)
+    def test_allowed_everyone(self):
+        self.assertEqual(openmetrics(RequestFactory().get("/metrics/", REMOTE_ADDR="10.1.2.3")).status_code, 200)
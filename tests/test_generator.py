@@ -0,0 +1,93 @@
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from collections import Counter
+import datetime
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import timezone
+import mock
+
+from metrics.generator import generate_requests, TrafficGenerator
+from metrics.models import Request
+from metrics.utils import browsers
+
+
+def fields(requests):
+    return [(r.timestamp, r.path, r.status_code, r.ip, r.referer, r.user_agent, r.user_id) for r in requests]
+
+
+class TrafficGeneratorTest(TestCase):
+    def test_reproducible(self):
+        end = datetime.date(2021, 6, 1)
+        first = fields(TrafficGenerator(seed=1, end=end).requests(100))
+        self.assertEqual(fields(TrafficGenerator(seed=1, end=end).requests(100)), first)
+        self.assertNotEqual(fields(TrafficGenerator(seed=2, end=end).requests(100)), first)
+        self.assertNotEqual(fields(TrafficGenerator(seed=1, end=end).requests(100, stream=1)), first)
+
+    def test_distributions(self):
+        generator = TrafficGenerator(seed=0, days=7, paths=100, visitors=50)
+        requests = list(generator.requests(5000))
+        now = timezone.now()
+        self.assertTrue(all(now - datetime.timedelta(days=8) < r.timestamp < now for r in requests))
+        paths = Counter(r.path for r in requests)
+        self.assertEqual(paths.most_common(1)[0][0], "/")
+        self.assertGreater(paths["/"], 5 * paths[generator.paths[10]])
+        self.assertLessEqual(len({r.ip for r in requests}), 50)
+        errors = sum(r.status_code >= 400 for r in requests) / len(requests)
+        self.assertTrue(0.01 < errors < 0.03, errors)
+        self.assertTrue(any(r.keywords for r in requests))
+        self.assertIn("Google Chrome", {browsers.resolve(r.user_agent)[0] for r in requests})
+        hours = Counter(
+            timezone.localtime(r.timestamp).hour if timezone.is_aware(r.timestamp) else r.timestamp.hour
+            for r in requests
+        )
+        self.assertGreater(hours[15], 3 * hours[3])
+
+    def test_generate_requests(self):
+        stdout = StringIO()
+        self.assertEqual(generate_requests(250, stream_size=100, seed=3, stdout=stdout), 250)
+        self.assertEqual(Request.objects.count(), 250)
+        self.assertIn("250 requests written.", stdout.getvalue())
+        expected = fields(TrafficGenerator(seed=3).requests(100))
+        self.assertEqual(fields(Request.objects.order_by("id")[:100]), expected)
+
+
+class GenerateRequestsCommandTest(TestCase):
+    def test_command(self):
+        stdout = StringIO()
+        call_command("generaterequests", 300, seed=1, interactive=False, stdout=stdout)
+        self.assertEqual(Request.objects.count(), 300)
+        self.assertIn("300 requests generated.", stdout.getvalue())
+
+    @mock.patch("metrics.management.commands.generaterequests.input", return_value="no", create=True)
+    def test_interactive_non_confirmed(self, *mocks):
+        call_command("generaterequests", 10, stdout=StringIO())
+        self.assertEqual(Request.objects.count(), 0)
+
+    def test_invalid(self):
+        with self.assertRaises(CommandError):
+            call_command("generaterequests", 0, interactive=False, stdout=StringIO())
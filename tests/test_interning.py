@@ -0,0 +1,218 @@
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from importlib import import_module
+from io import StringIO
+
+from django.contrib.admin import site
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.test import override_settings, TestCase
+import mock
+
+from metrics import plugins
+from metrics.admin import RequestAdmin
+from metrics.interning import header_sets, interner, normalize_requests
+from metrics.models import HeaderSet, Request, Term
+from metrics.traffic import Search, UniqueVisit
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0"
+
+
+class InternerTest(TestCase):
+    def setUp(self):
+        interner.clear()
+        self.addCleanup(interner.clear)
+
+    def test_intern(self):
+        pk = interner.intern("path", "/foo/")
+        self.assertEqual(interner.intern("path", "/foo/"), pk)
+        self.assertNotEqual(interner.intern("full_path", "/foo/"), pk)
+        self.assertEqual(Term.objects.get(pk=pk).value, "/foo/")
+        self.assertEqual(Term.objects.count(), 2)
+
+    def test_values(self):
+        pk = Term.objects.create(kind="path", digest="x", value="/foo/").pk
+        self.assertEqual(interner.values([pk]), {pk: "/foo/"})
+        with self.assertNumQueries(0):
+            self.assertEqual(interner.values([pk]), {pk: "/foo/"})
+
+    def test_intern_existing(self):
+        pk = interner.intern("path", "/foo/")
+        interner.clear()
+        self.assertEqual(interner.intern("path", "/foo/"), pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(interner.intern("path", "/foo/"), pk)
+
+
+@mock.patch("metrics.settings.NORMALIZE_STRINGS", True)
+class NormalizedRequestTest(TestCase):
+    def setUp(self):
+        interner.clear()
+        self.addCleanup(interner.clear)
+
+    def create(self, **kwargs):
+        kwargs.setdefault("ip", "1.2.3.4")
+        return Request.objects.create(**kwargs)
+
+    def test_save(self):
+        request = self.create(path="/foo/", referer="http://example.com/", user_agent=USER_AGENT)
+        self.assertEqual(request.path, "/foo/")
+        row = Request.objects.filter(pk=request.pk).values("path", "path_term", "language", "language_term").get()
+        self.assertEqual(row["path"], "")
+        self.assertEqual(Term.objects.get(pk=row["path_term"]).value, "/foo/")
+        self.assertEqual((row["language"], row["language_term"]), ("", None))
+
+    def test_bulk_insert(self):
+        requests = [Request(ip="1.2.3.4", path="/foo/") for index in range(3)]
+        self.assertEqual(Request.objects.bulk_insert(requests, batch_size=2), 3)
+        self.assertEqual(requests[0].path, "/foo/")
+        self.assertEqual(list(Request.objects.values_list("path", flat=True)), ["", "", ""])
+        top = Request.objects.top("path")
+        self.assertEqual([(row["path"], row["path__count"]) for row in top], [("/foo/", 3)])
+
+    def test_load(self):
+        pk = self.create(path="/foo/", referer="http://example.com/", user_agent=USER_AGENT).pk
+        request = Request.objects.get(pk=pk)
+        self.assertEqual(
+            (request.path, request.referer, request.user_agent), ("/foo/", "http://example.com/", USER_AGENT)
+        )
+        self.assertEqual(request.browser, "Firefox")
+
+    def test_top(self):
+        for path in ("/foo/", "/bar/", "/foo/"):
+            self.create(path=path)
+        top = Request.objects.top("path")
+        self.assertEqual([(row["path"], row["path__count"]) for row in top], [("/foo/", 2), ("/bar/", 1)])
+        self.assertIsNotNone(top[0]["path_term"])
+
+    def test_lookups(self):
+        self.create(path="/Foo/", referer="https://www.google.com/search?q=foo")
+        self.create(path="/bar/", referer="http://testserver/")
+        self.assertEqual(Request.objects.path_contains("foo").count(), 1)
+        self.assertEqual(Request.objects.search().count(), 1)
+        with mock.patch("metrics.settings.BASE_URL", "http://testserver"):
+            self.assertEqual(Request.objects.unique_visits().count(), 1)
+
+    @mock.patch("metrics.settings.BASE_URL", "http://testserver")
+    def test_traffic_modules(self):
+        self.create(referer="https://www.google.com/search?q=foo")
+        self.create(referer="http://testserver/")
+        self.create()
+        self.assertEqual(UniqueVisit().count(Request.objects.all()), 2)
+        self.assertEqual(Search().count(Request.objects.all()), 1)
+
+    def test_plugins(self):
+        self.create(path="/foo/", referer="https://www.google.com/search?q=foo+bar", user_agent=USER_AGENT)
+        self.create(path="/foo/", referer="https://www.google.com/search?q=foo+bar", user_agent=USER_AGENT)
+        for plugin_class, key, expected in (
+            (plugins.TopSearchPhrases, "phrases", [("foo bar", 2)]),
+            (plugins.TopBrowsers, "browsers", [("Firefox", 2)]),
+        ):
+            plugin = plugin_class()
+            plugin.qs = Request.objects.all()
+            self.assertEqual(plugin.template_context()[key], expected)
+
+
+class NormalizeRequestsTest(TestCase):
+    def setUp(self):
+        interner.clear()
+        self.addCleanup(interner.clear)
+        for path in ("/foo/", "/bar/", "/foo/"):
+            Request.objects.create(ip="1.2.3.4", path=path, user_agent=USER_AGENT)
+
+    def test_normalize_and_reverse(self):
+        self.assertEqual(normalize_requests(chunk_size=2), 3)
+        self.assertFalse(Request.objects.exclude(path="").exists())
+        self.assertEqual(Term.objects.filter(kind="path").count(), 2)
+        self.assertEqual(Term.objects.filter(kind="user_agent").count(), 1)
+        # Already normalized.
+        self.assertEqual(normalize_requests(), 0)
+
+        self.assertEqual(normalize_requests(reverse=True), 3)
+        self.assertEqual(sorted(Request.objects.values_list("path", flat=True)), ["/bar/", "/foo/", "/foo/"])
+        self.assertFalse(Request.objects.exclude(path_term=None).exists())
+
+    def test_migration(self):
+        migration = import_module("metrics.migrations.0014_normalize_strings")
+        apps = MigrationLoader(connection).project_state(("metrics", "0014_normalize_strings")).apps
+        schema_editor = mock.Mock(connection=connection)
+        with mock.patch.object(migration, "CHUNK_SIZE", 2):
+            migration.forwards(apps, schema_editor)
+            self.assertFalse(Request.objects.filter(path="").exists())
+            with override_settings(METRICS_NORMALIZE_STRINGS=True):
+                migration.forwards(apps, schema_editor)
+            self.assertFalse(Request.objects.exclude(path="").exists())
+            self.assertEqual(Term.objects.filter(kind="path").count(), 2)
+
+            migration.backwards(apps, schema_editor)
+        self.assertEqual(sorted(Request.objects.values_list("path", flat=True)), ["/bar/", "/foo/", "/foo/"])
+        self.assertFalse(Request.objects.exclude(path_term=None).exists())
+
+    def test_command(self):
+        with self.assertRaises(CommandError):
+            call_command("normalizerequests", stdout=StringIO())
+        with mock.patch("metrics.settings.NORMALIZE_STRINGS", True):
+            stdout = StringIO()
+            call_command("normalizerequests", stdout=stdout)
+            self.assertIn("3 requests updated.", stdout.getvalue())
+            with self.assertRaises(CommandError):
+                call_command("normalizerequests", reverse=True, stdout=StringIO())
+        call_command("normalizerequests", reverse=True, stdout=StringIO())
+        self.assertFalse(Request.objects.filter(path="").exists())
+
+
+@mock.patch("metrics.settings.DEDUPLICATE_HEADERS", True)
+class HeaderSetTest(TestCase):
+    def setUp(self):
+        header_sets.clear()
+        self.addCleanup(header_sets.clear)
+
+    def test_save(self):
+        first = Request.objects.create(ip="1.2.3.4", headers={"HTTP_ACCEPT": "*/*", "HTTP_HOST": "example.com"})
+        second = Request.objects.create(ip="1.2.3.4", headers={"HTTP_HOST": "example.com", "HTTP_ACCEPT": "*/*"})
+        self.assertEqual(first.headers, {"HTTP_ACCEPT": "*/*", "HTTP_HOST": "example.com"})
+        self.assertEqual(first.header_set_id, second.header_set_id)
+        self.assertEqual(HeaderSet.objects.count(), 1)
+        self.assertEqual(list(Request.objects.values_list("headers", flat=True)), [{}, {}])
+
+    def test_bulk_insert(self):
+        requests = [Request(ip="1.2.3.4", headers={"HTTP_HOST": "example.com"}) for index in range(3)]
+        self.assertEqual(Request.objects.bulk_insert(requests), 3)
+        self.assertEqual(requests[0].headers, {"HTTP_HOST": "example.com"})
+        self.assertEqual(HeaderSet.objects.count(), 1)
+        self.assertEqual(list(Request.objects.values_list("headers", flat=True)), [{}, {}, {}])
+
+    def test_without_headers(self):
+        request = Request.objects.create(ip="1.2.3.4")
+        self.assertIsNone(request.header_set_id)
+
+    def test_load(self):
+        pk = Request.objects.create(ip="1.2.3.4", headers={"HTTP_HOST": "example.com"}).pk
+        requests = list(Request.objects.filter(pk=pk)) + list(Request.objects.filter(pk=pk))
+        self.assertEqual([request.headers for request in requests], [{"HTTP_HOST": "example.com"}] * 2)
+        requests[0].headers["HTTP_HOST"] = "changed"
+        self.assertEqual(Request.objects.get(pk=pk).headers, {"HTTP_HOST": "example.com"})
+        self.assertIn("example.com", RequestAdmin(Request, site)._headers(Request.objects.get(pk=pk)))
@@ -0,0 +1,187 @@
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from datetime import datetime
+from itertools import islice
+import json
+from queue import Queue
+import threading
+import time
+from unittest import skipUnless
+
+from django.contrib.admin import site
+from django.db import connection
+from django.http import Http404
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.utils.timezone import utc
+import mock
+
+from metrics import live
+from metrics.admin import RequestAdmin
+from metrics.models import Request
+
+
+class EncodeTest(TestCase):
+    def make_request(self, path="/foo"):
+        return Request(
+            id=1,
+            timestamp=datetime(2021, 1, 2, 3, 4, 5, tzinfo=utc),
+            method="GET",
+            path=path,
+            status_code=200,
+            ip="1.2.3.4",
+            user_id=None,
+        )
+
+    def test_encode(self):
+        payloads = live.encode([self.make_request()])
+        self.assertEqual(payloads, ['[[1,"2021-01-02T03:04:05Z","GET","/foo",200,"1.2.3.4",null]]'])
+
+    def test_long_path(self):
+        row = json.loads(live.encode([self.make_request("/" + "x" * 1000)])[0])[0]
+        self.assertEqual(len(row[3]), live.MAX_PATH)
+
+    def test_batches(self):
+        requests = [self.make_request()] * 300
+        payloads = live.encode(requests)
+        self.assertGreater(len(payloads), 1)
+        self.assertTrue(all(len(payload.encode()) <= live.MAX_PAYLOAD for payload in payloads))
+        self.assertEqual(sum(len(json.loads(payload)) for payload in payloads), 300)
+
+    def test_empty(self):
+        self.assertEqual(live.encode([]), [])
+
+
+class PublishTest(TestCase):
+    def test_disabled(self):
+        request = Request.objects.create(ip="1.2.3.4")
+        with self.assertNumQueries(0):
+            live.publish([request])
+
+    @mock.patch("metrics.settings.LIVE_FEED", True)
+    def test_enabled(self):
+        request = Request.objects.create(ip="1.2.3.4")
+        with self.assertNumQueries(1 if connection.vendor == "postgresql" else 0):
+            live.publish([request])
+
+
+@mock.patch.object(live.threading, "Thread")
+class ListenerTest(TestCase):
+    def test_dispatch(self, Thread):
+        listener = live.Listener("metrics_test")
+        first, second = listener.subscribe(), listener.subscribe()
+        Thread.return_value.start.assert_called_once_with()
+        listener.dispatch("[]")
+        self.assertEqual((first.get_nowait(), second.get_nowait()), ("[]", "[]"))
+
+        listener.unsubscribe(second)
+        listener.dispatch("[1]")
+        self.assertEqual(first.get_nowait(), "[1]")
+        self.assertTrue(second.empty())
+
+    def test_slow_subscriber(self, Thread):
+        listener = live.Listener("metrics_test", max_size=1)
+        queue = listener.subscribe()
+        listener.dispatch("[1]")
+        listener.dispatch("[2]")
+        self.assertEqual(queue.get_nowait(), "[1]")
+        self.assertTrue(queue.empty())
+
+    def test_unexpected_error(self, Thread):
+        listener = live.Listener("metrics_test")
+        listener.subscribe()
+        listener._thread = threading.current_thread()
+        with mock.patch.object(listener, "connect", side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                listener._run()
+        self.assertIsNone(listener._thread)
+        listener.subscribe()
+        self.assertEqual(Thread.return_value.start.call_count, 2)
+
+    def test_stops_without_subscribers(self, Thread):
+        listener = live.Listener("metrics_test")
+        listener.unsubscribe(listener.subscribe())
+        self.assertFalse(listener.listening())
+        listener.subscribe()
+        self.assertEqual(Thread.return_value.start.call_count, 2)
+
+
+class EventsTest(TestCase):
+    def test_events(self):
+        queue = Queue()
+        queue.put("[1]")
+        with mock.patch.object(live.listener, "unsubscribe") as unsubscribe:
+            events = live.events(queue, keepalive=0.01)
+            self.assertEqual(list(islice(events, 3)), ["retry: 5000\n\n", "data: [1]\n\n", ": keepalive\n\n"])
+            events.close()
+        unsubscribe.assert_called_once_with(queue)
+
+    def test_lifetime(self):
+        with mock.patch.object(live.listener, "unsubscribe") as unsubscribe:
+            self.assertEqual(list(live.events(Queue(), lifetime=0.01)), ["retry: 5000\n\n", ": keepalive\n\n"])
+        unsubscribe.assert_called_once()
+
+
+class LiveViewTest(TestCase):
+    def setUp(self):
+        self.admin = RequestAdmin(Request, site)
+        self.request = RequestFactory().get("/foo")
+
+    def test_disabled(self):
+        with self.assertRaises(Http404):
+            self.admin.live(self.request)
+
+    @mock.patch("metrics.settings.LIVE_FEED", True)
+    def test_enabled(self):
+        if connection.vendor != "postgresql":
+            with self.assertRaises(Http404):
+                self.admin.live(self.request)
+            return
+        with mock.patch.object(live.listener, "subscribe", return_value=Queue()):
+            response = self.admin.live(self.request)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(next(response.streaming_content), b"retry: 5000\n\n")
+        response.close()
+
+
+@skipUnless(connection.vendor == "postgresql", "the live feed needs PostgreSQL")
+@mock.patch("metrics.settings.LIVE_FEED", True)
+@mock.patch("metrics.settings.LIVE_FEED_CHANNEL", "metrics_test")
+class NotifyTest(TransactionTestCase):
+    available_apps = ["metrics"]
+
+    def test_notify(self):
+        listener = live.Listener("metrics_test", timeout=0.1)
+        queue = listener.subscribe()
+        try:
+            request = Request.objects.create(path="/live", ip="1.2.3.4")
+            # Publish until the listener is connected.
+            deadline = time.monotonic() + 10
+            while queue.empty() and time.monotonic() < deadline:
+                live.publish([request])
+                time.sleep(0.1)
+            rows = json.loads(queue.get_nowait())
+        finally:
+            listener.unsubscribe(queue)
+        self.assertEqual(rows[0][0], request.id)
+        self.assertEqual(rows[0][3], "/live")
@@ -21,15 +21,20 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from datetime import date, timedelta
+from datetime import date, datetime, time, timedelta
+from importlib import import_module
 
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
 from django.test import override_settings, TestCase
-from django.utils.timezone import now
+from django.utils.timezone import make_aware, now, utc
+import mock
+import pytz
 
 from metrics import settings
-from metrics.managers import QUERYSET_PROXY_METHODS, RequestQuerySet
-from metrics.models import Request
+from metrics.managers import copy_prep_value, copy_value, QUERYSET_PROXY_METHODS, RequestQuerySet
+from metrics.models import LastSeen, Request
 
 User = get_user_model()
 
@@ -79,16 +84,132 @@ class RequestManagerTest(TestCase):
         users = Request.objects.active_users(**options)
         self.assertEqual(len(users), 1)
 
+    def test_active_users_reads_last_seen(self):
+        Request.objects.create(user=self.user, ip="1.2.3.4")
+        LastSeen.objects.create(user_id=self.user_2.pk, timestamp=now() - timedelta(hours=1))
+        with self.assertNumQueries(2):
+            users = list(Request.objects.active_users(minutes=15))
+        self.assertEqual(users, [self.user])
+
+    def test_bulk_insert(self):
+        requests = (Request(ip="1.2.3.4", path=f"/{index}/") for index in range(5))
+        with self.assertNumQueries(3):
+            self.assertEqual(Request.objects.bulk_insert(requests, batch_size=2), 5)
+        self.assertEqual(Request.objects.filter(ip="1.2.3.4").count(), 5)
+
+    def test_copy_value(self):
+        self.assertEqual(copy_value(None), "")
+        self.assertEqual(copy_value(""), '""')
+        self.assertEqual(copy_value('say "hi"'), '"say ""hi"""')
+        self.assertEqual(copy_value(True), '"True"')
+
+    def test_copy_prep_value(self):
+        field = Request._meta.get_field("headers")
+        value = copy_prep_value(field, {"HTTP_HOST": 'say "hi"'}, connection)
+        self.assertEqual(value, '{"HTTP_HOST": "say \\"hi\\""}')
+        self.assertEqual(copy_prep_value(Request._meta.get_field("method"), "GET", connection), "GET")
+
+    def test_bulk_insert_json(self):
+        headers = {"HTTP_HOST": "example.com", "HTTP_X_QUOTE": "'\""}
+        Request.objects.bulk_insert([Request(ip="1.2.3.4", headers=headers, query_string={"q": ["a,b"]})])
+        request = Request.objects.get()
+        self.assertEqual((request.headers, request.query_string), (headers, {"q": ["a,b"]}))
+
+
+class PrefetchUsersTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="foo")
+        self.user_2 = User.objects.create(username="bar")
+        Request.objects.create(user=self.user, ip="1.2.3.4")
+        Request.objects.create(user=self.user, ip="1.2.3.4")
+        Request.objects.create(user=self.user_2, ip="1.2.3.4")
+        Request.objects.create(ip="1.2.3.4")
+
+    def test_prefetch_users(self):
+        with self.assertNumQueries(2):
+            requests = list(Request.objects.order_by("id").prefetch_users())
+            users = [request.user for request in requests]
+        self.assertEqual(users, [self.user, self.user, self.user_2, None])
+        self.assertIs(users[0], users[1])
+
+    def test_prefetch_users_sliced(self):
+        with self.assertNumQueries(2):
+            requests = Request.objects.prefetch_users().order_by("id")[1:3]
+            users = [request.user for request in requests]
+        self.assertEqual(users, [self.user, self.user_2])
+
+    def test_prefetch_users_values(self):
+        values = list(Request.objects.prefetch_users().values_list("user_id", flat=True))
+        self.assertEqual(len(values), 4)
+
+    def test_without_prefetch(self):
+        with self.assertNumQueries(4):
+            for request in Request.objects.all():
+                request.user
+                request.user
+
+    def test_deleted_user(self):
+        user_id = self.user_2.pk
+        self.user_2.delete()
+        with self.assertNumQueries(2):
+            requests = list(Request.objects.filter(user_id=user_id).prefetch_users())
+            self.assertIsNone(requests[0].user)
+            self.assertIsNone(requests[0].user)
+
+
+class LastSeenManagerTest(TestCase):
+    def test_touch(self):
+        timestamp = now()
+        LastSeen.objects.touch(1, timestamp)
+        self.assertEqual(LastSeen.objects.get(pk=1).timestamp, timestamp)
+
+    def test_touch_newer(self):
+        LastSeen.objects.touch(1, now() - timedelta(hours=1))
+        timestamp = now()
+        LastSeen.objects.touch(1, timestamp)
+        self.assertEqual(LastSeen.objects.get(pk=1).timestamp, timestamp)
+
+    def test_touch_older(self):
+        timestamp = now()
+        LastSeen.objects.touch(1, timestamp)
+        LastSeen.objects.touch(1, timestamp - timedelta(hours=1))
+        self.assertEqual(LastSeen.objects.get(pk=1).timestamp, timestamp)
+
+    def test_request_save_touches(self):
+        user = User.objects.create(username="foo")
+        request = Request.objects.create(user=user, ip="1.2.3.4")
+        self.assertEqual(LastSeen.objects.get(pk=user.pk).timestamp, request.timestamp)
+
+    @mock.patch("metrics.models.settings.TRACK_PRESENCE", False)
+    def test_request_save_without_presence(self):
+        Request.objects.create(user_id=1, ip="1.2.3.4")
+        self.assertFalse(LastSeen.objects.exists())
+
+    @mock.patch("metrics.models.settings.TRACK_PRESENCE", False)
+    def test_migration(self):
+        migration = import_module("metrics.migrations.0009_lastseen")
+        apps = MigrationLoader(connection).project_state(("metrics", "0009_lastseen")).apps
+        timestamp = now() - timedelta(days=90)
+        for days, user_id in ((0, 1), (30, 1), (1, 2), (0, None)):
+            Request.objects.create(user_id=user_id, ip="1.2.3.4", timestamp=timestamp - timedelta(days=days))
+        with mock.patch.object(migration, "CHUNK_SIZE", 2):
+            migration.populate_last_seen(apps, mock.Mock(connection=connection))
+        self.assertEqual(
+            list(LastSeen.objects.order_by("user_id").values_list("user_id", "timestamp")),
+            [(1, timestamp), (2, timestamp - timedelta(days=1))],
+        )
+
 
+@override_settings(USE_TZ=True, TIME_ZONE="UTC")
 class RequestQuerySetTest(TestCase):
     def setUp(self):
         user = User.objects.create(username="foo")
         self.request = Request.objects.create(user=user, ip="1.2.3.4")
 
     def test_year(self):
-        qs = Request.objects.all().year(self.request.time.year)
+        qs = Request.objects.all().year(self.request.timestamp.year)
         self.assertEqual(qs.count(), 1)
-        qs = Request.objects.all().year(self.request.time.year + 1)
+        qs = Request.objects.all().year(self.request.timestamp.year + 1)
         self.assertEqual(qs.count(), 0)
 
     def test_month(self):
@@ -105,10 +226,10 @@ class RequestQuerySetTest(TestCase):
 
     def test_month_without_date(self):
         now_month = now().strftime("%b")
-        qs = Request.objects.all().month(year=str(self.request.time.year), month=now_month)
+        qs = Request.objects.all().month(year=str(self.request.timestamp.year), month=now_month)
         self.assertEqual(qs.count(), 1)
         previous_month = (now() - timedelta(days=31)).strftime("%b")
-        qs = Request.objects.all().month(year=str(self.request.time.year), month=previous_month)
+        qs = Request.objects.all().month(year=str(self.request.timestamp.year), month=previous_month)
         self.assertEqual(qs.count(), 0)
 
     def test_month_without_date_year_and_month(self):
@@ -123,7 +244,7 @@ class RequestQuerySetTest(TestCase):
     def test_month_is_december(self):
         # setUp
         december_date = date(2015, 12, 1)
-        self.request.time = december_date
+        self.request.timestamp = make_aware(datetime.combine(december_date, time.min))
         self.request.save()
         # Test
         qs = Request.objects.all().month(date=december_date)
@@ -132,7 +253,7 @@ class RequestQuerySetTest(TestCase):
     def test_month_is_not_december(self):
         # setUp
         november_date = date(2015, 11, 1)
-        self.request.time = november_date
+        self.request.timestamp = make_aware(datetime.combine(november_date, time.min))
         self.request.save()
         # Test
         qs = Request.objects.all().month(date=november_date)
@@ -141,7 +262,7 @@ class RequestQuerySetTest(TestCase):
     def test_week(self):
         # setUp
         january_date = date(2015, 1, 6)
-        self.request.time = january_date
+        self.request.timestamp = make_aware(datetime.combine(january_date, time.min))
         self.request.save()
         # Test
         qs = Request.objects.all().week(year="2015", week="1")
@@ -181,7 +302,7 @@ class RequestQuerySetTest(TestCase):
     def test_today(self):
         # setUp
         request = Request.objects.create(ip="1.2.3.4")
-        request.time = request.time - timedelta(days=3)
+        request.timestamp = request.timestamp - timedelta(days=3)
         request.save()
         # Test
         qs = Request.objects.all().today()
@@ -190,7 +311,7 @@ class RequestQuerySetTest(TestCase):
     def test_this_year(self):
         # setUp
         request = Request.objects.create(ip="1.2.3.4")
-        request.time = request.time - timedelta(days=700)
+        request.timestamp = request.timestamp - timedelta(days=700)
         request.save()
         # Test
         qs = Request.objects.all().this_year()
@@ -199,7 +320,7 @@ class RequestQuerySetTest(TestCase):
     def test_this_month(self):
         # setUp
         request = Request.objects.create(ip="1.2.3.4")
-        request.time = request.time - timedelta(days=60)
+        request.timestamp = request.timestamp - timedelta(days=60)
         request.save()
         # Test
         qs = Request.objects.all().this_month()
@@ -210,20 +331,65 @@ class RequestQuerySetTest(TestCase):
         self.assertEqual(1, qs.count())
 
     def test_sunday_in_this_week_today(self):
-        self.request.time -= timedelta(days=self.request.time.weekday())
+        self.request.timestamp -= timedelta(days=self.request.timestamp.weekday())
+        self.request.save()
         qs = Request.objects.all().this_week()
         self.assertEqual(1, qs.count())
 
     def test_this_week(self):
         # setUp
         request = Request.objects.create(ip="1.2.3.4")
-        request.time = request.time - timedelta(days=21)
+        request.timestamp = request.timestamp - timedelta(days=21)
         request.save()
         # Test
-        self.skipTest("Real error here before tests")
         qs = Request.objects.all().this_week()
         self.assertEqual(1, qs.count())
 
+    def test_period(self):
+        anchor = datetime(2015, 3, 4, 12, tzinfo=utc)
+        self.request.timestamp = anchor
+        self.request.save()
+        for kind in ("day", "week", "month", "year"):
+            with self.subTest(kind=kind):
+                qs = Request.objects.period(kind, anchor)
+                self.assertEqual(qs.count(), 1)
+                start, end = qs.archive_range
+                self.assertLessEqual(start, anchor)
+                self.assertLess(anchor, end)
+
+    def test_period_boundaries(self):
+        qs = Request.objects.period("week", date(2015, 3, 4))
+        self.assertEqual(qs.archive_range, (make_aware(datetime(2015, 3, 1)), make_aware(datetime(2015, 3, 8))))
+        qs = Request.objects.period("month", date(2015, 12, 31))
+        self.assertEqual(qs.archive_range, (make_aware(datetime(2015, 12, 1)), make_aware(datetime(2016, 1, 1))))
+        qs = Request.objects.period("year", date(2015, 6, 1))
+        self.assertEqual(qs.archive_range, (make_aware(datetime(2015, 1, 1)), make_aware(datetime(2016, 1, 1))))
+
+    def test_period_is_half_open(self):
+        self.request.timestamp = make_aware(datetime(2015, 3, 5))
+        self.request.save()
+        self.assertEqual(Request.objects.period("day", date(2015, 3, 4)).count(), 0)
+        self.assertEqual(Request.objects.period("day", date(2015, 3, 5)).count(), 1)
+
+    def test_period_tz(self):
+        # 23:30 UTC is already the next day in Rome.
+        self.request.timestamp = datetime(2015, 3, 4, 23, 30, tzinfo=utc)
+        self.request.save()
+        rome = pytz.timezone("Europe/Rome")
+        self.assertEqual(Request.objects.period("day", date(2015, 3, 4), tz=utc).count(), 1)
+        self.assertEqual(Request.objects.period("day", date(2015, 3, 4), tz=rome).count(), 0)
+        self.assertEqual(Request.objects.period("day", date(2015, 3, 5), tz=rome).count(), 1)
+
+    def test_period_dst(self):
+        # The day the clocks go forward in Rome is 23 hours long.
+        rome = pytz.timezone("Europe/Rome")
+        start, end = Request.objects.period("day", date(2015, 3, 29), tz=rome).archive_range
+        self.assertEqual(end - start, timedelta(hours=23))
+
+    def test_period_unknown(self):
+        with self.assertRaises(ValueError):
+            Request.objects.period("decade")
+
     def test_unique_visits(self):
         # setUp
         Request.objects.create(ip="1.2.3.4", referer=settings.BASE_URL)
@@ -232,8 +398,24 @@ class RequestQuerySetTest(TestCase):
         self.assertEqual(1, qs.count())
 
     def test_attr_list(self):
-        attrs = Request.objects.all().attr_list("time")
-        self.assertEqual(self.request.time, attrs[0])
+        attrs = Request.objects.all().attr_list("timestamp")
+        self.assertEqual(self.request.timestamp, attrs[0])
 
     def test_search(self):
         Request.objects.all().search()
+
+    def test_search_is_case_insensitive(self):
+        Request.objects.create(ip="1.2.3.4", referer="https://www.Google.com/search?q=foo")
+        self.assertEqual(Request.objects.search().count(), 1)
+
+    def test_errors(self):
+        for status_code in (200, 302, 400, 404, 500):
+            Request.objects.create(ip="1.2.3.4", status_code=status_code)
+        self.assertEqual(sorted(Request.objects.errors().values_list("status_code", flat=True)), [400, 404, 500])
+
+    def test_contains(self):
+        Request.objects.create(ip="1.2.3.4", path="/Foo/bar/", referer="http://Example.com/", user_agent="Mozilla")
+        self.assertEqual(Request.objects.path_contains("foo/B").count(), 1)
+        self.assertEqual(Request.objects.referer_contains("example.COM").count(), 1)
+        self.assertEqual(Request.objects.user_agent_contains("zill").count(), 1)
+        self.assertEqual(Request.objects.path_contains("baz").count(), 0)
@@ -31,6 +31,7 @@ import mock
 from request import settings
 
 from metrics.models import Request
+from metrics.resolver import Resolver
 
 User = get_user_model()
 
@@ -108,12 +109,15 @@ class RequestTests(TestCase):
         )
         self.assertEqual(request.keywords, "querykit core data")
 
-    @mock.patch("metrics.models.gethostbyaddr", return_value=("foo.net", [], ["1.2.3.4"]))
+    @mock.patch("metrics.managers.resolver", Resolver(lookup=lambda ip: ("foo.net", [], [ip])))
     def test_hostname(self, *mocks):
         request = Request(ip="1.2.3.4")
         self.assertEqual(request.hostname, "foo.net")
 
-    @mock.patch("metrics.models.gethostbyaddr", side_effect=socket.herror(2, "Host name lookup failure"))
+    @mock.patch(
+        "metrics.managers.resolver",
+        Resolver(lookup=mock.Mock(side_effect=socket.herror(2, "Host name lookup failure"))),
+    )
     def test_hostname_invalid(self, *mocks):
         request = Request(ip="1.2.3.4")
         self.assertEqual(request.hostname, request.ip)
@@ -0,0 +1,150 @@
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from importlib import import_module
+from io import StringIO
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.db import connection, migrations
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+import mock
+
+from metrics.indexes import create_indexes, has_trigram_indexes, missing_indexes
+from metrics.models import Request
+from metrics.operations import OptionalRunSQL
+from metrics.traffic import Error404
+
+
+class OptionalRunSQLTest(TestCase):
+    def setUp(self):
+        self.operation = OptionalRunSQL("SELECT 1", reverse_sql="SELECT 2", setting="TRIGRAM_INDEXES")
+
+    def schema_editor(self, vendor):
+        schema_editor = mock.Mock(connection=mock.Mock(vendor=vendor, alias="default"))
+        schema_editor.connection.ops.prepare_sql_script.side_effect = lambda sql: [sql]
+        return schema_editor
+
+    def test_other_vendor(self):
+        schema_editor = self.schema_editor(connection.vendor if connection.vendor != "postgresql" else "sqlite")
+        self.operation.database_forwards("metrics", schema_editor, None, None)
+        self.operation.database_backwards("metrics", schema_editor, None, None)
+        schema_editor.execute.assert_not_called()
+
+    @mock.patch("metrics.settings.TRIGRAM_INDEXES", False)
+    def test_setting_disabled(self):
+        schema_editor = self.schema_editor("postgresql")
+        self.operation.database_forwards("metrics", schema_editor, None, None)
+        schema_editor.execute.assert_not_called()
+        # Reverting drops what may have been created before.
+        self.operation.database_backwards("metrics", schema_editor, None, None)
+        schema_editor.execute.assert_called_once_with("SELECT 2", params=None)
+
+    @mock.patch("metrics.settings.TRIGRAM_INDEXES", True)
+    def test_setting_enabled(self):
+        schema_editor = self.schema_editor("postgresql")
+        self.operation.database_forwards("metrics", schema_editor, None, None)
+        schema_editor.execute.assert_called_once_with("SELECT 1", params=None)
+
+    def test_without_setting(self):
+        operation = OptionalRunSQL(["SELECT 1"])
+        schema_editor = self.schema_editor("postgresql")
+        operation.database_forwards("metrics", schema_editor, None, None)
+        schema_editor.execute.assert_called_once_with("SELECT 1", params=None)
+
+    def test_deconstruct(self):
+        name, args, kwargs = self.operation.deconstruct()
+        self.assertEqual(name, "OptionalRunSQL")
+        self.assertEqual(kwargs["setting"], "TRIGRAM_INDEXES")
+        self.assertEqual(kwargs["vendor"], "postgresql")
+        self.assertIsInstance(OptionalRunSQL(**kwargs), migrations.RunSQL)
+
+
+class IndexesTest(TestCase):
+    def setUp(self):
+        has_trigram_indexes.cache_clear()
+        self.addCleanup(has_trigram_indexes.cache_clear)
+
+    def test_disabled(self):
+        self.assertEqual(missing_indexes("default"), {})
+        stdout = StringIO()
+        call_command("indexrequests", stdout=stdout)
+        self.assertEqual(stdout.getvalue(), "0 indexes created.\n")
+
+    @mock.patch("metrics.settings.TRIGRAM_INDEXES", True)
+    @mock.patch("metrics.indexes.get_index_names", return_value={"metrics_request_path_trgm"})
+    def test_missing(self, get_index_names):
+        postgresql = mock.MagicMock(vendor="postgresql")
+        with mock.patch("metrics.indexes.connections", {"default": postgresql}):
+            self.assertFalse(has_trigram_indexes("default"))
+            created = create_indexes("default")
+        self.assertEqual(created, ["metrics_request_referer_trgm", "metrics_request_user_agent_trgm"])
+        cursor = postgresql.cursor.return_value.__enter__.return_value
+        statements = [call.args[0] for call in cursor.execute.call_args_list]
+        self.assertEqual(len(statements), 4)
+        self.assertIn("CREATE INDEX CONCURRENTLY IF NOT EXISTS metrics_request_referer_trgm", statements[1])
+
+    @mock.patch("metrics.indexes.get_index_names")
+    def test_has_trigram_indexes(self, get_index_names):
+        get_index_names.return_value = {f"metrics_request_{field}_trgm" for field in ("path", "referer", "user_agent")}
+        with mock.patch("metrics.indexes.connections", {"default": mock.Mock(vendor="postgresql")}):
+            self.assertTrue(has_trigram_indexes("default"))
+            self.assertTrue(has_trigram_indexes("default"))
+        get_index_names.assert_called_once()
+
+
+@skipUnless(connection.vendor == "sqlite", "the partial indexes of the other databases are checked in test_query_plans")
+class ErrorIndexesTest(TestCase):
+    def setUp(self):
+        migration = import_module("metrics.migrations.0017_request_error_indexes")
+        self.indexes = list(migration.ERROR_INDEXES)
+        # The real schema editor can't run in the transaction of the test.
+        schema_editor = mock.Mock(connection=connection)
+        with connection.cursor() as cursor, mock.patch("metrics.settings.ERROR_INDEXES", True):
+            schema_editor.execute.side_effect = cursor.execute
+            for operation in migration.Migration.operations:
+                operation.database_forwards("metrics", schema_editor, None, None)
+
+    def plan(self, func):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {queries[0]['sql']}")
+            return " ".join(row[-1] for row in cursor.fetchall())
+
+    def test_created(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Request._meta.db_table)
+        self.assertTrue(set(self.indexes).issubset(constraints))
+
+    def test_used(self):
+        # The index condition has to be in the query: SQLite doesn't infer it
+        # from status_code = 404.
+        self.assertIn("metrics_request_error_path_idx", self.plan(lambda: Request.objects.errors().top("path")))
+        with mock.patch("metrics.settings.NORMALIZE_STRINGS", True):
+            self.assertIn(
+                "metrics_request_error_path_term_idx", self.plan(lambda: Request.objects.errors().top("path"))
+            )
+        self.assertNotIn("error", self.plan(lambda: Request.objects.filter(status_code=404).count()))
+        self.assertIn("metrics_request_error", self.plan(lambda: Error404().count(Request.objects.all())))
@@ -0,0 +1,188 @@
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from datetime import datetime, timezone
+
+from django.contrib.admin import site
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.auth import get_user_model
+from django.test import override_settings, RequestFactory, TestCase
+from django.urls import reverse
+import mock
+
+from metrics.admin import decode_cursor, encode_cursor, RequestAdmin
+from metrics.managers import estimate_count
+from metrics.models import Request
+from metrics.paginator import EstimatedCountPaginator
+
+
+class EstimateCountTest(TestCase):
+    def test_not_postgresql(self):
+        with mock.patch("metrics.managers.connections") as connections:
+            connections.__getitem__.return_value.vendor = "sqlite"
+            self.assertIsNone(estimate_count(Request.objects.all()))
+
+    def test_empty(self):
+        with mock.patch("metrics.managers.connections") as connections:
+            connections.__getitem__.return_value.vendor = "postgresql"
+            self.assertEqual(estimate_count(Request.objects.filter(pk__in=[])), 0)
+
+
+class EstimatedCountPaginatorTest(TestCase):
+    def setUp(self):
+        for _ in range(3):
+            Request.objects.create(ip="1.2.3.4")
+
+    def test_exact_count(self):
+        paginator = EstimatedCountPaginator(Request.objects.order_by("-timestamp"), 2)
+        self.assertEqual(paginator.count, 3)
+        self.assertFalse(paginator.is_estimated)
+
+    @mock.patch("metrics.managers.estimate_count", return_value=10)
+    def test_estimate_below_threshold(self, *mocks):
+        paginator = EstimatedCountPaginator(Request.objects.order_by("-timestamp"), 2)
+        self.assertEqual(paginator.count, 3)
+        self.assertFalse(paginator.is_estimated)
+
+    @mock.patch("metrics.managers.estimate_count", return_value=10**9)
+    def test_estimate_above_threshold(self, *mocks):
+        paginator = EstimatedCountPaginator(Request.objects.order_by("-timestamp"), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(paginator.count, 10**9)
+        self.assertTrue(paginator.is_estimated)
+        self.assertEqual(len(paginator.page(2).object_list), 1)
+
+
+class ChangeListTest(TestCase):
+    def setUp(self):
+        user = get_user_model()(username="foo", is_superuser=True, is_staff=True)
+        user.set_password("bar")
+        user.save()
+        self.client.login(username=user.username, password="bar")
+        Request.objects.create(ip="1.2.3.4")
+
+    def test_exact_count(self):
+        response = self.client.get(reverse("admin:metrics_request_changelist"))
+        self.assertFalse(response.context["cl"].result_count_is_estimated)
+        self.assertNotContains(response, "~1")
+
+    @mock.patch("metrics.managers.estimate_count", return_value=10**9)
+    def test_estimated_count(self, *mocks):
+        response = self.client.get(reverse("admin:metrics_request_changelist"))
+        cl = response.context["cl"]
+        self.assertTrue(cl.result_count_is_estimated)
+        self.assertTrue(cl.full_result_count_is_estimated)
+        self.assertEqual(cl.full_result_count, 10**9)
+        self.assertContains(response, f"~{10 ** 9}")
+
+    def test_changelist_class(self):
+        admin = RequestAdmin(Request, site)
+        request = RequestFactory().get("/")
+        self.assertEqual(admin.get_changelist(request).__name__, "RequestChangeList")
+
+    def test_heavy_columns_are_deferred(self):
+        response = self.client.get(reverse("admin:metrics_request_changelist"))
+        obj = response.context["cl"].result_list[0]
+        self.assertEqual(
+            obj.get_deferred_fields(),
+            {
+                "headers",
+                "query_string",
+                "full_path",
+                "referer",
+                "user_agent",
+                "language",
+                "full_path_term_id",
+                "referer_term_id",
+                "user_agent_term_id",
+                "language_term_id",
+                "header_set_id",
+            },
+        )
+
+
+class CursorTest(TestCase):
+    def test_round_trip(self):
+        obj = Request(pk=42, timestamp=datetime(2021, 5, 1, 10, 20, 30, 123456, tzinfo=timezone.utc))
+        self.assertEqual(decode_cursor(encode_cursor(obj)), (obj.timestamp, 42))
+
+    def test_invalid(self):
+        for value in ("", "foo", "2021-05-01T10:20:30_foo", "foo_42"):
+            with self.subTest(value=value), self.assertRaises(IncorrectLookupParameters):
+                decode_cursor(value)
+
+
+@mock.patch("metrics.settings.ADMIN_KEYSET_PAGINATION", True)
+@override_settings(USE_TZ=True)
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        user = get_user_model()(username="foo", is_superuser=True, is_staff=True)
+        user.set_password("bar")
+        user.save()
+        self.client.login(username=user.username, password="bar")
+        # Same timestamp for all the requests: the id breaks the ties.
+        timestamp = datetime(2021, 5, 1, tzinfo=timezone.utc)
+        self.ids = [Request.objects.create(ip="1.2.3.4", timestamp=timestamp).pk for _ in range(5)][::-1]
+        self.url = reverse("admin:metrics_request_changelist")
+        self.per_page = mock.patch.object(RequestAdmin, "list_per_page", 2)
+        self.per_page.start()
+        self.addCleanup(self.per_page.stop)
+
+    def get(self, url):
+        cl = self.client.get(url).context["cl"]
+        return cl, [obj.pk for obj in cl.result_list]
+
+    def test_pages(self):
+        cl, ids = self.get(self.url)
+        self.assertEqual(ids, self.ids[:2])
+        self.assertIsNone(cl.keyset_previous_url)
+
+        cl, ids = self.get(self.url + cl.keyset_next_url)
+        self.assertEqual(ids, self.ids[2:4])
+        self.assertIsNotNone(cl.keyset_previous_url)
+
+        cl, ids = self.get(self.url + cl.keyset_next_url)
+        self.assertEqual(ids, self.ids[4:])
+        self.assertIsNone(cl.keyset_next_url)
+
+        cl, ids = self.get(self.url + cl.keyset_previous_url)
+        self.assertEqual(ids, self.ids[2:4])
+
+        cl, ids = self.get(self.url + cl.keyset_previous_url)
+        self.assertEqual(ids, self.ids[:2])
+        self.assertIsNone(cl.keyset_previous_url)
+        self.assertIsNotNone(cl.keyset_next_url)
+
+    def test_cursor_is_not_a_filter(self):
+        cl, ids = self.get(self.url + "?ip=1.2.3.4")
+        cl, ids = self.get(self.url + cl.keyset_next_url)
+        self.assertEqual(ids, self.ids[2:4])
+        self.assertIn("ip=1.2.3.4", cl.keyset_next_url)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url + "?after=foo")
+        self.assertRedirects(response, self.url + "?e=1", fetch_redirect_response=False)
+
+    def test_custom_ordering(self):
+        cl, ids = self.get(self.url + "?o=1")
+        self.assertFalse(cl.keyset)
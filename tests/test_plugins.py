@@ -21,8 +21,11 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import threading
+
 from django.core import exceptions
 from django.test import TestCase
+from django.utils import timezone, translation
 import mock
 
 from metrics import plugins
@@ -107,6 +110,91 @@ class PluginBaseTest(TestCase):
         self.assertEqual(plugin.render(), "<h2>Test Plugin</h2>\n\n")
 
 
+class PluginRendererTest(TestCase):
+    def setUp(self):
+        self.threads = []
+
+        class NamedPlugin(plugins.Plugin):
+            def template_context(plugin):
+                self.threads.append(threading.current_thread().name)
+                return {}
+
+        self.plugins = [type(name, (NamedPlugin,), {})() for name in ("First", "Second", "Third")]
+
+    def test_render_sequentially(self):
+        renderer = plugins.PluginRenderer()
+        rendered = renderer.render(self.plugins)
+        self.assertEqual(rendered, ["<h2>First</h2>\n\n", "<h2>Second</h2>\n\n", "<h2>Third</h2>\n\n"])
+        self.assertEqual(self.threads, [threading.current_thread().name] * 3)
+
+    def test_render_on_threads(self):
+        renderer = plugins.PluginRenderer(threads=2)
+        with mock.patch("metrics.plugins.connections") as connections:
+            rendered = renderer.render(self.plugins)
+        self.assertEqual(rendered, ["<h2>First</h2>\n\n", "<h2>Second</h2>\n\n", "<h2>Third</h2>\n\n"])
+        self.assertTrue(all(name.startswith("metrics-plugins") for name in self.threads))
+        self.assertEqual(connections.close_all.call_count, 3)
+
+    def test_timeout(self):
+        release = threading.Event()
+
+        class Slow(plugins.Plugin):
+            def template_context(self):
+                release.wait(5)
+                return {}
+
+        renderer = plugins.PluginRenderer(threads=2, timeout=0.1)
+        try:
+            rendered = renderer.render([Slow(), self.plugins[0]])
+        finally:
+            release.set()
+        self.assertIn("<h2>Slow</h2>", rendered[0])
+        self.assertIn("Not computed within 0.1 seconds.", rendered[0])
+        self.assertEqual(rendered[1], "<h2>First</h2>\n\n")
+
+    def test_language_and_time_zone(self):
+        context = []
+
+        class Localized(plugins.Plugin):
+            def template_context(self):
+                context.append((translation.get_language(), str(timezone.get_current_timezone())))
+                return {}
+
+        renderer = plugins.PluginRenderer(threads=2)
+        with translation.override("de"), timezone.override("Europe/Rome"):
+            renderer.render([Localized()])
+        self.assertEqual(context, [("de", "Europe/Rome")])
+
+    def test_timeout_keeps_thread(self):
+        release = threading.Event()
+
+        class Slow(plugins.Plugin):
+            def template_context(self):
+                release.wait(5)
+                return {}
+
+        renderer = plugins.PluginRenderer(threads=1, timeout=0.1)
+        try:
+            rendered = renderer.render([Slow(), self.plugins[0]])
+            # The only thread is still busy with the plugin timed out.
+            self.assertIn("Not computed within 0.1 seconds.", renderer.render([self.plugins[1]])[0])
+        finally:
+            release.set()
+        self.assertIn("Not computed within 0.1 seconds.", rendered[0])
+        self.assertIn("Not computed within 0.1 seconds.", rendered[1])
+        self.assertEqual(self.threads, [])
+        self.assertEqual(renderer.render([self.plugins[2]]), ["<h2>Third</h2>\n\n"])
+
+    def test_error(self):
+        class Broken(plugins.Plugin):
+            def template_context(self):
+                raise ValueError("broken")
+
+        renderer = plugins.PluginRenderer(threads=2)
+        with self.assertRaises(ValueError):
+            renderer.render([Broken()])
+
+
 class LatestRequestsTest(TestCase):
     def test_template_context(self):
         plugin = plugins.LatestRequests()
@@ -169,6 +257,15 @@ class TopBrowsersTest(TestCase):
         context = self.plugin.template_context()
         self.assertIn("browsers", context)
 
+    def test_render(self):
+        user_agent = "Mozilla/5.0 (X11; Linux x86_64; rv:91.0) Gecko/20100101 Firefox/91.0"
+        Request.objects.create(ip="1.2.3.4", user_agent=user_agent)
+        plugin = plugins.TopBrowsers()
+        plugin.qs = Request.objects.all()
+        html = plugin.render()
+        self.assertIn("<svg ", html)
+        self.assertIn("Firefox (1)", html)
+
 
 class ActiveUsersTest(TestCase):
     def test_template_context(self):
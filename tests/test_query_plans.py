@@ -0,0 +1,205 @@
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Plans of the queries on the requests table, checked on PostgreSQL only.
+
+The queries are captured while running the querysets, plugins, traffic
+modules and admin views, and each one is explained on a generated dataset.
+Sequential scans are disabled, as they would be the cheapest plan on a
+small table: one left in a plan means no index can serve the query.
+"""
+
+import datetime
+from importlib import import_module
+import json
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+import mock
+
+from metrics import plugins
+from metrics.generator import generate_requests
+from metrics.models import Request
+from metrics.traffic import Error, Error404, modules
+
+ROWS = 20000
+# Maximum total cost of a plan for a month of requests (about 750 when
+# written), and for a year.
+COST_BUDGET = 2000
+YEAR_COST_BUDGET = 4000
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}")
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+def nodes(plan):
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from nodes(child)
+
+
+def has_time_range(plan):
+    conditions = ("Index Cond", "Recheck Cond", "Filter")
+    return any("timestamp" in node.get(key, "") for node in nodes(plan) for key in conditions)
+
+
+@skipUnless(connection.vendor == "postgresql", "query plans are checked on PostgreSQL")
+class QueryPlanTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        generate_requests(ROWS, days=365, seed=0)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE metrics_request")
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SET enable_seqscan = off")
+
+    def assertPlans(self, func, budget=COST_BUDGET, whole_table=False):
+        """
+        Run ``func`` and check the plans of its queries on the requests table,
+        but the ones without a time range if ``whole_table`` is true.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        statements = [
+            query["sql"]
+            for query in queries
+            if query["sql"].lstrip().upper().startswith("SELECT") and Request._meta.db_table in query["sql"]
+        ]
+        self.assertTrue(statements, "no query on the requests table")
+        for sql in statements:
+            plan = explain(sql)
+            if whole_table and not has_time_range(plan):
+                continue
+            with self.subTest(sql=sql):
+                scans = [node for node in nodes(plan) if node["Node Type"] == "Seq Scan"]
+                self.assertEqual([node.get("Relation Name") for node in scans], [], "sequential scan")
+                self.assertLessEqual(plan["Total Cost"], budget, "over the cost budget")
+
+    def test_time_ranges(self):
+        today = datetime.date.today()
+        for name, qs in (
+            ("year", Request.objects.year(today.year)),
+            ("month", Request.objects.month(date=today)),
+            ("week", Request.objects.week(str(today.year), today.strftime("%U"))),
+            ("day", Request.objects.day(date=today)),
+            ("today", Request.objects.today()),
+            ("this_week", Request.objects.this_week()),
+            ("this_month", Request.objects.this_month()),
+            ("this_year", Request.objects.this_year()),
+            ("between", Request.objects.between(timezone.now() - datetime.timedelta(days=7), timezone.now())),
+        ):
+            with self.subTest(name):
+                budget = YEAR_COST_BUDGET if name in ("year", "this_year") else COST_BUDGET
+                self.assertPlans(lambda: (qs.count(), list(qs[:100])), budget)
+
+    def test_filters(self):
+        qs = Request.objects.this_month()
+        for name, filtered in (
+            ("unique_visits", qs.unique_visits()),
+            ("search", qs.search()),
+            ("humans", qs.humans()),
+            ("bots", qs.bots()),
+            ("path_contains", qs.path_contains("blog")),
+            ("referer_contains", qs.referer_contains("google")),
+            ("user_agent_contains", qs.user_agent_contains("firefox")),
+        ):
+            with self.subTest(name):
+                self.assertPlans(lambda: (filtered.count(), list(filtered[:100])))
+
+    def test_humans_partial_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            Request.objects.this_month().humans().count()
+        plan = explain(queries[0]["sql"])
+        self.assertIn("metrics_request_human_ts_idx", [node.get("Index Name") for node in nodes(plan)])
+
+    def test_error_indexes(self):
+        migration = import_module("metrics.migrations.0017_request_error_indexes")
+        with connection.cursor() as cursor:
+            for name, column in migration.ERROR_INDEXES.items():
+                cursor.execute(f"CREATE INDEX {name} ON metrics_request ({column}) WHERE {migration.ERROR_CONDITION}")
+            cursor.execute("ANALYZE metrics_request")
+        qs = Request.objects.this_month()
+        plugin = plugins.TopErrorPaths()
+        plugin.qs, plugin.frame = qs, None
+        for name, func, index in (
+            ("Error", lambda: Error().count(qs), "metrics_request_error_ts_idx"),
+            ("Error404", lambda: Error404().count(qs.humans()), "metrics_request_error_ts_idx"),
+            ("TopErrorPaths", plugin.render, "metrics_request_error_ts_idx"),
+            # Any of the path indexes finds the error rows, the planner picks
+            # the smallest one.
+            ("all errors", lambda: Request.objects.errors().top("path"), "metrics_request_error_path"),
+        ):
+            with self.subTest(name), CaptureQueriesContext(connection) as queries:
+                func()
+                plan = explain(queries[0]["sql"])
+                names = [node.get("Index Name") or "" for node in nodes(plan)]
+                self.assertTrue(any(name.startswith(index) for name in names), names)
+        with mock.patch("metrics.settings.NORMALIZE_STRINGS", True), CaptureQueriesContext(connection) as queries:
+            Request.objects.errors().top("path")
+        plan = explain(queries[0]["sql"])
+        self.assertIn("metrics_request_error_path_term_idx", [node.get("Index Name") for node in nodes(plan)])
+
+    def test_top(self):
+        for field in ("path", "referer", "user_agent"):
+            with self.subTest(field):
+                self.assertPlans(lambda: Request.objects.this_month().top(field))
+
+    def test_plugins(self):
+        qs = Request.objects.this_month().order_by("timestamp")
+        for plugin in plugins.plugins.plugins:
+            plugin.qs, plugin.frame = qs, None
+            # TrafficInformation counts the requests of the year, and of the
+            # whole table in its "all" column.
+            information = isinstance(plugin, plugins.TrafficInformation)
+            with self.subTest(plugin.__class__.__name__):
+                self.assertPlans(plugin.render, YEAR_COST_BUDGET if information else COST_BUDGET, information)
+
+    def test_traffic_graph(self):
+        now = timezone.now()
+        days = [
+            (day, Request.objects.between(day - datetime.timedelta(days=1), day))
+            for day in (now, now - datetime.timedelta(days=2))
+        ]
+        self.assertPlans(lambda: modules.graph(days))
+
+    def test_admin_changelist(self):
+        user = get_user_model().objects.create(username="admin", is_superuser=True, is_staff=True)
+        self.client.force_login(user)
+        url = reverse("admin:metrics_request_changelist")
+        self.assertPlans(lambda: self.client.get(url))
+        with mock.patch("metrics.settings.ADMIN_KEYSET_PAGINATION", True):
+            self.assertPlans(lambda: self.client.get(url))
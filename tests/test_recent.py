@@ -0,0 +1,205 @@
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from io import StringIO
+import os
+import shutil
+import socket
+import tempfile
+
+from django.contrib.admin import site
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import Http404, HttpResponse
+from django.test import RequestFactory, TestCase
+import mock
+
+from metrics import plugins, recent
+from metrics.admin import RequestAdmin
+from metrics.middleware import RequestMiddleware
+from metrics.models import Request
+
+User = get_user_model()
+
+
+def make_request(path="/foo", **kwargs):
+    return Request(path=path, method="GET", status_code=200, ip="1.2.3.4", **kwargs)
+
+
+class RingBufferTest(TestCase):
+    def test_records(self):
+        buffer = recent.RingBuffer(3)
+        request = make_request(user_id=7)
+        buffer.append(request, 0.25)
+        buffer.append(make_request("/bar"))
+        first, second = buffer.records()
+        self.assertEqual((first.seq, first.path, first.user_id, first.duration), (1, "/foo", 7, 0.25))
+        self.assertEqual((first.method, first.status_code, first.ip), ("GET", 200, "1.2.3.4"))
+        self.assertAlmostEqual(first.timestamp, request.timestamp.timestamp())
+        self.assertEqual((second.seq, second.path, second.user_id, second.duration), (2, "/bar", None, None))
+
+    def test_wraps_around(self):
+        buffer = recent.RingBuffer(3)
+        for index in range(5):
+            buffer.append(make_request(f"/{index}"))
+        self.assertEqual([record.path for record in buffer.records()], ["/2", "/3", "/4"])
+        self.assertEqual([record.path for record in buffer.records(after=3)], ["/3", "/4"])
+        self.assertEqual([record.path for record in buffer.records(limit=1)], ["/4"])
+        self.assertEqual(buffer.records(after=5), [])
+
+    def test_truncated(self):
+        buffer = recent.RingBuffer(1)
+        buffer.append(make_request("/" + "é" * 100))
+        path = buffer.records()[0].path
+        self.assertEqual(len(path.encode()), 127)
+        self.assertTrue(path.startswith("/éé"))
+
+    def test_clear(self):
+        buffer = recent.RingBuffer(3)
+        buffer.append(make_request())
+        buffer.clear()
+        self.assertEqual(buffer.records(), [])
+
+
+class ServerTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(dir=os.environ.get("TMPDIR"))
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.buffer = recent.RingBuffer(10)
+        self.server = recent.Server(self.buffer, self.directory)
+
+    def test_query(self):
+        self.buffer.append(make_request("/foo"))
+        self.buffer.append(make_request("/bar"))
+        self.server.start()
+        self.assertEqual(recent.sockets(self.directory), [self.server.path])
+        records = recent.query(self.server.path)
+        self.assertEqual([record["path"] for record in records], ["/foo", "/bar"])
+        self.assertEqual(records[0]["pid"], os.getpid())
+        records = recent.query(self.server.path, after=1)
+        self.assertEqual([record["path"] for record in records], ["/bar"])
+
+    def test_private(self):
+        self.server.start()
+        self.assertEqual(os.stat(self.server.path).st_mode & 0o777, 0o600)
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(self.server.path)])
+
+    def test_poll(self):
+        self.buffer.append(make_request("/foo"))
+        self.server.start()
+        # Left by a dead process.
+        stale = os.path.join(self.directory, "1.sock")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.bind(stale)
+        # The latest record of a dead process with the same id.
+        seen = {(self.server.path, 0, 0): 5}
+        self.assertEqual([record["path"] for record in recent.poll(self.directory, seen)], ["/foo"])
+        self.assertEqual(seen, {recent.socket_id(self.server.path): 1})
+        self.assertFalse(os.path.exists(stale))
+        self.assertEqual(recent.poll(self.directory, seen), [])
+
+    def test_started_once(self):
+        with mock.patch.object(recent.threading, "Thread") as Thread:
+            self.server.start()
+            self.server.start()
+        Thread.return_value.start.assert_called_once_with()
+
+    def test_no_directory(self):
+        self.assertEqual(recent.sockets(os.path.join(self.directory, "foo")), [])
+
+
+@mock.patch("metrics.settings.RECENT_REQUESTS", 10)
+class CaptureTest(TestCase):
+    def setUp(self):
+        self.buffer = recent.RingBuffer(10)
+        patcher = mock.patch.object(recent, "buffer", self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_middleware(self):
+        RequestMiddleware(lambda request: HttpResponse())(RequestFactory().get("/foo"))
+        (record,) = self.buffer.records()
+        self.assertEqual((record.path, record.status_code), ("/foo", 200))
+        self.assertIsNotNone(record.duration)
+
+    @mock.patch("metrics.settings.ONLY_ERRORS", True)
+    @mock.patch("metrics.settings.COUNTERS", False)
+    def test_not_stored(self):
+        RequestMiddleware(lambda request: HttpResponse())(RequestFactory().get("/foo"))
+        self.assertEqual(len(self.buffer.records()), 1)
+        self.assertEqual(Request.objects.count(), 0)
+
+    def test_latest(self):
+        user = User.objects.create(username="foo")
+        for path in ("/foo", "/bar"):
+            self.buffer.append(make_request(path, user_id=user.pk))
+        with self.assertNumQueries(1):
+            requests = recent.latest(5)
+            self.assertEqual([request.user for request in requests], [user, user])
+        self.assertEqual([request.path for request in requests], ["/bar", "/foo"])
+        self.assertIsNone(requests[0].id)
+
+    @mock.patch("metrics.settings.LATEST_REQUESTS_SOURCE", "buffer")
+    def test_latest_requests_plugin(self):
+        self.buffer.append(make_request("/buffered"))
+        plugin = plugins.LatestRequests()
+        with self.assertNumQueries(0):
+            html = plugin.render()
+        self.assertIn("/buffered", html)
+
+    def test_admin_view(self):
+        self.buffer.append(make_request("/buffered"))
+        response = RequestAdmin(Request, site).recent(RequestFactory().get("/foo"))
+        self.assertContains(response, "/buffered")
+        self.assertContains(response, f"Recent requests of process {os.getpid()}")
+
+
+class RecentViewDisabledTest(TestCase):
+    def test_disabled(self):
+        with self.assertRaises(Http404):
+            RequestAdmin(Request, site).recent(RequestFactory().get("/foo"))
+
+
+class TailRequestsTest(TestCase):
+    def test_not_configured(self):
+        with self.assertRaises(CommandError):
+            call_command("tailrequests")
+
+    def test_tail(self):
+        directory = tempfile.mkdtemp(dir=os.environ.get("TMPDIR"))
+        self.addCleanup(shutil.rmtree, directory)
+        buffer = recent.RingBuffer(10)
+        for index in range(3):
+            buffer.append(make_request(f"/{index}", user_id=index or None), 0.002)
+        recent.Server(buffer, directory).start()
+        # A process that is gone.
+        open(os.path.join(directory, "1.sock"), "w").close()
+
+        stdout = StringIO()
+        with mock.patch("metrics.settings.RECENT_REQUESTS_SOCKETS", directory):
+            call_command("tailrequests", lines=2, stdout=stdout)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn(f"[{os.getpid()}] GET /1 200 1.2.3.4 user=1 2.0ms", lines[0])
+        self.assertTrue(lines[1].endswith("GET /2 200 1.2.3.4 user=2 2.0ms"))
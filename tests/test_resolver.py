@@ -0,0 +1,149 @@
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from datetime import timedelta
+import socket
+import threading
+import time
+
+from django.test import TestCase
+from django.utils import timezone
+import mock
+
+from metrics.models import Hostname, Request
+from metrics.resolver import Resolver
+
+HOSTS = {"1.2.3.4": "foo.net", "5.6.7.8": "bar.org"}
+
+
+class StubLookup:
+    def __init__(self, hosts=HOSTS, event=None):
+        self.hosts = hosts
+        self.event = event
+        self.calls = []
+
+    def __call__(self, ip):
+        self.calls.append(ip)
+        if self.event is not None:
+            self.event.wait(5)
+        if ip not in self.hosts:
+            raise socket.herror(1, "Unknown host")
+        return self.hosts[ip], [], [ip]
+
+
+class ResolverTest(TestCase):
+    def test_resolve(self):
+        lookup = StubLookup()
+        resolver = Resolver(lookup=lookup)
+        self.assertEqual(resolver.resolve("1.2.3.4"), "foo.net")
+        self.assertEqual(resolver.resolve("9.9.9.9"), "")
+        self.assertEqual(resolver.resolve("1.2.3.4"), "foo.net")
+        self.assertEqual(lookup.calls, ["1.2.3.4", "9.9.9.9"])
+
+    def test_resolve_many(self):
+        resolver = Resolver(lookup=StubLookup(), max_workers=2)
+        self.assertEqual(
+            resolver.resolve_many(["1.2.3.4", "5.6.7.8", "9.9.9.9", "1.2.3.4"]),
+            {"1.2.3.4": "foo.net", "5.6.7.8": "bar.org", "9.9.9.9": ""},
+        )
+
+    def test_timeout(self):
+        event = threading.Event()
+        lookup = StubLookup(event=event)
+        resolver = Resolver(lookup=lookup, timeout=0.01)
+        self.assertEqual(resolver.resolve_many(["1.2.3.4"]), {})
+        self.assertIsNone(resolver.resolve("1.2.3.4"))
+        event.set()
+        resolver._executor.shutdown(wait=True)
+        # Completed after the timeout, but cached, and looked up only once.
+        self.assertEqual(resolver.cached(["1.2.3.4"]), {"1.2.3.4": "foo.net"})
+        self.assertEqual(lookup.calls, ["1.2.3.4"])
+
+    def test_timeout_per_batch(self):
+        event = threading.Event()
+        resolver = Resolver(lookup=StubLookup(event=event), timeout=0.05, max_workers=1)
+        start = time.monotonic()
+        self.assertEqual(resolver.resolve_many(["1.2.3.4", "5.6.7.8", "9.9.9.9"]), {})
+        # Not one timeout per round of workers.
+        self.assertLess(time.monotonic() - start, 0.1)
+        event.set()
+        resolver._executor.shutdown(wait=True)
+
+    def test_max_pending(self):
+        event = threading.Event()
+        lookup = StubLookup(event=event)
+        resolver = Resolver(lookup=lookup, timeout=0.01, max_workers=1, max_pending=1)
+        self.assertEqual(resolver.resolve_many(["1.2.3.4"]), {})
+        self.assertEqual(resolver.resolve_many(["5.6.7.8"]), {})
+        event.set()
+        resolver._executor.shutdown(wait=True)
+        self.assertEqual(lookup.calls, ["1.2.3.4"])
+
+    def test_ttl(self):
+        resolver = Resolver(lookup=StubLookup(), ttl=60)
+        resolver.store("1.2.3.4", "foo.net", ttl=0)
+        self.assertEqual(resolver.cached(["1.2.3.4"]), {})
+        resolver.store("1.2.3.4", "foo.net")
+        self.assertEqual(resolver.cached(["1.2.3.4"]), {"1.2.3.4": "foo.net"})
+
+    def test_max_size(self):
+        resolver = Resolver(lookup=StubLookup(), max_size=2)
+        resolver.store("1.1.1.1", "a")
+        resolver.store("2.2.2.2", "b")
+        resolver.cached(["1.1.1.1"])
+        resolver.store("3.3.3.3", "c")
+        self.assertEqual(resolver.cached(["1.1.1.1", "2.2.2.2", "3.3.3.3"]), {"1.1.1.1": "a", "3.3.3.3": "c"})
+
+
+class HostnameManagerTest(TestCase):
+    def setUp(self):
+        self.lookup = StubLookup()
+        patcher = mock.patch("metrics.managers.resolver", Resolver(lookup=self.lookup))
+        self.resolver = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_resolve_stores_hostnames(self):
+        self.assertEqual(Hostname.objects.resolve(["1.2.3.4", "9.9.9.9"]), {"1.2.3.4": "foo.net", "9.9.9.9": ""})
+        self.assertEqual(dict(Hostname.objects.values_list("ip", "hostname")), {"1.2.3.4": "foo.net", "9.9.9.9": ""})
+
+    def test_resolve_from_table(self):
+        Hostname.objects.create(ip="1.2.3.4", hostname="cached.net")
+        self.assertEqual(Hostname.objects.resolve(["1.2.3.4"]), {"1.2.3.4": "cached.net"})
+        self.assertEqual(self.lookup.calls, [])
+        # Now in the process cache.
+        with self.assertNumQueries(0):
+            self.assertEqual(Hostname.objects.resolve(["1.2.3.4"]), {"1.2.3.4": "cached.net"})
+
+    def test_resolve_expired(self):
+        Hostname.objects.create(ip="1.2.3.4", hostname="old.net", timestamp=timezone.now() - timedelta(days=2))
+        self.assertEqual(Hostname.objects.resolve(["1.2.3.4"]), {"1.2.3.4": "foo.net"})
+        self.assertEqual(Hostname.objects.get(pk="1.2.3.4").hostname, "foo.net")
+
+    def test_request_hostname(self):
+        self.assertEqual(Request(ip="1.2.3.4").hostname, "foo.net")
+        self.assertEqual(Request(ip="9.9.9.9").hostname, "9.9.9.9")
+
+    def test_expired(self):
+        Hostname.objects.create(ip="1.2.3.4", hostname="old.net", timestamp=timezone.now() - timedelta(days=2))
+        Hostname.objects.create(ip="5.6.7.8", hostname="new.net")
+        self.assertEqual([hostname.ip for hostname in Hostname.objects.expired()], ["1.2.3.4"])
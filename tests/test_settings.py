@@ -49,7 +49,7 @@ MIDDLEWARE_CLASSES = [
     "django.contrib.messages.middleware.MessageMiddleware",
 ]
 
-if django.VERSION >= (1, 7):
+if (1, 7) <= django.VERSION < (2, 0):
     MIDDLEWARE_CLASSES += [
         "django.contrib.auth.middleware.SessionAuthenticationMiddleware",
     ]
@@ -0,0 +1,120 @@
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import multiprocessing
+import os
+import tempfile
+
+from django.test import SimpleTestCase
+
+from metrics import counters
+from metrics.sharedstore import SharedStore, STRIPE
+
+KEY = ("foo_total", (("method", "GET"),))
+
+
+def increment(path, times):
+    store = SharedStore(path, max_keys=16, max_stripes=8)
+    for _ in range(times):
+        store.inc(KEY)
+    store.close()
+
+
+class SharedStoreTest(SimpleTestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, self.path)
+
+    def store(self, **kwargs):
+        kwargs.setdefault("max_keys", 16)
+        kwargs.setdefault("max_stripes", 8)
+        store = SharedStore(self.path, **kwargs)
+        self.addCleanup(store.close)
+        return store
+
+    def test_inc(self):
+        store = self.store()
+        store.inc(KEY)
+        store.inc(KEY, 2.5)
+        store.inc(("bar_total", ()))
+        self.assertEqual(store.snapshot(), {KEY: 3.5, ("bar_total", ()): 1})
+
+    def test_snapshot_from_another_store(self):
+        self.store().inc(KEY)
+        reader = self.store()
+        self.assertEqual(reader.snapshot(), {KEY: 1})
+        self.assertIsNone(reader._stripe)
+
+    def test_processes(self):
+        context = multiprocessing.get_context("fork")
+        workers = [context.Process(target=increment, args=(self.path, 100)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.store().snapshot(), {KEY: 400})
+
+    def test_dead_process_stripe_is_reused(self):
+        store = self.store()
+        store._open()
+        dead = multiprocessing.get_context("fork").Process(target=os._exit, args=(0,))
+        dead.start()
+        dead.join()
+        for stripe in range(store.max_stripes - 1):
+            STRIPE.pack_into(store._mmap, store.stripes_offset + stripe * STRIPE.size, dead.pid)
+        store.inc(KEY)
+        self.assertEqual(store._stripe, 0)
+
+    def test_shared_stripe_when_full(self):
+        store = self.store(max_stripes=2)
+        store._open()
+        STRIPE.pack_into(store._mmap, store.stripes_offset, os.getppid())
+        store.inc(KEY)
+        self.assertIsNone(store._stripe)
+        self.assertEqual(store.snapshot(), {KEY: 1})
+
+    def test_generation_reset(self):
+        self.store(generation="1").inc(KEY)
+        self.assertEqual(self.store(generation="1").snapshot(), {KEY: 1})
+        self.assertEqual(self.store(generation="2").snapshot(), {})
+
+    def test_reset(self):
+        store = self.store()
+        other = self.store()
+        store.inc(KEY)
+        other.reset()
+        self.assertEqual(store.snapshot(), {})
+        store.inc(("bar_total", ()))
+        self.assertEqual(other.snapshot(), {("bar_total", ()): 1})
+
+    def test_too_many_keys(self):
+        store = self.store(max_keys=1)
+        store.inc(KEY)
+        store.inc(("bar_total", ()))
+        self.assertEqual(store.snapshot(), {KEY: 1})
+
+    def test_registry(self):
+        registry = counters.Registry(self.store())
+        registry.counter("foo", "Foo help.", ("method",)).inc(method="GET")
+        self.assertIn('foo_total{method="GET"} 1\n', counters.generate(registry))
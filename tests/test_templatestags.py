@@ -22,22 +22,34 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 from django import template
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import QuerySet
 from django.test import TestCase
+import mock
 
+from metrics.models import Request
 from metrics.templatetags.metrics_admin import pie_chart
 from metrics.templatetags.metrics_tag import active_users, ActiveUserNode
 
 
 class RequestAdminPieChart(TestCase):
     def test_pie_chart(self):
-        inventory = ["apple", "lemon", "apple", "orange", "lemon", "lemon"]
+        inventory = [("lemon", 3), ("apple", 2), ("orange", 1)]
         result = pie_chart(inventory)
-        self.assertTrue(result.startswith("//chart.googleapis.com/chart?"))
-        self.assertIn("chs=440x190", result)
+        self.assertTrue(result.startswith("<svg "))
+        self.assertIn('width="440" height="190"', result)
+        self.assertNotIn("googleapis", result)
 
         result = pie_chart(inventory, width=100, height=100)
-        self.assertTrue(result.startswith("//chart.googleapis.com/chart?"))
-        self.assertIn("chs=100x100", result)
+        self.assertIn('width="100" height="100"', result)
+
+    def test_in_template(self):
+        t = template.Template("{% load metrics_admin %}{% pie_chart items 300 100 %}{% bar_chart items %}")
+        result = t.render(template.Context({"items": [("<b>", 1)]}))
+        self.assertEqual(result.count("<svg "), 2)
+        self.assertIn("&lt;b&gt;", result)
+        self.assertNotIn("<b>", result)
 
 
 # TODO: It's unused but add a parser: template.debug.DebugParser
@@ -73,6 +85,25 @@ class RequestTagActiveUserNodeTest(TestCase):
         node = ActiveUserNode(None, token)
         self.assertEqual("", node.render({}))
 
+    def test_render_is_cached(self):
+        cache.clear()
+        user = get_user_model().objects.create(username="foo")
+        Request.objects.create(user=user, ip="1.2.3.4")
+        node = ActiveUserNode(None, template.base.Token(2, "active_users in 5 minutes as users"))
+        context = {}
+        node.render(context)
+        self.assertEqual(context["users"], [user])
+        with self.assertNumQueries(0):
+            node.render(context)
+        self.assertEqual(context["users"], [user])
+
+    @mock.patch("metrics.templatetags.metrics_tag.settings.ACTIVE_USERS_CACHE_TIMEOUT", 0)
+    def test_render_without_cache(self):
+        node = ActiveUserNode(None, template.base.Token(2, "active_users"))
+        context = {}
+        node.render(context)
+        self.assertIsInstance(context["user_list"], QuerySet)
+
 
 class RequestTagActiveUsersTest(TestCase):
     def test_active_users(self):
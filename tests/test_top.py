@@ -0,0 +1,171 @@
+# Copyright (C) 2009-2021, Kyle Fuller and Mariusz Felisiak
+# Copyright (C) 2016-2021, Raffaele Salmaso <raffaele@salmaso.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY KYLE FULLER ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL KYLE FULLER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from io import StringIO
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+import mock
+
+from metrics import counters, recent, top
+from metrics.models import Request
+
+
+def make_request(path="/foo", status_code=200, ip="1.2.3.4"):
+    return Request(path=path, method="GET", status_code=status_code, ip=ip)
+
+
+class WindowTest(TestCase):
+    def test_add(self):
+        window = top.Window(2)
+        window.add(200, "/foo", "1.2.3.4", 0.01)
+        window.add(404, "/bar", "1.2.3.4", 0.02)
+        window.add(500, "/foo", count=2)
+        self.assertEqual((window.requests, window.errors, window.server_errors), (4, 3, 2))
+        self.assertEqual(window.rate(), 2)
+        self.assertEqual(window.share(window.errors), 0.75)
+        self.assertEqual(window.routes.most_common(1), [("/foo", 3)])
+        self.assertEqual(window.ips, {"1.2.3.4": 2})
+
+    def test_percentile(self):
+        window = top.Window(1)
+        self.assertIsNone(window.percentile(50))
+        for duration in range(1, 101):
+            window.add(200, "/", duration=duration / 1000)
+        self.assertEqual(window.percentile(50), 0.05)
+        self.assertEqual(window.percentile(99), 0.099)
+        self.assertEqual(window.percentile(100), 0.1)
+
+    def test_empty(self):
+        window = top.Window(0)
+        self.assertEqual((window.rate(), window.share(0)), (0.0, 0.0))
+        lines = top.render(window, top.DatabaseSource())
+        self.assertIn("Requests/s: 0.0", lines[0])
+        self.assertIn("  (not known by the database)", lines)
+
+
+class CounterSourceTest(TestCase):
+    def test_poll(self):
+        registry = counters.Registry(counters.LocalStore())
+        total = registry.counter("metrics_requests", "", ("method", "route", "status_code"))
+        duration = registry.histogram("metrics_request_duration_seconds", "", ("method", "route"), (0.1, 1))
+        total.inc(method="GET", route="old/", status_code=200)
+        source = top.CounterSource(registry.store)
+
+        total.inc(method="GET", route="foo/", status_code=200)
+        total.inc(2, method="GET", route="bar/", status_code=500)
+        duration.observe(0.05, method="GET", route="foo/")
+        duration.observe(0.5, method="GET", route="bar/")
+        duration.observe(5, method="GET", route="bar/")
+        window = top.Window(1)
+        source.poll(window)
+        self.assertEqual((window.requests, window.server_errors), (3, 2))
+        self.assertEqual(window.routes, {"foo/": 1, "bar/": 2})
+        self.assertIsNone(window.ips)
+        self.assertEqual(window.percentile(50), 1)
+        self.assertEqual(window.percentile(90), float("inf"))
+
+        window = top.Window(1)
+        source.poll(window)
+        self.assertEqual(window.requests, 0)
+
+
+class BufferSourceTest(TestCase):
+    def test_poll(self):
+        directory = tempfile.mkdtemp(dir=os.environ.get("TMPDIR"))
+        self.addCleanup(shutil.rmtree, directory)
+        buffer = recent.RingBuffer(10)
+        buffer.append(make_request("/old"))
+        recent.Server(buffer, directory).start()
+        source = top.BufferSource(directory)
+
+        buffer.append(make_request("/foo"), 0.01)
+        buffer.append(make_request("/bar", 404, "5.6.7.8"), 0.03)
+        window = top.Window(1)
+        source.poll(window)
+        self.assertEqual((window.requests, window.errors), (2, 1))
+        self.assertEqual(window.ips, {"1.2.3.4": 1, "5.6.7.8": 1})
+        self.assertEqual(window.percentile(50), 0.01)
+
+        window = top.Window(1)
+        source.poll(window)
+        self.assertEqual(window.requests, 0)
+
+
+class DatabaseSourceTest(TestCase):
+    def test_poll(self):
+        make_request("/old").save()
+        source = top.DatabaseSource()
+        make_request("/foo").save()
+        make_request("/bar", 404).save()
+        window = top.Window(1)
+        with self.assertNumQueries(1):
+            source.poll(window)
+        self.assertEqual((window.requests, window.errors), (2, 1))
+        self.assertEqual(window.routes, {"/foo": 1, "/bar": 1})
+        self.assertFalse(window.truncated)
+        self.assertEqual(source.last_id, Request.objects.latest("id").id)
+
+        window = top.Window(1)
+        source.poll(window)
+        self.assertEqual(window.requests, 0)
+
+    def test_truncated(self):
+        source = top.DatabaseSource(batch_size=1)
+        make_request("/foo").save()
+        make_request("/bar").save()
+        window = top.Window(1)
+        source.poll(window)
+        self.assertEqual((window.requests, window.truncated), (1, True))
+        self.assertIn("Requests/s: 1.0+", top.render(window, source)[0])
+
+
+class GetSourceTest(TestCase):
+    def test_auto(self):
+        self.assertIsInstance(top.get_source(), top.DatabaseSource)
+        with mock.patch("metrics.settings.SHARED_COUNTERS", "/tmp/counters"):
+            self.assertIsInstance(top.get_source(), top.CounterSource)
+
+    def test_not_configured(self):
+        for name in ("counters", "buffers"):
+            with self.assertRaises(ValueError):
+                top.get_source(name)
+
+
+class MetricsTopTest(TestCase):
+    def test_top(self):
+        stdout = StringIO()
+        with mock.patch.object(top.DatabaseSource, "poll", lambda source, window: window.add(200, "/foo/", "1.2.3.4")):
+            call_command("metricstop", interval=0, iterations=2, stdout=stdout)
+        output = stdout.getvalue()
+        self.assertEqual(output.count("Source: database"), 2)
+        self.assertIn("/foo/", output)
+        self.assertNotIn("\x1b[", output)
+
+    def test_not_configured(self):
+        with self.assertRaises(CommandError):
+            call_command("metricstop", source="buffers", iterations=1)
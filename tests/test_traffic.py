@@ -152,13 +152,17 @@ class ModuleUniqueVisitorTest(TestCase):
 
 class ModuleUserTest(TestCase):
     def test_count(self):
+        for user_id in (1, 1, None):
+            Request.objects.create(path="/", ip="1.2.3.4", user_id=user_id)
         module = traffic.User()
         queries = Request.objects.all()
-        module.count(queries)
+        self.assertEqual(module.count(queries), 2)
 
 
 class ModuleUniqueUserTest(TestCase):
     def test_count(self):
+        for user_id in (1, 1, None):
+            Request.objects.create(path="/", ip="1.2.3.4", user_id=user_id)
         module = traffic.UniqueUser()
         queries = Request.objects.all()
-        module.count(queries)
+        self.assertEqual(module.count(queries), 1)